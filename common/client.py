@@ -1,9 +1,21 @@
+import asyncio
 import enum
 import logging
+import os
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3 import Retry
+# The HTTP libraries are imported on first use, keeping them out of the web process's startup
+if TYPE_CHECKING:
+    import aiohttp
+    import requests
+
+# Defaults for every upstream client, in seconds and connections per host
+CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 30))
+POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', 20))
+KEEPALIVE_TIMEOUT = float(os.getenv('UPSTREAM_KEEPALIVE_TIMEOUT', 60))
 
 
 class HttpMethods(enum.Enum):
@@ -34,6 +46,85 @@ class HttpMethods(enum.Enum):
         return self == HttpMethods.DELETE
 
 
+def session_stats(session: 'requests.Session') -> dict:
+    """
+    Requests sent and connections opened by the connection pools of a requests session.
+
+    Every request that did not open a connection reused a kept-alive one.
+    """
+    sent = opened = 0
+    for adapter in {id(adapter): adapter for adapter in session.adapters.values()}.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                sent += pool.num_requests
+                opened += pool.num_connections
+    return {'requests': sent, 'connections': opened, 'reused': max(0, sent - opened)}
+
+
+async def _close_on_shutdown(close: Callable[[], Awaitable]):
+    try:
+        yield
+    finally:
+        await close()
+
+
+async def _start(generator):
+    await generator.__anext__()
+
+
+def close_on_loop_shutdown(close: Callable[[], Awaitable]):
+    """
+    Await ``close()`` when the running event loop shuts down.
+
+    ``asyncio.run`` and asgiref's ``async_to_sync``, which serves async views under WSGI with a new loop per
+    call, finalize a loop's suspended async generators before closing it. ``close`` runs in one of them.
+    :return: Returns the generator, which the caller must keep alive as long as the loop (the loop only holds a
+        weak reference to it).
+    """
+    generator = _close_on_shutdown(close)
+    asyncio.get_running_loop().create_task(_start(generator))
+    return generator
+
+
+class ClientRegistry:
+    """
+    Process-wide registry of long-lived upstream clients.
+
+    Clients keep pooled keep-alive connections, so building one per request would pay a TCP and TLS
+    handshake on every upstream call. ``get`` builds a client on first use and hands the same instance
+    to every thread afterwards.
+    """
+
+    _clients = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name: str, factory: Callable[[], Any]) -> Any:
+        client = cls._clients.get(name)
+        if client is None:
+            with cls._lock:
+                client = cls._clients.get(name)
+                if client is None:
+                    client = cls._clients[name] = factory()
+        return client
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Connection reuse counters of every registered client."""
+        return {name: client.stats() for name, client in list(cls._clients.items()) if hasattr(client, 'stats')}
+
+    @classmethod
+    def reset(cls):
+        """Drop every client so the next ``get`` builds new ones, closing the sync sessions."""
+        with cls._lock:
+            clients, cls._clients = cls._clients, {}
+        for client in clients.values():
+            if isinstance(client, BaseRequestClient):
+                client.session.close()
+
+
 class BaseRequestClient:
 
     base_url = None
@@ -44,10 +135,15 @@ class BaseRequestClient:
         # "Content-Type": "multipart/form-data"
     }
 
-    def __init__(self, retries=3, backoff_factor=0.3, status_force_list=(500, 502, 504, 429)):
+    def __init__(
+            self, retries=3, backoff_factor=0.3, status_force_list=(500, 502, 504, 429),
+            timeout=None, pool_size=None
+    ):
         self.retries = retries
         self.backoff_factor = backoff_factor
         self.status_force_list = status_force_list
+        self.timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.pool_size = pool_size or POOL_SIZE
 
         self.session = self.get_session()
 
@@ -58,6 +154,10 @@ class BaseRequestClient:
         return f"{self.base_url}{endpoint.format(**kwargs)}"
 
     def get_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3 import Retry
+
         session = requests.Session()
         retry = Retry(
             total=self.retries,
@@ -66,11 +166,19 @@ class BaseRequestClient:
             backoff_factor=self.backoff_factor,
             status_forcelist=self.status_force_list
         )
-        adapter = HTTPAdapter(max_retries=retry)
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=self.pool_size)
         session.mount('http://', adapter)
         session.mount('https://', adapter)
         return session
 
+    @classmethod
+    def shared(cls):
+        """The process-wide instance of this client, see ``ClientRegistry``."""
+        return ClientRegistry.get(cls.__name__, cls)
+
+    def stats(self) -> dict:
+        return session_stats(self.session)
+
     def get_default_headers(self):
         return self.headers.copy()
 
@@ -83,6 +191,8 @@ class BaseRequestClient:
         :param params The parameters to use for GET query parameters.
         :param headers: Extra headers to add to request.
         """
+        import requests
+
         try:
             # add logs
             self.logger.info(f"Sending {method.value.upper()} request to {url} with data {data} and parameters {params}")
@@ -97,6 +207,7 @@ class BaseRequestClient:
                     url,
                     headers=all_headers,
                     params=params,
+                    timeout=self.timeout,
                 )
             elif method.is_post:
                 response = self.session.post(
@@ -104,6 +215,7 @@ class BaseRequestClient:
                     headers=all_headers,
                     data=data,
                     params=params,
+                    timeout=self.timeout,
                 )
             elif method.is_put:
                 response = self.session.put(
@@ -111,6 +223,7 @@ class BaseRequestClient:
                     headers=all_headers,
                     data=data,
                     params=params,
+                    timeout=self.timeout,
                 )
             elif method.is_patch:
                 response = self.session.patch(
@@ -118,12 +231,14 @@ class BaseRequestClient:
                     headers=all_headers,
                     data=data,
                     params=params,
+                    timeout=self.timeout,
                 )
             elif method.is_delete:
                 response = self.session.delete(
                     url,
                     headers=all_headers,
                     params=params,
+                    timeout=self.timeout,
                 )
             else:
                 raise ValueError(f"Invalid method: {method}")
@@ -152,3 +267,148 @@ class BaseRequestClient:
         """Send POST request."""
         url = self._get_url(endpoint, **kwargs)
         return self.send(url, HttpMethods.POST, data=data)
+
+
+class AsyncBaseRequestClient:
+    """Asyncio counterpart of BaseRequestClient.
+
+    Keeps one pooled keep-alive aiohttp session per event loop, closed when that loop shuts down, and retries
+    failed requests with the same retry count, backoff factor and status list semantics as the urllib3 Retry
+    used by the sync client.
+    """
+
+    base_url = None
+
+    headers = BaseRequestClient.headers
+
+    def __init__(
+            self, retries=3, backoff_factor=0.3, status_force_list=(500, 502, 504, 429),
+            timeout=None, pool_size=None, keepalive_timeout=None
+    ):
+        import aiohttp
+
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_force_list = status_force_list
+        connect, read = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.timeout = aiohttp.ClientTimeout(connect=connect, sock_read=read)
+        self.pool_size = pool_size or POOL_SIZE
+        self.keepalive_timeout = keepalive_timeout or KEEPALIVE_TIMEOUT
+
+        self._sessions = weakref.WeakKeyDictionary()
+        self._closers = weakref.WeakKeyDictionary()
+        self._stats = {'requests': 0, 'connections': 0}
+        self._trace = aiohttp.TraceConfig()
+        self._trace.on_request_start.append(self._count('requests'))
+        self._trace.on_connection_create_end.append(self._count('connections'))
+
+        self.logger = logging.getLogger("routing.client")
+
+    def _get_url(self, endpoint:str, **kwargs):
+        """Get url for endpoint."""
+        return f"{self.base_url}{endpoint.format(**kwargs)}"
+
+    def get_session(self) -> 'aiohttp.ClientSession':
+        """Get the pooled session for the running event loop, creating it on first use."""
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, trace_configs=[self._trace])
+            self._sessions[loop] = session
+            self._closers[loop] = close_on_loop_shutdown(self.close)
+        return session
+
+    @classmethod
+    def shared(cls):
+        """The process-wide instance of this client, see ``ClientRegistry``."""
+        return ClientRegistry.get(cls.__name__, cls)
+
+    def _count(self, counter: str):
+        async def count(session, context, params):
+            self._stats[counter] += 1
+        return count
+
+    def stats(self) -> dict:
+        """Requests sent and connections opened across all event loops, as in ``session_stats``."""
+        sent, opened = self._stats['requests'], self._stats['connections']
+        return {'requests': sent, 'connections': opened, 'reused': max(0, sent - opened)}
+
+    async def close(self):
+        """Close the session of the running event loop."""
+        loop = asyncio.get_running_loop()
+        self._closers.pop(loop, None)
+        session = self._sessions.pop(loop, None)
+        if session is not None:
+            await session.close()
+
+    def get_default_headers(self):
+        return self.headers.copy()
+
+    def get_backoff_time(self, attempt: int) -> float:
+        """Backoff before retry number ``attempt``, matching urllib3's Retry (no wait before the first retry)."""
+        if attempt <= 1:
+            return 0
+        return self.backoff_factor * (2 ** (attempt - 1))
+
+    async def send(self, url: str, method: HttpMethods, data=None, params=None, headers=None):
+        """Generic method for sending request.
+
+        :param url The url to send request to.
+        :param method The http method to use for request.
+        :param data The data to use for POST request
+        :param params The parameters to use for GET query parameters.
+        :param headers: Extra headers to add to request.
+        """
+        import aiohttp
+
+        self.logger.info(f"Sending {method.value.upper()} request to {url} with data {data} and parameters {params}")
+
+        all_headers = self.get_default_headers()
+
+        if headers:
+            all_headers.update(headers)
+
+        session = self.get_session()
+        attempt = 0
+        while True:
+            try:
+                async with session.request(
+                        method.name, url, headers=all_headers, data=data, params=params
+                ) as response:
+                    if response.status in self.status_force_list and attempt < self.retries:
+                        attempt += 1
+                        self.logger.warning("Retrying %s after status %s (attempt %s)", url, response.status, attempt)
+                        await asyncio.sleep(self.get_backoff_time(attempt))
+                        continue
+
+                    if response.status >= 400:
+                        self.logger.error("Response: %s", await response.text())
+                    response.raise_for_status()
+                    json_response = await response.json(content_type=None)
+                    self.logger.info("Received response from %s. Response: %s", url, json_response)
+                    return json_response
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries:
+                    self.logger.error("Error sending request. Error: %s", e)
+                    raise e
+                attempt += 1
+                self.logger.warning("Retrying %s after error %s (attempt %s)", url, e, attempt)
+                await asyncio.sleep(self.get_backoff_time(attempt))
+
+            except Exception as e:
+                self.logger.error("Error sending request. Error: %s", e)
+                raise e
+
+    async def get(self, endpoint, params, headers=None, **kwargs):
+        """Send GET request."""
+        url = self._get_url(endpoint, **kwargs)
+        return await self.send(url, HttpMethods.GET, params=params, headers=headers)
+
+    async def post(self, endpoint, data, headers=None, **kwargs):
+        """Send POST request."""
+        url = self._get_url(endpoint, **kwargs)
+        return await self.send(url, HttpMethods.POST, data=data, headers=headers)
@@ -0,0 +1,17 @@
+import logging
+import os
+
+
+class LogFileHandler(logging.FileHandler):
+    """
+    FileHandler that opens its file on the first record, creating the log directory then.
+
+    Keeps filesystem work out of settings import and logging configuration, so it is not on the startup path.
+    """
+
+    def __init__(self, filename, mode='a', encoding=None, delay=True, errors=None):
+        super().__init__(filename, mode=mode, encoding=encoding, delay=delay, errors=errors)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
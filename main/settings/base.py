@@ -51,6 +51,9 @@ djsettings.installed_apps += [
     'routing'
 ]
 
+# First, so the Server-Timing total covers the rest of the middleware
+djsettings.middleware = ['routing.middleware.ServerTimingMiddleware', *djsettings.middleware]
+
 djsettings.root_urlconf = 'main.urls'
 
 djsettings.wsgi_application = 'main.wsgi.application'
@@ -58,10 +61,6 @@ djsettings.wsgi_application = 'main.wsgi.application'
 
 djsettings.static_root = BASE_DIR / "static"
 
-# Create logs directory if it doesn't exist
-(BASE_DIR / 'logs').mkdir(exist_ok=True)
-
-
 djsettings.rest_framework = {
     'TEST_REQUEST_RENDERER_CLASSES': [
         'rest_framework.renderers.MultiPartRenderer',
@@ -15,17 +15,17 @@ LOGGING = {
             'formatter': 'json',
         },
         'file': {
-            'class': 'logging.FileHandler',
+            'class': 'common.log.LogFileHandler',
             'filename': BASE_DIR / 'logs' / 'app.log',
             'formatter': 'json',
         },
         'client_file': {
-            'class': 'logging.FileHandler',
+            'class': 'common.log.LogFileHandler',
             'filename': BASE_DIR / 'logs' / 'client.log',
             'formatter': 'json',
         },
         'route_file': {
-            'class': 'logging.FileHandler',
+            'class': 'common.log.LogFileHandler',
             'filename': BASE_DIR / 'logs' / 'route.log',
             'formatter': 'json',
         },
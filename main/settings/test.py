@@ -0,0 +1,20 @@
+from .base import djsettings
+from .logging import LOGGING
+
+djsettings.debug = False
+
+djsettings.secret_key = 'django-insecure-test-only'
+
+djsettings.allowed_hosts = ["*"]
+
+djsettings.logging = LOGGING
+
+# Tests flush and bump cache entries, so they must never run against the shared Redis at REDIS_URL
+djsettings.caches = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'route-planner-tests',
+    }
+}
+
+djsettings.register()
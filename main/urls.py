@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from routing.views import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('routing.urls')),
     path('api-auth/', include('rest_framework.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
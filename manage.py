@@ -6,7 +6,11 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings.dev')
+    if sys.argv[1:2] == ['test']:
+        # Even when .env selects another module; --settings still takes precedence
+        os.environ['DJANGO_SETTINGS_MODULE'] = 'main.settings.test'
+    else:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings.dev')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class RoutingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'routing'
+
+    def ready(self):
+        # Map the station snapshot before a preloading server forks, so its workers share the pages
+        from routing.services.index import StationIndex
+        StationIndex.preload()
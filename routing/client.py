@@ -1,14 +1,85 @@
+import asyncio
+import enum
 import hashlib
+import os
 from typing import Optional
-from django.core.cache import cache
-from common.client import BaseRequestClient
-from .data import Coordinate, RouteData
+from routing.utils.cache import tiered_cache
+from routing.utils.timing import record_cache
+from common.client import BaseRequestClient, AsyncBaseRequestClient
+from .data import Coordinate, RouteData, RouteGeometry
+
+
+class RoutingEngineType(enum.IntEnum):
+    OSRM = 0
+    LOCAL_GRAPH = 1
+
+    @property
+    def is_osrm(self):
+        return self == RoutingEngineType.OSRM
+
+    @property
+    def is_local_graph(self):
+        return self == RoutingEngineType.LOCAL_GRAPH
+
+    @classmethod
+    def from_env(cls) -> 'RoutingEngineType':
+        """Engine selected by the ``ROUTING_ENGINE`` environment variable (``osrm`` or ``local_graph``)."""
+        name = os.getenv('ROUTING_ENGINE', 'osrm')
+        try:
+            return cls[name.upper()]
+        except KeyError:
+            engines = ', '.join(engine.name.lower() for engine in cls)
+            raise ValueError(f"Invalid ROUTING_ENGINE {name!r}, expected one of: {engines}") from None
+
+
+def get_local_engine(graph_path: str = None):
+    """Load the local graph engine for ``graph_path`` or the ``ROUTING_GRAPH_PATH`` environment variable."""
+    from .graph import LocalGraphEngine
+
+    graph_path = graph_path or os.getenv('ROUTING_GRAPH_PATH')
+    if not graph_path:
+        raise ValueError("ROUTING_GRAPH_PATH must be set to use the local graph routing engine")
+    return LocalGraphEngine.load(graph_path)
 
 
 class RoutingClient(BaseRequestClient):
 
     base_url = 'https://router.project-osrm.org/route/v1/'
 
+    params = {
+        'overview': 'full',
+        'geometries': 'geojson',
+        'steps': 'false'
+    }
+
+    def __init__(self, *args, engine_type: RoutingEngineType = None, graph_path: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engine_type = engine_type if engine_type is not None else RoutingEngineType.from_env()
+        self.engine = get_local_engine(graph_path) if self.engine_type.is_local_graph else None
+
+    @staticmethod
+    def get_coordinates(from_location: Coordinate, to_location: Coordinate) -> str:
+        return f"{from_location.longitude},{from_location.latitude};{to_location.longitude},{to_location.latitude}"
+
+    @staticmethod
+    def get_cache_key(coords: str) -> str:
+        return f"route:{hashlib.md5(coords.encode()).hexdigest()}"
+
+    @staticmethod
+    def parse_route(response: dict, from_location: Coordinate, to_location: Coordinate) -> Optional[RouteData]:
+        """Build route data from an OSRM route response, or None if no route was found."""
+        if response.get('code') == 'Ok' and response.get('routes'):
+            route = response['routes'][0]
+            return RouteData(
+                distance=route['distance'] / 1609.34,  # Convert to miles
+                duration=route['duration'] / 60,  # Convert to minutes
+                # geometry=route['geometry'],
+                coordinates=RouteGeometry.from_lonlat(route['geometry']['coordinates']),
+                start=from_location,
+                finish=to_location
+            )
+
+        return None
 
     def get_route(self, *, from_location: Coordinate, to_location: Coordinate) -> Optional[RouteData]:
         """
@@ -17,35 +88,62 @@ class RoutingClient(BaseRequestClient):
         :param to_location: The finish location for route.
         :return: Returns a route data if route was found, else None.
         """
-        coords = f"{from_location.longitude},{from_location.latitude};{to_location.longitude},{to_location.latitude}"
-        cache_key = f"route:{hashlib.md5(coords.encode()).hexdigest()}"
-        
-        cached = cache.get(cache_key)
+        if self.engine is not None:
+            # Local routing is deterministic and fast enough not to need caching
+            return self.engine.get_route(from_location=from_location, to_location=to_location)
+
+        coords = self.get_coordinates(from_location, to_location)
+        cache_key = self.get_cache_key(coords)
+
+        cached = tiered_cache.get(cache_key)
+        record_cache(bool(cached))
         if cached:
-            return RouteData(**cached)
+            return RouteData.from_cache(cached)
 
-        endpoint = f'driving/{coords}'
+        response = self.get(f'driving/{coords}', params=self.params)
 
-        params = {
-            'overview': 'full',
-            'geometries': 'geojson',
-            'steps': 'false'
-        }
+        route_data = self.parse_route(response, from_location, to_location)
+        if route_data:
+            tiered_cache.set(cache_key, route_data.to_cache(), timeout=3600)
 
-        response = self.get(endpoint, params=params)
+        return route_data
 
-        if response.get('code') == 'Ok' and response.get('routes'):
-            route = response['routes'][0]
-            route_data = RouteData(
-                distance=route['distance'] / 1609.34,  # Convert to miles
-                duration=route['duration'] / 60,  # Convert to minutes
-                # geometry=route['geometry'],
-                coordinates=[Coordinate(latitude=lat, longitude=lon) for lon, lat in route['geometry']['coordinates']],
-                start=from_location,
-                finish=to_location
+
+class AsyncRoutingClient(AsyncBaseRequestClient):
+    """Asyncio variant of RoutingClient sharing its cache entries."""
+
+    base_url = RoutingClient.base_url
+
+    def __init__(self, *args, engine_type: RoutingEngineType = None, graph_path: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engine_type = engine_type if engine_type is not None else RoutingEngineType.from_env()
+        self.engine = get_local_engine(graph_path) if self.engine_type.is_local_graph else None
+
+    async def get_route(self, *, from_location: Coordinate, to_location: Coordinate) -> Optional[RouteData]:
+        """
+        Get route data for specified locations.
+        :param from_location: The location route is starting from.
+        :param to_location: The finish location for route.
+        :return: Returns a route data if route was found, else None.
+        """
+        if self.engine is not None:
+            # The search is CPU bound pure Python, so keep it off the event loop
+            return await asyncio.to_thread(
+                self.engine.get_route, from_location=from_location, to_location=to_location
             )
-            
-            cache.set(cache_key, route_data.__dict__, timeout=3600)
-            return route_data
 
-        return None
+        coords = RoutingClient.get_coordinates(from_location, to_location)
+        cache_key = RoutingClient.get_cache_key(coords)
+
+        cached = await tiered_cache.aget(cache_key)
+        record_cache(bool(cached))
+        if cached:
+            return RouteData.from_cache(cached)
+
+        response = await self.get(f'driving/{coords}', params=RoutingClient.params)
+
+        route_data = RoutingClient.parse_route(response, from_location, to_location)
+        if route_data:
+            await tiered_cache.aset(cache_key, route_data.to_cache(), timeout=3600)
+
+        return route_data
@@ -1,9 +1,12 @@
 import dataclasses
+import struct
 from collections import namedtuple
-from typing import List, Optional, Any
+from typing import Iterable, List, Optional, Any, Union
 from math import radians, sin, cos, sqrt, atan2
 
-from geopy import Point
+import numpy as np
+
+from routing.utils.geo import douglas_peucker
 
 
 class Coordinate(namedtuple('Coordinate', ['latitude', 'longitude'])):
@@ -30,6 +33,7 @@ class Coordinate(namedtuple('Coordinate', ['latitude', 'longitude'])):
 
 
     def as_point(self):
+        from geopy import Point
         return Point(self.latitude, self.longitude)
 
 
@@ -43,15 +47,108 @@ class SamplePoint:
         return Coordinate(self.latitude, self.longitude)
 
 
+class RouteGeometry:
+    """
+    Route polyline stored as one contiguous ``(n, 2)`` float64 array of latitude/longitude rows.
+
+    Indexing and iteration yield ``Coordinate``s, so it can stand in for a list of coordinates, while the
+    sampler, corridor query and map work on the array directly. ``to_bytes``/``from_bytes`` round-trip the
+    raw buffer; decoding is a zero-copy ``np.frombuffer`` view.
+    """
+
+    __slots__ = ('array',)
+
+    def __init__(self, array):
+        self.array = np.ascontiguousarray(array, dtype=np.float64).reshape(-1, 2)
+
+    @classmethod
+    def of(cls, coordinates: Union['RouteGeometry', Iterable]) -> 'RouteGeometry':
+        """Wrap coordinates (anything with latitude/longitude, or (lat, lon) pairs) unless already a geometry."""
+        if isinstance(coordinates, cls):
+            return coordinates
+        return cls([(c.latitude, c.longitude) if hasattr(c, 'latitude') else c for c in coordinates])
+
+    @classmethod
+    def from_lonlat(cls, positions) -> 'RouteGeometry':
+        """Build from GeoJSON-ordered ``[lon, lat]`` positions."""
+        return cls(np.asarray(positions, dtype=np.float64).reshape(-1, 2)[:, ::-1])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'RouteGeometry':
+        return cls(np.frombuffer(data, dtype=np.float64))
+
+    def to_bytes(self) -> bytes:
+        return self.array.tobytes()
+
+    def to_wkb(self) -> bytes:
+        """Little-endian WKB LineString (x = longitude, y = latitude)."""
+        return struct.pack('<BII', 1, 2, len(self)) + np.ascontiguousarray(self.array[:, ::-1]).tobytes()
+
+    def simplify(self, tolerance: float) -> 'RouteGeometry':
+        """Douglas-Peucker simplified copy, ``tolerance`` in degrees."""
+        return RouteGeometry(self.array[douglas_peucker(self.latitudes, self.longitudes, tolerance)])
+
+    def tolist(self) -> List[List[float]]:
+        """``[[lat, lon], ...]`` for JSON."""
+        return self.array.tolist()
+
+    @property
+    def latitudes(self) -> np.ndarray:
+        return self.array[:, 0]
+
+    @property
+    def longitudes(self) -> np.ndarray:
+        return self.array[:, 1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RouteGeometry(self.array[index])
+        lat, lon = self.array[index].tolist()
+        return Coordinate(lat, lon)
+
+    def __iter__(self):
+        return (Coordinate(lat, lon) for lat, lon in self.array.tolist())
+
+    def __eq__(self, other):
+        if not isinstance(other, RouteGeometry):
+            return NotImplemented
+        return np.array_equal(self.array, other.array)
+
+    def __repr__(self):
+        return f"RouteGeometry({len(self)} points)"
+
+
 @dataclasses.dataclass(frozen=True)
 class RouteData:
-    coordinates: List[Coordinate]
+    coordinates: RouteGeometry
     distance: float
     duration: float = None
     start: Coordinate = None
     finish: Coordinate = None
     geometry: Any = None
 
+    def __post_init__(self):
+        # Lists of coordinates are accepted and stored as a RouteGeometry
+        object.__setattr__(self, 'coordinates', RouteGeometry.of(self.coordinates))
+
+    def to_cache(self) -> dict:
+        """Cache payload with the geometry as a raw float64 buffer instead of pickled tuples."""
+        return {**self.__dict__, 'coordinates': self.coordinates.to_bytes()}
+
+    @classmethod
+    def from_cache(cls, data: dict) -> 'RouteData':
+        coordinates = data['coordinates']
+        if isinstance(coordinates, bytes):
+            coordinates = RouteGeometry.from_bytes(coordinates)
+        return cls(**{**data, 'coordinates': coordinates})
+
 
 @dataclasses.dataclass(frozen=True)
 class OptimizedRouteResult:
@@ -60,7 +157,7 @@ class OptimizedRouteResult:
     gallons: float
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class FuelStop:
     id: str
     name: str
@@ -98,3 +195,101 @@ class FuelStop:
             'gallons': self.gallons,
             'cost': self.cost
         }
+
+
+class StopTable:
+    """
+    Fuel stops stored column-wise, one numpy array per field.
+
+    Candidate indexing and the optimizer only read the numeric columns, and ``FuelStop`` records are
+    created with ``stop`` for the few stops a plan ends up using. Tables are never modified in place, so
+    lookups can share one between concurrent plans. A missing ``distance_from_start`` is NaN and a
+    missing ``segment_index`` is -1.
+    """
+
+    __slots__ = (
+        'ids', 'names', 'addresses', 'cities', 'states',
+        'prices', 'latitudes', 'longitudes', 'distances_from_point', 'distances_from_start', 'segment_indices'
+    )
+
+    def __init__(
+            self, *,
+            ids, names, addresses, cities, states, prices, latitudes, longitudes, distances_from_point,
+            distances_from_start=None,
+            segment_indices=None
+    ):
+        self.ids = np.asarray(ids, dtype=object)
+        self.names = np.asarray(names, dtype=object)
+        self.addresses = np.asarray(addresses, dtype=object)
+        self.cities = np.asarray(cities, dtype=object)
+        self.states = np.asarray(states, dtype=object)
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.distances_from_point = np.asarray(distances_from_point, dtype=np.float64)
+        count = len(self.ids)
+        self.distances_from_start = (
+            np.full(count, np.nan) if distances_from_start is None
+            else np.asarray(distances_from_start, dtype=np.float64)
+        )
+        self.segment_indices = (
+            np.full(count, -1, dtype=np.int64) if segment_indices is None
+            else np.asarray(segment_indices, dtype=np.int64)
+        )
+
+    @classmethod
+    def from_stops(cls, stops: Iterable['FuelStop']) -> 'StopTable':
+        stops = list(stops)
+        return cls(
+            ids=[s.id for s in stops],
+            names=[s.name for s in stops],
+            addresses=[s.address for s in stops],
+            cities=[s.city for s in stops],
+            states=[s.state for s in stops],
+            prices=[s.price for s in stops],
+            latitudes=[s.latitude for s in stops],
+            longitudes=[s.longitude for s in stops],
+            distances_from_point=[s.distance_from_point for s in stops],
+            distances_from_start=[np.nan if s.distance_from_start is None else s.distance_from_start for s in stops],
+            segment_indices=[-1 if s.segment_index is None else s.segment_index for s in stops]
+        )
+
+    def take(self, indices) -> 'StopTable':
+        """Table of the rows at ``indices`` (an index array or boolean mask), in that order."""
+        return StopTable(**{name: getattr(self, name)[indices] for name in self.__slots__})
+
+    def stop(self, i: int, **changes) -> 'FuelStop':
+        """A new ``FuelStop`` for row ``i``, with any fields overridden by ``changes``."""
+        city, state = self.cities[i], self.states[i]
+        distance_from_start = float(self.distances_from_start[i])
+        segment_index = int(self.segment_indices[i])
+        fields = dict(
+            id=self.ids[i],
+            name=self.names[i],
+            address=self.addresses[i],
+            city=city,
+            state=state,
+            price=float(self.prices[i]),
+            location=f"{city}, {state}, USA",
+            latitude=float(self.latitudes[i]),
+            longitude=float(self.longitudes[i]),
+            distance_from_point=float(self.distances_from_point[i]),
+            distance_from_start=None if np.isnan(distance_from_start) else distance_from_start,
+            segment_index=None if segment_index < 0 else segment_index
+        )
+        fields.update(changes)
+        return FuelStop(**fields)
+
+    def by_segment(self, count: int) -> List[List['FuelStop']]:
+        """One list of stops per segment index ``0..count - 1``, for a table sorted by segment index."""
+        bounds = np.searchsorted(self.segment_indices, np.arange(count + 1))
+        return [[self.stop(j) for j in range(bounds[i], bounds[i + 1])] for i in range(count)]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (self.stop(i) for i in range(len(self)))
+
+    def __repr__(self):
+        return f"StopTable({len(self)} stops)"
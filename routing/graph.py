@@ -0,0 +1,294 @@
+import heapq
+import logging
+import threading
+from math import radians, sin, cos, sqrt, asin, inf
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from .data import Coordinate, RouteData, RouteGeometry
+from .utils.geo import EARTH_RADIUS_MILES, MILES_PER_DEGREE_LAT, degrees_for_miles, haversine_miles
+
+logger = logging.getLogger('routing')
+
+
+class RoadGraph:
+    """
+    Directed road graph stored in compact arrays.
+
+    Nodes are parallel latitude/longitude arrays. Edges are kept in CSR form (``offsets`` into ``targets``)
+    with per-edge length in miles and duration in minutes, plus a reverse CSR for backward searches.
+    Node ids are also sorted by a lat/lon grid cell key, as in ``StationIndex``, for ``nearest_node``.
+    Graphs are saved to and loaded from ``.npz`` files.
+    """
+
+    default_speed_mph = 55  # Used when edge durations are not given
+    cell_size = 0.1  # Node grid cell size in degrees
+
+    def __init__(self, *, latitudes, longitudes, offsets, targets, lengths, durations):
+        self.latitudes = np.ascontiguousarray(latitudes, dtype=np.float64)
+        self.longitudes = np.ascontiguousarray(longitudes, dtype=np.float64)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        self.targets = np.ascontiguousarray(targets, dtype=np.int32)
+        self.lengths = np.ascontiguousarray(lengths, dtype=np.float64)
+        self.durations = np.ascontiguousarray(durations, dtype=np.float64)
+
+        sources = np.repeat(np.arange(len(self.latitudes), dtype=np.int32), np.diff(self.offsets))
+        order = np.argsort(self.targets, kind='stable')
+        in_degree = np.bincount(self.targets, minlength=len(self.latitudes))
+        self.reverse_offsets = np.concatenate(([0], np.cumsum(in_degree))).astype(np.int64)
+        self.reverse_sources = np.ascontiguousarray(sources[order], dtype=np.int32)
+        self.reverse_edges = np.ascontiguousarray(order, dtype=np.int64)
+
+        keys = self._cell_keys(self.latitudes, self.longitudes)
+        self.cell_order = np.argsort(keys, kind='stable')
+        self.cell_keys = keys[self.cell_order]
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    @classmethod
+    def from_edges(
+            cls, *,
+            latitudes,
+            longitudes,
+            sources,
+            targets,
+            lengths=None,
+            durations=None
+    ) -> 'RoadGraph':
+        """
+        Build a graph from node coordinates and a directed edge list.
+
+        Missing lengths default to the straight-line distance between the edge's nodes and missing durations
+        to the length driven at ``default_speed_mph``.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+
+        if lengths is None:
+            lengths = haversine_miles(latitudes[sources], longitudes[sources], latitudes[targets], longitudes[targets])
+        lengths = np.asarray(lengths, dtype=np.float64)
+        if durations is None:
+            durations = lengths / cls.default_speed_mph * 60
+        durations = np.asarray(durations, dtype=np.float64)
+
+        order = np.argsort(sources, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=len(latitudes)))))
+
+        return cls(
+            latitudes=latitudes,
+            longitudes=longitudes,
+            offsets=offsets,
+            targets=targets[order],
+            lengths=lengths[order],
+            durations=durations[order]
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'RoadGraph':
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in (
+                'latitudes', 'longitudes', 'offsets', 'targets', 'lengths', 'durations'
+            )})
+
+    def save(self, path: Union[str, Path]):
+        np.savez(
+            path,
+            latitudes=self.latitudes,
+            longitudes=self.longitudes,
+            offsets=self.offsets,
+            targets=self.targets,
+            lengths=self.lengths,
+            durations=self.durations
+        )
+
+    def _cell_rows(self, latitudes):
+        return np.floor((np.asarray(latitudes) + 90) / self.cell_size).astype(np.int64)
+
+    def _cell_columns(self, longitudes):
+        return np.floor((np.asarray(longitudes) + 180) / self.cell_size).astype(np.int64)
+
+    def _cell_keys(self, latitudes, longitudes):
+        columns = int(np.ceil(360 / self.cell_size)) + 1
+        return self._cell_rows(latitudes) * columns + self._cell_columns(longitudes)
+
+    def _nodes_near(self, lat: float, lon: float, miles: float) -> np.ndarray:
+        """Nodes in the grid cells overlapping a radius of ``miles`` around a point."""
+        lat_span, lon_span = degrees_for_miles(miles, lat)
+        columns = int(np.ceil(360 / self.cell_size)) + 1
+
+        row_lo, row_hi = self._cell_rows([lat - lat_span, lat + lat_span])
+        col_lo, col_hi = self._cell_columns([lon - lon_span, lon + lon_span])
+
+        rows = np.arange(row_lo, row_hi + 1)
+        starts = np.searchsorted(self.cell_keys, rows * columns + col_lo, side='left')
+        ends = np.searchsorted(self.cell_keys, rows * columns + col_hi, side='right')
+
+        slices = [self.cell_order[s:e] for s, e in zip(starts, ends) if e > s]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def nearest_node(self, location: Coordinate) -> int:
+        """
+        Return the node closest to a location.
+
+        Only the nodes in the grid cells around the location are measured. The radius starts at one cell and
+        doubles until the closest of those nodes lies within it, since every node within the radius was
+        measured by then.
+        """
+        lat, lon = location.latitude, location.longitude
+        miles = self.cell_size * MILES_PER_DEGREE_LAT
+        while miles < EARTH_RADIUS_MILES:
+            nodes = self._nodes_near(lat, lon, miles)
+            if len(nodes):
+                distances = haversine_miles(lat, lon, self.latitudes[nodes], self.longitudes[nodes])
+                closest = int(np.argmin(distances))
+                if distances[closest] <= miles:
+                    return int(nodes[closest])
+            miles *= 2
+
+        # Nothing within a quarter of the globe, so measure every node
+        distances = haversine_miles(lat, lon, self.latitudes, self.longitudes)
+        return int(np.argmin(distances))
+
+    def shortest_path(self, source: int, target: int) -> Optional[Tuple[List[int], List[int]]]:
+        """
+        Shortest path by length using bidirectional A*.
+
+        Both searches use the average potential ``(h(v, target) - h(source, v)) / 2`` with great-circle
+        distance as ``h``, which keeps reduced edge lengths non-negative in both directions, so the search can
+        stop as soon as the two frontier keys sum to at least the best path found.
+        :return: Returns the (nodes, edges) along the path, or None if target is unreachable.
+        """
+        if source == target:
+            return [source], []
+
+        lat = memoryview(self.latitudes)
+        lon = memoryview(self.longitudes)
+        offsets, targets, lengths = memoryview(self.offsets), memoryview(self.targets), memoryview(self.lengths)
+        r_offsets, r_sources, r_edges = (
+            memoryview(self.reverse_offsets), memoryview(self.reverse_sources), memoryview(self.reverse_edges)
+        )
+
+        def great_circle(a, b):
+            lat1, lat2 = radians(lat[a]), radians(lat[b])
+            h = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin(radians(lon[b] - lon[a]) / 2) ** 2
+            # Slightly shrunk so spherical rounding never overestimates an edge measured on the ellipsoid
+            return 0.995 * 2 * EARTH_RADIUS_MILES * asin(min(1.0, sqrt(h)))
+
+        potentials = {}
+
+        def potential(v):
+            p = potentials.get(v)
+            if p is None:
+                p = potentials[v] = (great_circle(v, target) - great_circle(source, v)) / 2
+            return p
+
+        forward = {source: 0.0}
+        backward = {target: 0.0}
+        forward_parent = {source: None}
+        backward_parent = {target: None}
+        forward_heap = [(potential(source), source)]
+        backward_heap = [(-potential(target), target)]
+        forward_settled, backward_settled = set(), set()
+
+        best, meeting = inf, None
+        while forward_heap and backward_heap:
+            if forward_heap[0][0] + backward_heap[0][0] >= best:
+                break
+
+            if forward_heap[0][0] <= backward_heap[0][0]:
+                _, u = heapq.heappop(forward_heap)
+                if u in forward_settled:
+                    continue
+                forward_settled.add(u)
+                du = forward[u]
+                for e in range(offsets[u], offsets[u + 1]):
+                    v = targets[e]
+                    dv = du + lengths[e]
+                    if dv < forward.get(v, inf):
+                        forward[v] = dv
+                        forward_parent[v] = (u, e)
+                        heapq.heappush(forward_heap, (dv + potential(v), v))
+                        if v in backward and dv + backward[v] < best:
+                            best, meeting = dv + backward[v], v
+            else:
+                _, u = heapq.heappop(backward_heap)
+                if u in backward_settled:
+                    continue
+                backward_settled.add(u)
+                du = backward[u]
+                for i in range(r_offsets[u], r_offsets[u + 1]):
+                    v, e = r_sources[i], r_edges[i]
+                    dv = du + lengths[e]
+                    if dv < backward.get(v, inf):
+                        backward[v] = dv
+                        backward_parent[v] = (u, e)
+                        heapq.heappush(backward_heap, (dv - potential(v), v))
+                        if v in forward and dv + forward[v] < best:
+                            best, meeting = dv + forward[v], v
+
+        if meeting is None:
+            return None
+
+        nodes, edges = [meeting], []
+        step = forward_parent[meeting]
+        while step is not None:
+            nodes.append(step[0])
+            edges.append(step[1])
+            step = forward_parent[step[0]]
+        nodes.reverse()
+        edges.reverse()
+
+        step = backward_parent[meeting]
+        while step is not None:
+            nodes.append(step[0])
+            edges.append(step[1])
+            step = backward_parent[step[0]]
+
+        return nodes, edges
+
+
+class LocalGraphEngine:
+    """Routing engine answering route queries from a local RoadGraph instead of a remote OSRM server."""
+
+    _engines = {}
+    _lock = threading.Lock()
+
+    def __init__(self, graph: RoadGraph):
+        self.graph = graph
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'LocalGraphEngine':
+        """Return the process-wide engine for a graph file, loading it on first use."""
+        path = str(path)
+        if path not in cls._engines:
+            with cls._lock:
+                if path not in cls._engines:
+                    graph = RoadGraph.load(path)
+                    logger.info(f"Loaded road graph {path} with {len(graph)} nodes and {len(graph.targets)} edges")
+                    cls._engines[path] = cls(graph)
+        return cls._engines[path]
+
+    def get_route(self, *, from_location: Coordinate, to_location: Coordinate) -> Optional[RouteData]:
+        """
+        Get route data for specified locations.
+        :param from_location: The location route is starting from.
+        :param to_location: The finish location for route.
+        :return: Returns a route data if route was found, else None.
+        """
+        path = self.graph.shortest_path(self.graph.nearest_node(from_location), self.graph.nearest_node(to_location))
+        if path is None:
+            return None
+
+        nodes, edges = path
+        return RouteData(
+            distance=float(self.graph.lengths[edges].sum()),
+            duration=float(self.graph.durations[edges].sum()),
+            coordinates=RouteGeometry(np.column_stack((self.graph.latitudes[nodes], self.graph.longitudes[nodes]))),
+            start=from_location,
+            finish=to_location
+        )
@@ -0,0 +1,58 @@
+import time
+from django.core.management.base import BaseCommand
+from routing.client import RoutingClient
+from routing.services.geolocation import GeoLocationService
+from routing.services.station import StationService
+
+
+class Command(BaseCommand):
+    help = 'Benchmark vectorized route sampling against the per-segment geodesic implementation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', type=str, nargs='?', default='Los Angeles, CA')
+        parser.add_argument('finish', type=str, nargs='?', default='New York, NY')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs per implementation')
+        parser.add_argument('--interval', type=float, default=100, help='Sample interval in miles')
+
+    def _time(self, func, repeat):
+        best = None
+        result = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def handle(self, *args, **options):
+        geolocation = GeoLocationService()
+        route = RoutingClient().get_route(
+            from_location=geolocation.geocode(options['start']),
+            to_location=geolocation.geocode(options['finish'])
+        )
+        if not route:
+            self.stdout.write(self.style.ERROR('No route found'))
+            return
+
+        coordinates = route.coordinates
+        interval = options['interval']
+        repeat = options['repeat']
+        self.stdout.write(
+            f"{options['start']} -> {options['finish']}: {len(coordinates)} coordinates, {route.distance:.1f} miles"
+        )
+
+        legacy_time, legacy = self._time(
+            lambda: StationService.get_sample_points_along_route_geodesic(coordinates, at_intervals=interval), repeat
+        )
+        vector_time, vector = self._time(
+            lambda: StationService.get_sample_points_along_route(coordinates, at_intervals=interval), repeat
+        )
+
+        max_error = max(
+            (abs(a.distance_from_start - b.distance_from_start) for a, b in zip(legacy, vector)), default=0
+        )
+
+        self.stdout.write(f'geodesic:   {legacy_time * 1000:.2f} ms ({len(legacy)} points)')
+        self.stdout.write(f'vectorized: {vector_time * 1000:.2f} ms ({len(vector)} points)')
+        self.stdout.write(f'max distance difference: {max_error:.6f} miles')
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {legacy_time / vector_time:.1f}x'))
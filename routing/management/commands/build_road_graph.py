@@ -0,0 +1,57 @@
+import csv
+import numpy as np
+from django.core.management.base import BaseCommand
+from routing.graph import RoadGraph
+from routing.utils.geo import haversine_miles
+
+
+class Command(BaseCommand):
+    help = 'Build a road graph file for the local routing engine from an edge list CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'edges', type=str,
+            help='CSV with from_lat,from_lon,to_lat,to_lon and optional length (miles) and duration (minutes)'
+        )
+        parser.add_argument('output', type=str, help='Path of the .npz graph file to write')
+        parser.add_argument('--bidirectional', action='store_true', help='Add the reverse of every edge')
+
+    def handle(self, *args, **options):
+        nodes = {}
+        sources, targets, lengths, durations = [], [], [], []
+
+        def node_id(lat, lon):
+            return nodes.setdefault((round(float(lat), 6), round(float(lon), 6)), len(nodes))
+
+        with open(options['edges'], newline='') as f:
+            for row in csv.DictReader(f):
+                sources.append(node_id(row['from_lat'], row['from_lon']))
+                targets.append(node_id(row['to_lat'], row['to_lon']))
+                lengths.append(float(row['length']) if row.get('length') else np.nan)
+                durations.append(float(row['duration']) if row.get('duration') else np.nan)
+
+        if options['bidirectional']:
+            sources, targets = sources + targets, targets + sources
+            lengths, durations = lengths * 2, durations * 2
+
+        coordinates = np.array(list(nodes), dtype=np.float64).reshape(-1, 2)
+        sources, targets = np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64)
+        lengths, durations = np.array(lengths), np.array(durations)
+
+        # Fill in missing values the same way RoadGraph.from_edges defaults them
+        missing = np.isnan(lengths)
+        lengths[missing] = haversine_miles(
+            coordinates[sources[missing], 0], coordinates[sources[missing], 1],
+            coordinates[targets[missing], 0], coordinates[targets[missing], 1]
+        )
+        missing = np.isnan(durations)
+        durations[missing] = lengths[missing] / RoadGraph.default_speed_mph * 60
+
+        graph = RoadGraph.from_edges(
+            latitudes=coordinates[:, 0], longitudes=coordinates[:, 1], sources=sources, targets=targets,
+            lengths=lengths, durations=durations
+        )
+        graph.save(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['output']} with {len(graph)} nodes and {len(graph.targets)} edges"
+        ))
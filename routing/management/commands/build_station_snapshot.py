@@ -0,0 +1,31 @@
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from routing.services.index import StationIndex, get_snapshot_path
+from routing.utils.cache import bump_station_revision
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
+
+
+class Command(BaseCommand):
+    help = 'Write the station snapshot that server processes map read-only and share'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', type=str, default=None,
+            help='Snapshot file to write (defaults to the STATION_SNAPSHOT_PATH environment variable)'
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['output']) if options['output'] else get_snapshot_path()
+        if path is None:
+            self.stdout.write(self.style.ERROR('Pass --output or set STATION_SNAPSHOT_PATH'))
+            return
+        if not path.is_absolute():
+            path = BASE_DIR / path
+
+        index = StationIndex.from_queryset()
+        index.save(path)
+        # Processes reload on the next revision and pick up the new file
+        bump_station_revision()
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(index)} stations to {path}'))
@@ -2,20 +2,34 @@ from pathlib import Path
 from django.core.management.base import BaseCommand
 from django.core import serializers
 from routing.models import FuelStation
+from routing.utils.fixtures import read_station_columns, write_station_fixture
 
 
 class Command(BaseCommand):
     help = 'Dump fuel stations to fixture file'
-    
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=['binary', 'json'], default='binary',
+            help='Columnar .npz fixture for restore_stations, or a JSON fixture for loaddata'
+        )
+        parser.add_argument('--output', type=str, default=None, help='Fixture file to write')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Stations read per database round trip')
+
     def handle(self, *args, **options):
         fixtures_dir = Path(__file__).resolve().parent.parent.parent / 'fixtures'
         fixtures_dir.mkdir(exist_ok=True)
-        
-        fixture_path = fixtures_dir / 'fuel_stations.json'
-        
-        stations = FuelStation.objects.all()
-        
-        with open(fixture_path, 'w') as f:
-            serializers.serialize('json', stations, indent=2, stream=f)
-        
-        self.stdout.write(self.style.SUCCESS(f'Dumped {stations.count()} stations to {fixture_path}'))
+
+        if options['format'] == 'binary':
+            fixture_path = Path(options['output'] or fixtures_dir / 'fuel_stations.npz')
+            columns = read_station_columns(chunk_size=options['chunk_size'])
+            write_station_fixture(fixture_path, columns)
+            count = len(columns['id'])
+        else:
+            fixture_path = Path(options['output'] or fixtures_dir / 'fuel_stations.json')
+            stations = FuelStation.objects.order_by('pk').iterator(chunk_size=options['chunk_size'])
+            with open(fixture_path, 'w') as f:
+                serializers.serialize('json', stations, indent=2, stream=f)
+            count = FuelStation.objects.count()
+
+        self.stdout.write(self.style.SUCCESS(f'Dumped {count} stations to {fixture_path}'))
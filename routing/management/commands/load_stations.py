@@ -1,13 +1,72 @@
 import csv
+import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from django.contrib.gis.geos import Point
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from geopy.exc import GeopyError
 from geopy.geocoders import Nominatim
 from routing.models import FuelStation
+from routing.services.gazetteer import Gazetteer
+from routing.services.index import StationIndex
+from routing.services.station import StationService
+from routing.utils.cache import bump_station_generation
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
+
+
+class RateLimiter:
+    """Spaces calls at least ``interval`` seconds apart across all threads."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class GeocodeCache:
+    """Append-only JSON lines file of ``{"location": ..., "coordinates": [lat, lon] | null}`` results."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.results = {}
+        self._lock = threading.Lock()
+        if path.exists():
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written line from an interrupted run
+                    self.results[entry['location']] = entry['coordinates']
+
+    def __contains__(self, location):
+        return location in self.results
+
+    def get(self, location):
+        return self.results.get(location)
+
+    def add(self, location, coordinates):
+        with self._lock:
+            self.results[location] = coordinates
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'location': location, 'coordinates': coordinates}) + '\n')
+
 
 class Command(BaseCommand):
     help = 'Load fuel stations from CSV and geocode them'
-    
+
     def add_arguments(self, parser):
         parser.add_argument(
             'file',
@@ -16,63 +75,138 @@ class Command(BaseCommand):
             default='data/fuel-stations.csv',
             help='Path to CSV file with fuel station data'
         )
-    
+        parser.add_argument(
+            '--geocode-cache', type=str, default='data/geocode-cache.jsonl',
+            help='File geocoding results are kept in, so an interrupted run resumes where it stopped'
+        )
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent geocoding requests')
+        parser.add_argument(
+            '--rate', type=float, default=1.0, help='Maximum geocoding requests per second across all workers'
+        )
+        parser.add_argument('--retries', type=int, default=3, help='Attempts per city on geocoder errors')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Stations per bulk insert')
+        parser.add_argument(
+            '--fresh', action='store_true',
+            help='Ignore cached results and coordinates of already loaded stations and geocode every city again'
+        )
+
+    def resolve(self, path: str) -> Path:
+        path = Path(path)
+        return path if path.is_absolute() else BASE_DIR / path
+
+    def geocode(self, geocoder, limiter: RateLimiter, location: str, retries: int):
+        for attempt in range(retries):
+            limiter.wait()
+            try:
+                result = geocoder.geocode(location)
+                return [result.latitude, result.longitude] if result else None
+            except GeopyError:
+                if attempt + 1 == retries:
+                    raise
+                time.sleep(2 ** attempt)
+
+    def geocode_all(self, locations, options):
+        """Geocode distinct locations once each, returning ``{location: [lat, lon] | None}``."""
+        cache = GeocodeCache(self.resolve(options['geocode_cache']))
+        known = Gazetteer() if options['fresh'] else Gazetteer.build()
+
+        results, pending = {}, []
+        for location in locations:
+            if not options['fresh'] and location in cache:
+                results[location] = cache.get(location)
+            elif (coordinate := known.lookup(location)) is not None:
+                results[location] = list(coordinate)
+            else:
+                pending.append(location)
+
+        self.stdout.write(
+            f'{len(locations)} distinct cities: {len(locations) - len(pending)} already geocoded, '
+            f'{len(pending)} to geocode'
+        )
+
+        geocoder = Nominatim(user_agent="route_planner", timeout=10)
+        limiter = RateLimiter(1 / options['rate'])
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {
+                pool.submit(self.geocode, geocoder, limiter, location, options['retries']): location
+                for location in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                location = futures[future]
+                try:
+                    results[location] = future.result()
+                except GeopyError as e:
+                    # Not cached, so the next run retries it
+                    self.stdout.write(self.style.ERROR(f"Error geocoding: {location}. {e}"))
+                    results[location] = None
+                    continue
+
+                cache.add(location, results[location])
+                if results[location] is None:
+                    self.stdout.write(self.style.WARNING(f"Failed to geocode: {location}"))
+                if done % 100 == 0:
+                    self.stdout.write(f'Geocoded {done}/{len(pending)} cities...')
+
+        return results
+
+    @staticmethod
+    def cheapest_quotes(rows):
+        """
+        One row per OPIS ID, at its cheapest quote.
+
+        A station can be listed several times with different quotes. ``update_prices`` prices it the same
+        way, so re-importing an unchanged file changes nothing.
+        """
+        cheapest = {}
+        for row in rows:
+            current = cheapest.get(row['OPIS Truckstop ID'])
+            if current is None or float(row['Retail Price']) < float(current['Retail Price']):
+                cheapest[row['OPIS Truckstop ID']] = row
+        return list(cheapest.values())
+
     def handle(self, *args, **options):
-        csv_path = Path(options['file'])
-        if not csv_path.is_absolute():
-            csv_path = Path(__file__).resolve().parent.parent.parent.parent / csv_path
-        
+        csv_path = self.resolve(options['file'])
+
         if not csv_path.exists():
             self.stdout.write(self.style.ERROR(f'File not found: {csv_path}'))
             return
-        
-        geocoder = Nominatim(user_agent="route_planner")
 
-        FuelStation.objects.all().delete()
+        with open(csv_path, 'r') as f:
+            rows = self.cheapest_quotes(csv.DictReader(f))
+
+        def location_of(row):
+            return f"{row['City'].strip()}, {row['State'].strip()}, USA"
+
+        locations = list(dict.fromkeys(location_of(row) for row in rows))
+        coordinates = self.geocode_all(locations, options)
+
         stations = []
+        for row in rows:
+            coordinate = coordinates.get(location_of(row))
+            if coordinate is None:
+                continue
+            stations.append(FuelStation(
+                opis_id=row['OPIS Truckstop ID'],
+                name=row['Truckstop Name'].strip(),
+                address=row['Address'],
+                city=row['City'].strip(),
+                state=row['State'].strip(),
+                rack_id=row['Rack ID'],
+                price=float(row['Retail Price']),
+                location=Point(coordinate[1], coordinate[0])
+            ))
 
-        processed = 0
+        # Replace the table only once every station is ready, so a failed run leaves the old data in place
+        with transaction.atomic():
+            FuelStation.objects.all().delete()
+            FuelStation.objects.bulk_create(stations, batch_size=options['batch_size'])
+            cells = StationService.refresh_cheapest_stations()
 
-        with open(csv_path, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                processed += 1
-                try:
-                    city = row['City'].strip()
-                    state = row['State']
-                    location = f"{city}, {state}, USA"
-                    self.stdout.write(
-                            f'{processed}. Processing station: {row["Truckstop Name"]} ({location})'
-                    )
-                    result = geocoder.geocode(location)
-
-                    if result:
-                        from django.contrib.gis.geos import Point
-                        name = row['Truckstop Name'].strip()
-                        address = row['Address']
-                        stations.append(FuelStation(
-                            opis_id=row['OPIS Truckstop ID'],
-                            name=name,
-                            address=address,
-                            city=city,
-                            state=state,
-                            rack_id=row['Rack ID'],
-                            price=float(row['Retail Price']),
-                            location=Point(result.longitude, result.latitude)
-                        ))
-                    else:
-                        self.stdout.write(self.style.WARNING(f"Failed to geocode: {location}"))
-
-                    if len(stations) >= 100:
-                        FuelStation.objects.bulk_create(stations)
-                        self.stdout.write(f'Loaded {FuelStation.objects.count()} stations...')
-                        stations = []
-
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Error parsing: {location}. {e}"))
-                    time.sleep(1)
-
-        if stations:
-            FuelStation.objects.bulk_create(stations)
-        
-        self.stdout.write(self.style.SUCCESS(f'Successfully loaded {FuelStation.objects.count()} fuel stations'))
+        Gazetteer.reset()
+        StationIndex.publish()
+        bump_station_generation()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully loaded {len(stations)} fuel stations ({len(rows) - len(stations)} skipped), '
+            f'precomputed cheapest stations for {cells} lookup cells'
+        ))
@@ -0,0 +1,41 @@
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from routing.models import FuelStation
+from routing.services.gazetteer import Gazetteer
+from routing.services.index import StationIndex
+from routing.services.station import StationService
+from routing.utils.cache import bump_station_generation
+from routing.utils.fixtures import copy_stations, read_station_fixture
+
+DEFAULT_FIXTURE = Path(__file__).resolve().parent.parent.parent / 'fixtures' / 'fuel_stations.npz'
+
+
+class Command(BaseCommand):
+    help = 'Replace the fuel stations with a binary fixture written by dump_stations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'file', type=str, nargs='?', default=str(DEFAULT_FIXTURE), help='Path to the .npz station fixture'
+        )
+
+    def handle(self, *args, **options):
+        fixture_path = Path(options['file'])
+        if not fixture_path.exists():
+            self.stdout.write(self.style.ERROR(f'File not found: {fixture_path}'))
+            return
+
+        columns = read_station_fixture(fixture_path)
+        with transaction.atomic():
+            FuelStation.objects.all().delete()
+            count = copy_stations(columns)
+            cells = StationService.refresh_cheapest_stations()
+
+        Gazetteer.reset()
+        StationIndex.publish()
+        bump_station_generation()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Restored {count} fuel stations from {fixture_path}, '
+            f'precomputed cheapest stations for {cells} lookup cells'
+        ))
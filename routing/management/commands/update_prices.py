@@ -0,0 +1,162 @@
+from pathlib import Path
+from typing import List
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from routing.models import FuelStation
+from routing.services.geolocation import GeoLocationService, LocationServiceType
+from routing.services.index import StationIndex
+from routing.services.station import StationService
+from routing.utils.cache import bump_cells, cell_for
+
+# Same columns, in the same order, as data/fuel-stations.csv
+CREATE_TEMP_TABLE = """
+    CREATE TEMP TABLE price_update (
+        opis_id varchar(50),
+        name text,
+        address text,
+        city text,
+        state text,
+        rack_id integer,
+        price numeric(12, 9)
+    ) ON COMMIT DROP
+"""
+
+COPY_PRICES = "COPY price_update FROM STDIN WITH (FORMAT csv, HEADER true)"
+
+# A station can be listed several times with different quotes; it is priced at its cheapest
+UPDATE_PRICES = """
+    WITH latest AS (
+        SELECT opis_id, MIN(price) AS price FROM price_update GROUP BY opis_id
+    )
+    UPDATE {table} AS station
+    SET price = latest.price
+    FROM latest, {table} AS previous
+    WHERE station.opis_id = latest.opis_id
+      AND previous.id = station.id
+      AND station.price <> latest.price
+    RETURNING station.opis_id, previous.price, station.price,
+        ST_Y(station.location::geometry), ST_X(station.location::geometry)
+"""
+
+NEW_STATIONS = """
+    SELECT DISTINCT ON (u.opis_id)
+        u.opis_id, u.name, u.address, u.city, u.state, u.rack_id,
+        MIN(u.price) OVER (PARTITION BY u.opis_id)
+    FROM price_update u
+    WHERE NOT EXISTS (SELECT 1 FROM {table} s WHERE s.opis_id = u.opis_id)
+    ORDER BY u.opis_id
+"""
+
+MISSING_STATIONS = """
+    SELECT COUNT(DISTINCT s.opis_id)
+    FROM {table} s
+    WHERE NOT EXISTS (SELECT 1 FROM price_update u WHERE u.opis_id = s.opis_id)
+"""
+
+
+class Command(BaseCommand):
+    help = 'Update fuel prices in place from a price CSV, adding only stations that are new'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'file',
+            type=str,
+            nargs='?',
+            default='data/fuel-stations.csv',
+            help='Path to CSV file with fuel station data'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report the diff without changing anything')
+
+    def handle(self, *args, **options):
+        csv_path = Path(options['file'])
+        if not csv_path.is_absolute():
+            csv_path = Path(__file__).resolve().parent.parent.parent.parent / csv_path
+
+        if not csv_path.exists():
+            self.stdout.write(self.style.ERROR(f'File not found: {csv_path}'))
+            return
+
+        table = connection.ops.quote_name(FuelStation._meta.db_table)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(CREATE_TEMP_TABLE)
+                with open(csv_path, 'r') as f:
+                    cursor.copy_expert(COPY_PRICES, f)
+                cursor.execute("CREATE INDEX ON price_update (opis_id)")
+                cursor.execute("ANALYZE price_update")
+
+                cursor.execute(UPDATE_PRICES.format(table=table))
+                changes = cursor.fetchall()
+                cursor.execute(NEW_STATIONS.format(table=table))
+                new_rows = cursor.fetchall()
+                cursor.execute(MISSING_STATIONS.format(table=table))
+                missing = cursor.fetchone()[0]
+
+            self.report(changes, new_rows, missing)
+            if options['dry_run']:
+                transaction.set_rollback(True)
+                self.stdout.write(self.style.WARNING('Dry run, no changes saved'))
+                return
+
+            StationService.refresh_cheapest_stations([(lat, lon) for *_, lat, lon in changes])
+
+        # Serve the new prices right away, not only once new stations are geocoded
+        self.invalidate({cell_for(lat, lon) for *_, lat, lon in changes})
+
+        # Geocode after the price update has committed so no row locks are held during upstream calls
+        created = self.create_stations(new_rows)
+        if created:
+            StationService.refresh_cheapest_stations([(s.location.y, s.location.x) for s in created])
+            self.invalidate({cell_for(s.location.y, s.location.x) for s in created})
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated {len(changes)} prices and added {len(created)} stations'
+        ))
+
+    def invalidate(self, cells):
+        """Publish the station index and invalidate cached lookups touching the cells of changed stations."""
+        if cells:
+            StationIndex.publish()
+            self.stdout.write(f'Invalidated cached station lookups in {bump_cells(cells)} grid cells')
+
+    def report(self, changes, new_rows, missing):
+        stations = {opis_id for opis_id, *_ in changes}
+        increases = [(new - old, opis_id) for opis_id, old, new, *_ in changes if new > old]
+        decreases = [(new - old, opis_id) for opis_id, old, new, *_ in changes if new < old]
+
+        self.stdout.write(
+            f'{len(changes)} prices changed at {len(stations)} stations '
+            f'({len(increases)} up, {len(decreases)} down), '
+            f'{len(new_rows)} new stations, {missing} stations not in file (kept)'
+        )
+        if changes:
+            average = sum(new - old for _, old, new, *_ in changes) / len(changes)
+            self.stdout.write(f'Average change: {average:+.3f}')
+        for label, moves in (('increases', sorted(increases, reverse=True)), ('decreases', sorted(decreases))):
+            if moves:
+                self.stdout.write(f'Largest {label}: ' + ', '.join(f'{i} ({d:+.3f})' for d, i in moves[:5]))
+
+    def create_stations(self, rows) -> List[FuelStation]:
+        geolocation = GeoLocationService.shared(LocationServiceType.GAZETTEER)
+        stations = []
+        for opis_id, name, address, city, state, rack_id, price in rows:
+            city, state = city.strip(), state.strip()
+            location = f"{city}, {state}, USA"
+            coordinate = geolocation.geocode(location)
+            if coordinate is None:
+                self.stdout.write(self.style.WARNING(f"Failed to geocode: {location}, skipping station {opis_id}"))
+                continue
+
+            stations.append(FuelStation(
+                opis_id=opis_id,
+                name=name.strip(),
+                address=address,
+                city=city,
+                state=state,
+                rack_id=rack_id,
+                price=price,
+                location=Point(coordinate.longitude, coordinate.latitude)
+            ))
+
+        return FuelStation.objects.bulk_create(stations, batch_size=2000)
@@ -0,0 +1,33 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from routing.utils.timing import record_timings
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a ``Server-Timing`` header with the stages timed while handling the request (see
+    ``routing.utils.timing.stage``) and the total, so clients and browser dev tools show where the time went.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with record_timings() as timings:
+            response = self.get_response(request)
+            response['Server-Timing'] = timings.header()
+        return response
+
+    async def __acall__(self, request):
+        with record_timings() as timings:
+            response = await self.get_response(request)
+            response['Server-Timing'] = timings.header()
+        return response
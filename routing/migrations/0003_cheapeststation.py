@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routing', '0002_alter_fuelstation_opis_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheapestStation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('max_distance', models.FloatField()),
+                ('cell_row', models.IntegerField()),
+                ('cell_col', models.IntegerField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('station', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, related_name='+', to='routing.fuelstation'
+                )),
+            ],
+            options={
+                'verbose_name': 'Cheapest Station',
+                'verbose_name_plural': 'Cheapest Stations',
+                'indexes': [
+                    models.Index(
+                        fields=['max_distance', 'cell_row', 'cell_col', 'rank'],
+                        name='routing_che_max_dis_862938_idx'
+                    )
+                ],
+            },
+        ),
+    ]
@@ -13,3 +13,22 @@ class FuelStation(models.Model):
     class Meta:
         verbose_name = "Fuel Station"
         verbose_name_plural = "Fuel Stations"
+
+
+class CheapestStation(models.Model):
+    """
+    Precomputed cheapest stations around a station lookup grid cell, ranked by price.
+
+    Holds the stations within ``max_distance`` miles of any point in the cell (see
+    ``routing.utils.cache.lookup_cell_area``), truncated to the cheapest few. Rebuilt by the station loaders.
+    """
+    max_distance = models.FloatField()
+    cell_row = models.IntegerField()
+    cell_col = models.IntegerField()
+    rank = models.PositiveSmallIntegerField()
+    station = models.ForeignKey(FuelStation, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        verbose_name = "Cheapest Station"
+        verbose_name_plural = "Cheapest Stations"
+        indexes = [models.Index(fields=['max_distance', 'cell_row', 'cell_col', 'rank'])]
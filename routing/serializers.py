@@ -18,6 +18,13 @@ class RouteRequestSerializer(serializers.Serializer):
         return value
 
 
+class BatchRouteRequestSerializer(serializers.Serializer):
+    routes = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False, max_length=1000,
+        help_text='List of {"start": ..., "finish": ...} lanes to plan'
+    )
+
+
 
 class FuelStopSerializer(serializers.Serializer):
     name = serializers.CharField()
@@ -0,0 +1,77 @@
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+from routing.data import FuelStop, StopTable
+
+
+class CandidateTable:
+    """
+    Candidate fuel stops for a route, sorted once by distance along the route.
+
+    Stops are kept in a columnar ``StopTable``; lookups return a new ``FuelStop`` for the chosen row, so
+    callers may set ``gallons`` and ``cost`` on it without touching the table. A sparse table of price
+    argmins over the sorted stops answers "cheapest stop in (a, b]" in O(log n) (two binary searches plus
+    an O(1) range-minimum lookup) and "first stop cheaper than p after d" in O(log n) by binary searching
+    on the range minimum.
+    """
+
+    def __init__(self, stops: Union[StopTable, Iterable[FuelStop]]):
+        if not isinstance(stops, StopTable):
+            stops = StopTable.from_stops(stops)
+        self.table = stops.take(np.lexsort((stops.prices, stops.distances_from_start)))
+        self.distances = self.table.distances_from_start
+        self.prices = self.table.prices
+
+        count = len(self.table)
+        self._sparse = [np.arange(count)]
+        width = 1
+        while 2 * width <= count:
+            previous = self._sparse[-1]
+            left = previous[:count - 2 * width + 1]
+            right = previous[width:count - width + 1]
+            self._sparse.append(np.where(self.prices[right] < self.prices[left], right, left))
+            width *= 2
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def _argmin(self, lo: int, hi: int) -> int:
+        """Index of the cheapest stop in ``stops[lo:hi]`` (``hi > lo``), earliest on ties."""
+        level = (hi - lo).bit_length() - 1
+        left = self._sparse[level][lo]
+        right = self._sparse[level][hi - (1 << level)]
+        return int(right if self.prices[right] < self.prices[left] else left)
+
+    def _bounds(self, start: float, end: Optional[float]):
+        lo = int(np.searchsorted(self.distances, start, side='right'))
+        hi = len(self.table) if end is None else int(np.searchsorted(self.distances, end, side='right'))
+        return lo, hi
+
+    def cheapest_in_range(self, start: float, end: float) -> Optional[FuelStop]:
+        """Return the cheapest stop with ``start < distance_from_start <= end``."""
+        lo, hi = self._bounds(start, end)
+        if hi <= lo:
+            return None
+        return self.table.stop(self._argmin(lo, hi))
+
+    def first_cheaper_after(
+            self, distance: float, price: float, max_distance: float = None
+    ) -> Optional[FuelStop]:
+        """Return the first stop after ``distance`` (up to ``max_distance``) priced below ``price``."""
+        lo, hi = self._bounds(distance, max_distance)
+        if hi <= lo or self.prices[self._argmin(lo, hi)] >= price:
+            return None
+
+        # Smallest end such that stops[lo:end] contains a cheaper stop; that stop is stops[end - 1]
+        left, right = lo + 1, hi
+        while left < right:
+            middle = (left + right) // 2
+            if self.prices[self._argmin(lo, middle)] < price:
+                right = middle
+            else:
+                left = middle + 1
+        return self.table.stop(left - 1)
@@ -0,0 +1,101 @@
+import csv
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from routing.data import Coordinate
+
+logger = logging.getLogger('routing')
+
+DEFAULT_GAZETTEER_PATH = Path(__file__).resolve().parent.parent.parent / 'data' / 'gazetteer.csv'
+
+
+class Gazetteer:
+    """
+    Offline "City, ST" to coordinate table held in a dict.
+
+    It is seeded from an optional gazetteer CSV (``city,state,latitude,longitude``, path from the
+    ``GAZETTEER_PATH`` environment variable) and from the city/state pairs of the already geocoded fuel
+    stations. Entries from the file take precedence.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, entries: Iterable[Tuple[str, str, float, float]] = ()):
+        self.coordinates = {}
+        for city, state, latitude, longitude in entries:
+            self.add(city, state, latitude, longitude)
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    @staticmethod
+    def make_key(city: str, state: str) -> Tuple[str, str]:
+        return ' '.join(city.split()).lower(), state.strip().upper()
+
+    @classmethod
+    def parse(cls, location: str) -> Optional[Tuple[str, str]]:
+        """Key for a ``City, ST`` or ``City, ST, USA`` location, or None for any other format."""
+        parts = [part.strip() for part in location.split(',')]
+        if len(parts) == 3 and parts[2].upper() in ('USA', 'US'):
+            parts = parts[:2]
+        if len(parts) != 2 or not all(parts):
+            return None
+        return cls.make_key(*parts)
+
+    def add(self, city: str, state: str, latitude: float, longitude: float):
+        """Add an entry unless the city is already known."""
+        self.coordinates.setdefault(
+            self.make_key(city, state), Coordinate(latitude=float(latitude), longitude=float(longitude))
+        )
+
+    def lookup(self, location: str) -> Optional[Coordinate]:
+        key = self.parse(location)
+        return self.coordinates.get(key) if key else None
+
+    @staticmethod
+    def read_file(path) -> Iterable[Tuple[str, str, float, float]]:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                yield row['city'], row['state'], float(row['latitude']), float(row['longitude'])
+
+    @staticmethod
+    def read_stations(queryset=None) -> Iterable[Tuple[str, str, float, float]]:
+        if queryset is None:
+            from routing.models import FuelStation
+            queryset = FuelStation.objects.all()
+
+        for city, state, location in queryset.values_list('city', 'state', 'location').iterator(chunk_size=2000):
+            yield city, state, location.y, location.x
+
+    @classmethod
+    def build(cls, path=None) -> 'Gazetteer':
+        """Build a gazetteer from the gazetteer file (if it exists) and the fuel stations."""
+        path = Path(path or os.getenv('GAZETTEER_PATH') or DEFAULT_GAZETTEER_PATH)
+        gazetteer = cls(cls.read_file(path) if path.exists() else ())
+        for entry in cls.read_stations():
+            gazetteer.add(*entry)
+        return gazetteer
+
+    @classmethod
+    def is_loaded(cls) -> bool:
+        return cls._instance is not None
+
+    @classmethod
+    def get(cls) -> 'Gazetteer':
+        """Return the process-wide gazetteer, building it on first use."""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls.build()
+                    logger.info(f"Built gazetteer with {len(cls._instance)} cities")
+        return cls._instance
+
+    @classmethod
+    def reset(cls):
+        """Drop the process-wide gazetteer so the next ``get`` rebuilds it."""
+        with cls._lock:
+            cls._instance = None
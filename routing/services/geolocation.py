@@ -1,12 +1,20 @@
+import asyncio
 import enum
+import functools
 import hashlib
-from django.core.cache import cache
+import weakref
+from asgiref.sync import sync_to_async
+from common.client import ClientRegistry, POOL_SIZE, READ_TIMEOUT, close_on_loop_shutdown, session_stats
+from routing.utils.cache import tiered_cache
+from routing.utils.timing import record_cache
 from routing.data import Coordinate
+from .gazetteer import Gazetteer
 
 
 class LocationServiceType(enum.IntEnum):
     OPEN_STREET_MAPS = 0
     GOOGLE_MAPS = 1
+    GAZETTEER = 2  # Offline city table, falling back to OpenStreetMap on a miss
 
     @property
     def is_open_street_maps(self):
@@ -16,6 +24,10 @@ class LocationServiceType(enum.IntEnum):
     def is_google_maps(self):
         return self == LocationServiceType.GOOGLE_MAPS
 
+    @property
+    def is_gazetteer(self):
+        return self == LocationServiceType.GAZETTEER
+
 
 class GeoLocationService:
     service_class = None
@@ -26,10 +38,23 @@ class GeoLocationService:
         if not self.service_class:
             raise ValueError(f"Invalid service type: {service_type}")
 
-        self.geocoder = self.service_class(user_agent="route_planner")
+        from geopy.adapters import RequestsAdapter
+        self.geocoder = self.service_class(
+            user_agent="route_planner",
+            timeout=READ_TIMEOUT,
+            adapter_factory=functools.partial(RequestsAdapter, pool_maxsize=POOL_SIZE)
+        )
+
+    @classmethod
+    def shared(cls, service_type: LocationServiceType = LocationServiceType.OPEN_STREET_MAPS):
+        """The process-wide service for ``service_type``, see ``ClientRegistry``."""
+        return ClientRegistry.get(f"{cls.__name__}:{service_type.name}", lambda: cls(service_type))
+
+    def stats(self) -> dict:
+        return session_stats(self.geocoder.adapter.session)
 
     def get_service_class(self):
-        if self.service_type.is_open_street_maps:
+        if self.service_type.is_open_street_maps or self.service_type.is_gazetteer:
             from geopy.geocoders import Nominatim
             return Nominatim
         elif self.service_type.is_google_maps:
@@ -38,16 +63,91 @@ class GeoLocationService:
         else:
             raise ValueError(f"Invalid service type: {self.service_type}")
 
+    @staticmethod
+    def get_cache_key(location:str) -> str:
+        return f"geocode:{hashlib.md5(location.encode()).hexdigest()}"
+
     def geocode(self, location:str) -> Coordinate:
-        cache_key = f"geocode:{hashlib.md5(location.encode()).hexdigest()}"
-        cached = cache.get(cache_key)
-        
+        if self.service_type.is_gazetteer:
+            coord = Gazetteer.get().lookup(location)
+            if coord:
+                record_cache(True)
+                return coord
+
+        cache_key = self.get_cache_key(location)
+        cached = tiered_cache.get(cache_key)
+        record_cache(bool(cached))
+
         if cached:
             return Coordinate(**cached)
         
         result = self.geocoder.geocode(location)
         if result:
             coord = Coordinate(latitude=result.latitude, longitude=result.longitude)
-            cache.set(cache_key, {'latitude': coord.latitude, 'longitude': coord.longitude}, timeout=86400)
+            tiered_cache.set(cache_key, {'latitude': coord.latitude, 'longitude': coord.longitude}, timeout=86400)
+            return coord
+        return None
+
+
+class AsyncGeoLocationService(GeoLocationService):
+    """
+    Asyncio variant of GeoLocationService using geopy's aiohttp adapter, one geocoder per event loop.
+
+    A geocoder's session is closed when its loop shuts down.
+    """
+
+    def __init__(self, service_type:LocationServiceType = LocationServiceType.OPEN_STREET_MAPS):
+        self.service_type = service_type
+        self.service_class = self.get_service_class()
+        if not self.service_class:
+            raise ValueError(f"Invalid service type: {service_type}")
+
+        self._geocoders = weakref.WeakKeyDictionary()
+        self._closers = weakref.WeakKeyDictionary()
+
+    def stats(self) -> dict:
+        # geopy's aiohttp adapter does not expose its connection pool
+        return {}
+
+    def get_geocoder(self):
+        from geopy.adapters import AioHTTPAdapter
+
+        loop = asyncio.get_running_loop()
+        geocoder = self._geocoders.get(loop)
+        if geocoder is None:
+            geocoder = self.service_class(
+                user_agent="route_planner", timeout=READ_TIMEOUT, adapter_factory=AioHTTPAdapter
+            )
+            self._geocoders[loop] = geocoder
+            self._closers[loop] = close_on_loop_shutdown(self.close)
+        return geocoder
+
+    async def close(self):
+        """Close the geocoder session of the running event loop."""
+        loop = asyncio.get_running_loop()
+        self._closers.pop(loop, None)
+        geocoder = self._geocoders.pop(loop, None)
+        if geocoder is not None:
+            await geocoder.__aexit__(None, None, None)
+
+    async def ageocode(self, location:str) -> Coordinate:
+        if self.service_type.is_gazetteer:
+            gazetteer = Gazetteer.get() if Gazetteer.is_loaded() else await sync_to_async(Gazetteer.get)()
+            coord = gazetteer.lookup(location)
+            if coord:
+                record_cache(True)
+                return coord
+
+        cache_key = self.get_cache_key(location)
+        cached = await tiered_cache.aget(cache_key)
+        record_cache(bool(cached))
+
+        if cached:
+            return Coordinate(**cached)
+
+        result = await self.get_geocoder().geocode(location)
+        if result:
+            coord = Coordinate(latitude=result.latitude, longitude=result.longitude)
+            await tiered_cache.aset(cache_key, {'latitude': coord.latitude, 'longitude': coord.longitude}, timeout=86400)
             return coord
         return None
\ No newline at end of file
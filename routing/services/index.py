@@ -0,0 +1,333 @@
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from routing.data import FuelStop, SamplePoint, StopTable
+from routing.utils.cache import get_station_revision
+from routing.utils.geo import haversine_miles, degrees_for_miles
+
+logger = logging.getLogger('routing')
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+TEXT_FIELDS = (('id', 'ids'), ('name', 'names'), ('address', 'addresses'), ('city', 'cities'), ('state', 'states'))
+NUMBER_FIELDS = (('price', 'prices'), ('latitude', 'latitudes'), ('longitude', 'longitudes'))
+
+
+def get_snapshot_path() -> Optional[Path]:
+    """
+    Station snapshot file from the ``STATION_SNAPSHOT_PATH`` environment variable, None when not configured.
+
+    Only worth configuring with INDEX station lookups, the only ones that read the index.
+    """
+    path = os.getenv('STATION_SNAPSHOT_PATH')
+    return BASE_DIR / path if path else None
+
+
+class StationIndex:
+    """
+    In-memory spatial index over every fuel station.
+
+    Stations are kept in parallel numpy arrays sorted by a lat/lon grid cell key, so the stations of
+    one grid row are a contiguous slice that can be located with ``searchsorted``. A radius query only
+    computes exact distances for the stations in the handful of cells around each point.
+    """
+
+    cell_size = 0.5  # Grid cell size in degrees
+
+    _instance = None
+    _revision = None
+    _snapshot = None  # (inode, mtime) of the snapshot file the instance is mapped from
+    _lock = threading.Lock()
+
+    def __init__(
+            self, *,
+            ids: Sequence[str],
+            names: Sequence[str],
+            addresses: Sequence[str],
+            cities: Sequence[str],
+            states: Sequence[str],
+            prices: Sequence[float],
+            latitudes: Sequence[float],
+            longitudes: Sequence[float],
+            cell_size: float = None
+    ):
+        if cell_size:
+            self.cell_size = cell_size
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        keys = self._cell_keys(latitudes, longitudes)
+        order = np.argsort(keys, kind='stable')
+
+        self.keys = keys[order]
+        self.latitudes = latitudes[order]
+        self.longitudes = longitudes[order]
+        self.prices = np.asarray(prices, dtype=np.float64)[order]
+        self.ids = np.asarray(ids, dtype=object)[order]
+        self.names = np.asarray(names, dtype=object)[order]
+        self.addresses = np.asarray(addresses, dtype=object)[order]
+        self.cities = np.asarray(cities, dtype=object)[order]
+        self.states = np.asarray(states, dtype=object)[order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_queryset(cls, queryset=None, **kwargs) -> 'StationIndex':
+        """Build an index from a FuelStation queryset (all stations by default)."""
+        if queryset is None:
+            from routing.models import FuelStation
+            queryset = FuelStation.objects.all()
+
+        rows = queryset.values_list('opis_id', 'name', 'address', 'city', 'state', 'price', 'location')
+
+        return cls.from_rows(
+            [(*r[:5], float(r[5]), r[6].y, r[6].x) for r in rows],
+            **kwargs
+        )
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple], **kwargs) -> 'StationIndex':
+        """Build an index from ``(opis_id, name, address, city, state, price, latitude, longitude)`` rows."""
+        rows = list(rows)
+
+        return cls(
+            ids=[r[0] for r in rows],
+            names=[r[1] for r in rows],
+            addresses=[r[2] for r in rows],
+            cities=[r[3] for r in rows],
+            states=[r[4] for r in rows],
+            prices=[r[5] for r in rows],
+            latitudes=[r[6] for r in rows],
+            longitudes=[r[7] for r in rows],
+            **kwargs
+        )
+
+    @classmethod
+    def from_snapshot(cls, path) -> 'StationIndex':
+        """
+        Map a snapshot written by ``save`` read-only.
+
+        The columns are views into the mapped file, so every process mapping the same file shares its
+        pages through the page cache instead of holding a private copy. Text columns stay UTF-8 bytes
+        and are only decoded for the stations a search returns.
+        """
+        snapshot = np.load(path, mmap_mode='r').view(np.ndarray)
+        index = cls.__new__(cls)
+        index.keys = index._cell_keys(snapshot['latitude'], snapshot['longitude'])
+        if np.any(index.keys[1:] < index.keys[:-1]):
+            # Written with another cell size, so the rows are not in cell order for this one
+            return cls(
+                **{column: cls._decode(snapshot[field]) for field, column in TEXT_FIELDS},
+                **{column: snapshot[field] for field, column in NUMBER_FIELDS}
+            )
+
+        for field, column in TEXT_FIELDS + NUMBER_FIELDS:
+            setattr(index, column, snapshot[field])
+        return index
+
+    def save(self, path):
+        """
+        Write the index to a snapshot file (a numpy structured array in ``.npy`` format).
+
+        The file is written next to ``path`` and renamed over it, so processes mapping the old snapshot
+        keep reading it unchanged and new mappings only ever see a complete file.
+        """
+        path = Path(path)
+        text = {field: np.char.encode(getattr(self, column).astype(str), 'utf-8') for field, column in TEXT_FIELDS}
+        dtype = [(field, f'S{max(values.itemsize, 1)}') for field, values in text.items()]
+        dtype += [(field, np.float64) for field, _ in NUMBER_FIELDS]
+
+        snapshot = np.empty(len(self), dtype=dtype)
+        for field, values in text.items():
+            snapshot[field] = values
+        for field, column in NUMBER_FIELDS:
+            snapshot[field] = getattr(self, column)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        try:
+            with open(temporary, 'wb') as f:
+                np.save(f, snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, path)
+        finally:
+            temporary.unlink(missing_ok=True)
+
+    @staticmethod
+    def _snapshot_identity(path: Path):
+        stat = path.stat()
+        return stat.st_ino, stat.st_mtime_ns
+
+    @classmethod
+    def _load(cls):
+        """Map the configured snapshot if it was replaced since it was last mapped, else build from the database."""
+        path = get_snapshot_path()
+        if path is not None and path.exists():
+            identity = cls._snapshot_identity(path)
+            if cls._instance is None or cls._snapshot != identity:
+                cls._instance, cls._snapshot = cls.from_snapshot(path), identity
+                logger.info(f"Mapped station snapshot {path} with {len(cls._instance)} stations")
+            return
+
+        cls._instance, cls._snapshot = cls.from_queryset(), None
+        logger.info(f"Built station index with {len(cls._instance)} stations")
+
+    @classmethod
+    def get(cls) -> 'StationIndex':
+        """Return the process-wide index, (re)loading it on first use and whenever station data changed."""
+        revision = get_station_revision()
+        if cls._instance is None or cls._revision != revision:
+            with cls._lock:
+                if cls._instance is None or cls._revision != revision:
+                    cls._load()
+                    cls._revision = revision
+        return cls._instance
+
+    @classmethod
+    def preload(cls) -> bool:
+        """
+        Map the configured snapshot into this process, returning whether there was one.
+
+        Called from ``RoutingConfig.ready`` so a server that preloads the application maps the snapshot
+        once before forking its workers. It touches neither the database nor the cache.
+        """
+        path = get_snapshot_path()
+        if path is None or not path.exists():
+            return False
+        with cls._lock:
+            cls._snapshot = cls._snapshot_identity(path)
+            cls._instance = cls.from_snapshot(path)
+        return True
+
+    @classmethod
+    def publish(cls):
+        """
+        Write a fresh snapshot from the database when one is configured and drop the process-wide index.
+
+        Must run after station changes are committed and before the station revision is bumped, so every
+        process reloading on the new revision maps the new snapshot.
+        """
+        path = get_snapshot_path()
+        if path is not None:
+            index = cls.from_queryset()
+            index.save(path)
+            logger.info(f"Wrote station snapshot {path} with {len(index)} stations")
+        cls.reset()
+
+    @classmethod
+    def reset(cls):
+        """Drop the process-wide index so the next ``get`` reloads it."""
+        with cls._lock:
+            cls._instance = None
+            cls._snapshot = None
+
+    def _cell_rows(self, latitudes):
+        return np.floor((np.asarray(latitudes) + 90) / self.cell_size).astype(np.int64)
+
+    def _cell_columns(self, longitudes):
+        return np.floor((np.asarray(longitudes) + 180) / self.cell_size).astype(np.int64)
+
+    def _cell_keys(self, latitudes, longitudes):
+        columns = int(np.ceil(360 / self.cell_size)) + 1
+        return self._cell_rows(latitudes) * columns + self._cell_columns(longitudes)
+
+    def _candidates(self, lat: float, lon: float, max_distance: float) -> np.ndarray:
+        """Indices of stations in the grid cells overlapping the search radius around a point."""
+        lat_span, lon_span = degrees_for_miles(max_distance, lat)
+        columns = int(np.ceil(360 / self.cell_size)) + 1
+
+        row_lo, row_hi = self._cell_rows([lat - lat_span, lat + lat_span])
+        col_lo, col_hi = self._cell_columns([lon - lon_span, lon + lon_span])
+
+        rows = np.arange(row_lo, row_hi + 1)
+        starts = np.searchsorted(self.keys, rows * columns + col_lo, side='left')
+        ends = np.searchsorted(self.keys, rows * columns + col_hi, side='right')
+
+        slices = [np.arange(s, e) for s, e in zip(starts, ends) if e > s]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def query(
+            self,
+            points: List[SamplePoint],
+            *,
+            max_distance: float = 25,
+            limit: Optional[int] = 20
+    ) -> List[List[FuelStop]]:
+        """
+        Find the cheapest stations within ``max_distance`` miles of each point.
+        :param points: Sample points to search around.
+        :param max_distance: Search radius in miles.
+        :param limit: Maximum number of stations per point, cheapest first. None for no limit.
+        :return: One list of FuelStops per point, sorted by price.
+        """
+        return self.search(points, max_distance=max_distance, limit=limit).by_segment(len(points))
+
+    def search(
+            self,
+            points: List[SamplePoint],
+            *,
+            max_distance: float = 25,
+            limit: Optional[int] = 20
+    ) -> StopTable:
+        """
+        Columnar version of ``query``: the stations found for every point in one ``StopTable``.
+
+        All candidates for all points are measured in one vectorized distance call. Rows are grouped by
+        point, cheapest first, with ``segment_indices`` holding the index of the point and
+        ``distances_from_start`` the point's ``distance_from_start``.
+        """
+        if not points or not len(self):
+            return self._table(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64), points)
+
+        candidates = [self._candidates(p.latitude, p.longitude, max_distance) for p in points]
+        owners = np.repeat(np.arange(len(points)), [len(c) for c in candidates])
+        indices = np.concatenate(candidates)
+
+        point_lats = np.array([p.latitude for p in points])[owners]
+        point_lons = np.array([p.longitude for p in points])[owners]
+        distances = haversine_miles(point_lats, point_lons, self.latitudes[indices], self.longitudes[indices])
+
+        within = distances <= max_distance
+        owners, indices, distances = owners[within], indices[within], distances[within]
+
+        # Group by point, cheapest first within each point
+        order = np.lexsort((self.prices[indices], owners))
+        owners, indices, distances = owners[order], indices[order], distances[order]
+
+        if limit is not None:
+            ranks = np.arange(len(owners)) - np.searchsorted(owners, owners)
+            keep = ranks < limit
+            owners, indices, distances = owners[keep], indices[keep], distances[keep]
+
+        return self._table(indices, distances, owners, points)
+
+    def _table(self, indices: np.ndarray, distances: np.ndarray, owners: np.ndarray, points) -> StopTable:
+        starts = np.array([p.distance_from_start for p in points], dtype=np.float64)
+        return StopTable(
+            ids=self._text(self.ids, indices),
+            names=self._text(self.names, indices),
+            addresses=self._text(self.addresses, indices),
+            cities=self._text(self.cities, indices),
+            states=self._text(self.states, indices),
+            prices=self.prices[indices],
+            latitudes=self.latitudes[indices],
+            longitudes=self.longitudes[indices],
+            distances_from_point=distances,
+            distances_from_start=starts[owners],
+            segment_indices=owners
+        )
+
+    @staticmethod
+    def _decode(values: np.ndarray) -> np.ndarray:
+        return np.array([value.decode() for value in values.tolist()], dtype=object)
+
+    def _text(self, column: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        values = column[indices]
+        return self._decode(values) if values.dtype.kind == 'S' else values
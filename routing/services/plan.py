@@ -0,0 +1,337 @@
+import asyncio
+import contextvars
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+
+from routing.client import RoutingClient, AsyncRoutingClient
+from routing.data import Coordinate, FuelStop, RouteData, SamplePoint
+from routing.utils.cache import get_station_revision, single_flight, asingle_flight, tiered_cache
+from routing.utils.map import cache_map_html, get_cached_map_html, render_map_html, simplify_route
+from routing.utils.route import make_response
+from routing.utils.timing import record_cache, stage
+from .geolocation import GeoLocationService, AsyncGeoLocationService, LocationServiceType
+from .route import RouteService
+from .station import StationService
+
+logger = logging.getLogger('routing')
+
+# Simplified route geometry kept in cached plans for their map, see ``PlanService.get_map_html``
+MAP_ROUTE_KEY = '_map_route'
+
+
+class RouteNotFoundError(Exception):
+    """Raised when no route exists between the requested locations."""
+
+
+class PlanService:
+    """Runs the route planning pipeline: geocoding, routing, station lookup, optimization and response."""
+
+    batch_workers = 8  # Worker threads used by plan_batch
+    plan_cache_timeout = 3600
+
+    def __init__(self, *, geolocation=None, client=None, route_service: RouteService = None):
+        self.geolocation = geolocation or GeoLocationService.shared(LocationServiceType.GAZETTEER)
+        self.client = client or RoutingClient.shared()
+        self.route_service = route_service or RouteService()
+
+    def plan(self, *, start: str, finish: str, include_map: bool = False) -> dict:
+        """
+        Plan a route with fuel stops between two addresses.
+        :param start: The starting address.
+        :param finish: The finish address.
+        :param include_map: Embed the base64 map HTML in the response.
+        :return: Returns the API response for the plan.
+        :raises RouteNotFoundError: If no route was found.
+        """
+        with stage('plan') as current:
+            plan_id = self.get_plan_id(start=start, finish=finish, include_map=include_map)
+
+            def compute():
+                current.cache = 'miss'
+                return self.compute_plan(start=start, finish=finish, include_map=include_map, plan_id=plan_id)
+
+            response = single_flight(self.get_plan_cache_key(plan_id), compute, timeout=self.plan_cache_timeout)
+            current.cache = current.cache or 'hit'
+        return self.with_names(response, start=start, finish=finish)
+
+    def compute_plan(self, *, start: str, finish: str, include_map: bool = False, plan_id: str = None) -> dict:
+        """Plan a route without the plan cache. ``plan_id`` is the id the plan is cached under, if any."""
+        start_location = self.geocode(start)
+        finish_location = self.geocode(finish)
+
+        with stage('route'):
+            route = self.client.get_route(from_location=start_location, to_location=finish_location)
+        if not route:
+            raise RouteNotFoundError(f"No route found from {start} to {finish}")
+
+        return self.build_plan(
+            start=start, finish=finish, start_location=start_location, finish_location=finish_location, route=route,
+            include_map=include_map, plan_id=plan_id
+        )
+
+    def plan_batch(self, lanes: List[Tuple[str, str]]) -> List[dict]:
+        """
+        Plan many lanes at once.
+
+        Identical addresses are geocoded once and identical routes fetched once. Distinct geocodes, routes
+        and plans each run concurrently on a worker pool. Plans share the plan cache with ``plan``.
+        :param lanes: List of (start, finish) address pairs.
+        :return: One result per lane in input order, either ``{'status': 200, 'plan': {...}}`` or
+            ``{'status': <code>, 'error': <message>}``.
+        """
+        with ThreadPoolExecutor(max_workers=self.batch_workers) as pool:
+            addresses = {}
+            for lane in lanes:
+                for address in lane:
+                    addresses.setdefault(self.normalize_address(address), address)
+            locations = self._run_all(pool, lambda key: self.geocode(addresses[key]), addresses)
+
+            def lane_locations(lane):
+                return locations[self.normalize_address(lane[0])], locations[self.normalize_address(lane[1])]
+
+            route_keys = {
+                lane_locations(lane) for lane in lanes
+                if not any(isinstance(location, Exception) for location in lane_locations(lane))
+            }
+            routes = self._run_all(pool, self._get_route, route_keys)
+
+            plan_keys = {}
+            for start, finish in lanes:
+                plan_keys.setdefault((self.normalize_address(start), self.normalize_address(finish)), (start, finish))
+            plans = self._run_all(pool, lambda key: self._build_lane(*plan_keys[key], locations, routes), plan_keys)
+
+        results = []
+        for start, finish in lanes:
+            plan = plans[(self.normalize_address(start), self.normalize_address(finish))]
+            if isinstance(plan, RouteNotFoundError):
+                results.append({'status': 404, 'error': 'No route found'})
+            elif isinstance(plan, Exception):
+                results.append({'status': 500, 'error': str(plan)})
+            else:
+                results.append({'status': 200, 'plan': plan})
+        return results
+
+    @staticmethod
+    def normalize_address(address: str) -> str:
+        return ' '.join(address.split()).lower()
+
+    def get_plan_id(self, *, start: str, finish: str, include_map: bool) -> str:
+        """
+        Id of a whole plan response, which it is cached under and its map is fetched with.
+
+        Covers the normalized addresses, every vehicle and lookup parameter and the station data revision, so
+        any price change starts a fresh set of plans.
+        """
+        service = self.route_service
+        params = (
+            get_station_revision(), self.normalize_address(start), self.normalize_address(finish), include_map,
+            service.vehicle_range, service.mpg, service.search_radius, int(service.lookup_type), int(service.optimizer)
+        )
+        return hashlib.md5(repr(params).encode()).hexdigest()
+
+    @staticmethod
+    def get_plan_cache_key(plan_id: str) -> str:
+        return f"plan:{plan_id}"
+
+    @staticmethod
+    def with_names(response: dict, *, start: str, finish: str) -> dict:
+        """
+        Label a (possibly cached) response with the addresses as this request spelled them, leaving out the
+        geometry kept for its map.
+        """
+        return {
+            **{key: value for key, value in response.items() if key != MAP_ROUTE_KEY},
+            'start': {**response['start'], 'name': start},
+            'finish': {**response['finish'], 'name': finish},
+        }
+
+    def get_map_html(self, plan_id: str) -> Optional[str]:
+        """
+        Map HTML of a plan, or None once the plan has expired.
+
+        The map is rendered on its first request from the simplified geometry and stops kept in the cached
+        plan, without calling the routing upstream, and then kept for ``MAP_CACHE_TIMEOUT`` seconds.
+        """
+        html = get_cached_map_html(plan_id)
+        if html is not None:
+            return html
+
+        plan = tiered_cache.get(self.get_plan_cache_key(plan_id))
+        if not plan or MAP_ROUTE_KEY not in plan:
+            return None
+        html = render_map_html(RouteData.from_cache(plan[MAP_ROUTE_KEY]), [FuelStop(**stop) for stop in plan['stops']])
+        cache_map_html(plan_id, html)
+        return html
+
+    @staticmethod
+    def _run_all(pool: ThreadPoolExecutor, func: Callable, keys: Iterable[Hashable]) -> Dict:
+        """
+        Run ``func`` for every key on the pool, returning results or raised exceptions by key.
+
+        Each task runs in its own copy of the caller's context, so stages it times are added to the request's
+        ``Server-Timing`` header.
+        """
+        def run(key):
+            try:
+                return func(key)
+            except Exception as e:
+                logger.warning(f"Batch task failed for {key}: {e}")
+                return e
+            finally:
+                # Worker threads each open their own connection; don't leave them behind
+                connection.close()
+
+        keys = list(keys)
+        futures = [pool.submit(contextvars.copy_context().run, run, key) for key in keys]
+        return {key: future.result() for key, future in zip(keys, futures)}
+
+    def _get_route(self, key: Tuple[Coordinate, Coordinate]) -> RouteData:
+        with stage('route'):
+            route = self.client.get_route(from_location=key[0], to_location=key[1])
+        if not route:
+            raise RouteNotFoundError(f"No route found from {key[0]} to {key[1]}")
+        return route
+
+    def _build_lane(self, start: str, finish: str, locations: Dict, routes: Dict) -> dict:
+        start_location = locations[self.normalize_address(start)]
+        finish_location = locations[self.normalize_address(finish)]
+        for result in (start_location, finish_location, routes.get((start_location, finish_location))):
+            if isinstance(result, Exception):
+                raise result
+
+        plan_id = self.get_plan_id(start=start, finish=finish, include_map=False)
+        response = single_flight(
+            self.get_plan_cache_key(plan_id),
+            lambda: self.build_plan(
+                start=start, finish=finish, start_location=start_location, finish_location=finish_location,
+                route=routes[(start_location, finish_location)], plan_id=plan_id
+            ),
+            timeout=self.plan_cache_timeout
+        )
+        return self.with_names(response, start=start, finish=finish)
+
+    def geocode(self, location: str) -> Coordinate:
+        with stage('geocode'):
+            coordinate = self.geolocation.geocode(location)
+        if coordinate is None:
+            raise ValueError(f"Could not geocode location: {location}")
+        return coordinate
+
+    def get_route_points(self, *, start: str, finish: str, route: RouteData) -> Optional[List[SamplePoint]]:
+        """Get sample points along the route, or None when the station lookup does not need them."""
+        # Corridor lookups search along the route line itself, so sample points are only needed otherwise
+        if self.route_service.lookup_type.is_corridor:
+            return None
+
+        # Get sample stop points with caching
+        cache_key = f"route_points:{hashlib.md5(f'{start}:{finish}'.encode()).hexdigest()}"
+        route_points = tiered_cache.get(cache_key)
+        record_cache(bool(route_points))
+
+        if not route_points:
+            route_points = StationService.get_sample_points_along_route(
+                with_coordinates=route.coordinates
+            )
+            tiered_cache.set(cache_key, [p.__dict__ for p in route_points], timeout=3600)
+        else:
+            route_points = [SamplePoint(**p) for p in route_points]
+
+        return route_points
+
+    def build_plan(
+            self, *,
+            start: str,
+            finish: str,
+            start_location: Coordinate,
+            finish_location: Coordinate,
+            route: RouteData,
+            include_map: bool = False,
+            plan_id: str = None
+    ) -> dict:
+        """
+        Find the optimal fuel stops for a route and build the API response.
+
+        The response links the plan's map when ``plan_id`` is given, and keeps the route simplified for the
+        map so it can be rendered from the cached plan when it is first requested, see ``get_map_html``.
+        """
+        with stage('sampling'):
+            route_points = self.get_route_points(start=start, finish=finish, route=route)
+
+        result = self.route_service.get_optimized_stops_for_route(
+            with_points=route_points,
+            total_distance=route.distance,
+            route=route
+        )
+        logger.info(f"Route planned successfully: {route.distance} miles")
+
+        with stage('map'):
+            map_route = simplify_route(route) if plan_id or include_map else None
+            response = make_response(
+                route=route, fuel_stops=result.stops, total_cost=result.cost, total_gallons=result.gallons,
+                message="Successful", plan_id=plan_id, map_route=map_route if include_map else None
+            )
+            if plan_id:
+                response[MAP_ROUTE_KEY] = map_route.to_cache()
+        response.update({
+            'start': {'lat': start_location.latitude, 'lon': start_location.longitude, 'name': start},
+            'finish': {'lat': finish_location.latitude, 'lon': finish_location.longitude, 'name': finish},
+        })
+        return response
+
+
+class AsyncPlanService(PlanService):
+    """
+    Asyncio variant of PlanService.
+
+    Both endpoints are geocoded concurrently (including their cache lookups) and routing is awaited on a
+    pooled connection, so one worker can hold many plans waiting on upstreams. The CPU and database bound
+    stages run in Django's sync worker thread.
+    """
+
+    def __init__(self, *, geolocation=None, client=None, route_service: RouteService = None):
+        super().__init__(
+            geolocation=geolocation or AsyncGeoLocationService.shared(LocationServiceType.GAZETTEER),
+            client=client or AsyncRoutingClient.shared(),
+            route_service=route_service
+        )
+
+    async def ageocode(self, location: str) -> Coordinate:
+        with stage('geocode'):
+            coordinate = await self.geolocation.ageocode(location)
+        if coordinate is None:
+            raise ValueError(f"Could not geocode location: {location}")
+        return coordinate
+
+    async def aplan(self, *, start: str, finish: str, include_map: bool = False) -> dict:
+        """Async version of ``plan``."""
+        with stage('plan') as current:
+            plan_id = await sync_to_async(self.get_plan_id)(start=start, finish=finish, include_map=include_map)
+
+            def compute():
+                current.cache = 'miss'
+                return self.acompute_plan(start=start, finish=finish, include_map=include_map, plan_id=plan_id)
+
+            response = await asingle_flight(self.get_plan_cache_key(plan_id), compute, timeout=self.plan_cache_timeout)
+            current.cache = current.cache or 'hit'
+        return self.with_names(response, start=start, finish=finish)
+
+    async def acompute_plan(
+            self, *, start: str, finish: str, include_map: bool = False, plan_id: str = None
+    ) -> dict:
+        """Async version of ``compute_plan``."""
+        start_location, finish_location = await asyncio.gather(self.ageocode(start), self.ageocode(finish))
+
+        with stage('route'):
+            route = await self.client.get_route(from_location=start_location, to_location=finish_location)
+        if not route:
+            raise RouteNotFoundError(f"No route found from {start} to {finish}")
+
+        return await sync_to_async(self.build_plan)(
+            start=start, finish=finish, start_location=start_location, finish_location=finish_location, route=route,
+            include_map=include_map, plan_id=plan_id
+        )
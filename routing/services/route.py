@@ -1,55 +1,113 @@
+import enum
 import logging
-from typing import List, Dict
+from typing import List
 
-from .station import StationService
-from routing.data import SamplePoint, FuelStop, OptimizedRouteResult
+import numpy as np
+
+from .candidates import CandidateTable
+from .station import StationService, StationLookupType
+from routing.data import SamplePoint, FuelStop, OptimizedRouteResult, RouteData
+from routing.utils.timing import stage
 
 logger = logging.getLogger('routing.route')
 
 
+class OptimizerType(enum.IntEnum):
+    GREEDY = 0
+    NEXT_CHEAPER = 1
+
+    @property
+    def is_greedy(self):
+        return self == OptimizerType.GREEDY
+
+    @property
+    def is_next_cheaper(self):
+        return self == OptimizerType.NEXT_CHEAPER
+
+
 class RouteService:
 
     def __init__(
             self, *,
             vehicle_range: float = 500,
             mpg: float = 10,
-            search_radius: float = 25  # Miles off route to search
+            search_radius: float = 25,  # Miles off route to search
+            lookup_type: StationLookupType = StationLookupType.CORRIDOR,
+            optimizer: OptimizerType = OptimizerType.NEXT_CHEAPER
     ):
         self.vehicle_range = vehicle_range
         self.mpg = mpg
         self.tank_capacity = vehicle_range / mpg
         self.search_radius = search_radius
         self.reserve_miles = 50  # Safety reserve
+        self.lookup_type = lookup_type
+        self.optimizer = optimizer
 
 
     def get_optimized_stops_for_route(
             self, *,
-            with_points: List[SamplePoint],
+            with_points: List[SamplePoint] = None,
             total_distance: float,
-            current_fuel_level: float = 1
+            current_fuel_level: float = 1,
+            route: RouteData = None
     ) -> OptimizedRouteResult:
         """
         Find optimal fuel stops along the route.
 
         Args:
-            with_points: List of SamplePoints along route
+            with_points: List of SamplePoints along route (not needed for corridor lookups)
             total_distance: Total route distance in miles
             current_fuel_level: Starting fuel as fraction of tank (0-1)
+            route: The route itself, required for corridor lookups
 
         Returns:
             List of recommended FuelStop objects
         """
         logger.info(f"Optimizing fuel stops for {total_distance} mile route")
+        current_miles = current_fuel_level * self.tank_capacity * self.mpg
+
+        # Build index of stops near each route point
+        with stage('stations'):
+            if self.lookup_type.is_corridor:
+                if route is None:
+                    raise ValueError("A route is required for corridor station lookups")
+                candidates = StationService.index_stops_for_corridor(
+                    route=route, max_distance=self.search_radius
+                )
+            else:
+                candidates = StationService.index_stops_for_route(
+                    with_points=with_points, lookup_type=self.lookup_type
+                )
+
+        with stage('optimize'):
+            if self.optimizer.is_greedy:
+                result = self._optimize_greedy(
+                    candidates=candidates, total_distance=total_distance, current_miles=current_miles
+                )
+            else:
+                result = self._optimize_next_cheaper(
+                    candidates=candidates, total_distance=total_distance, current_miles=current_miles
+                )
+
+        logger.info(f"Optimized route: {len(result.stops)} stops, ${round(result.cost, 2)} total cost")
+        return result
+
+
+    def _optimize_greedy(
+            self, *,
+            candidates: CandidateTable,
+            total_distance: float,
+            current_miles: float
+    ) -> OptimizedRouteResult:
+        """
+        Legacy greedy optimizer: repeatedly stop at the cheapest station before the fuel runs out and buy
+        enough to reach a station at least 5% cheaper.
+        """
         stops = []
         total_gallons = 0
         total_cost = 0
-
-        current_miles = current_fuel_level * self.tank_capacity * self.mpg
         distance_traveled = 0
 
-        # Build index of stops near each route point
-        stops_by_segment = StationService.index_stops_by_segment_for_route(with_points=with_points)
-
         while distance_traveled < total_distance:
             # Calculate when we need to refuel
             safe_range = current_miles - self.reserve_miles
@@ -61,7 +119,7 @@ class RouteService:
 
             # Find best stop before we must refuel
             best_stop = StationService.find_best_stop_in_range(
-                stops_by_segment=stops_by_segment,
+                candidates=candidates,
                 start_distance=distance_traveled,
                 max_distance=must_fuel_by,
                 total_distance=total_distance
@@ -79,7 +137,7 @@ class RouteService:
             # Look ahead for cheaper options
             gallons_needed = self._calculate_optimal_gallons(
                 current_stop=best_stop,
-                stops_by_segment=stops_by_segment,
+                candidates=candidates,
                 current_distance=stop_distance,
                 current_fuel_miles=current_miles,
                 total_distance=total_distance
@@ -99,14 +157,83 @@ class RouteService:
             current_miles += gallons_needed * self.mpg
             distance_traveled = stop_distance
 
-        logger.info(f"Optimized route: {len(stops)} stops, ${round(total_cost, 2)} total cost")
+        return OptimizedRouteResult(stops=stops, cost=total_cost, gallons=total_gallons)
+
+
+    def _optimize_next_cheaper(
+            self, *,
+            candidates: CandidateTable,
+            total_distance: float,
+            current_miles: float
+    ) -> OptimizedRouteResult:
+        """
+        Cost-optimal refuelling plan in O(n log n).
+
+        Candidates come sorted by distance along the route and the next strictly cheaper stop of each
+        candidate is precomputed with a monotonic stack, treating the destination as the cheapest stop.
+        At each stop, if the next cheaper stop is within range, buy just enough fuel to reach it and drive
+        there; otherwise fill up and drive to the following stop. Fuel is tracked in miles and the tank
+        never drops below the reserve.
+        """
+        table = candidates.table
+        rows = np.flatnonzero((table.distances_from_start >= 0) & (table.distances_from_start < total_distance))
+        positions = table.distances_from_start[rows].tolist() + [total_distance]
+        prices = table.prices[rows].tolist() + [float('-inf')]
+        count = len(rows)
+
+        next_cheaper = [count] * (count + 1)
+        stack = []
+        for i in range(count, -1, -1):
+            while stack and prices[stack[-1]] >= prices[i]:
+                stack.pop()
+            if stack:
+                next_cheaper[i] = stack[-1]
+            stack.append(i)
+
+        usable_range = self.tank_capacity * self.mpg - self.reserve_miles
+        fuel = current_miles - self.reserve_miles
+
+        stops = []
+        total_gallons = 0
+        total_cost = 0
+
+        if positions[0] > fuel:
+            logger.warning("No fuel stop found at distance 0")
+            return OptimizedRouteResult(stops=stops, cost=total_cost, gallons=total_gallons)
+
+        i = 0
+        fuel -= positions[0]
+        while i < count:
+            target = next_cheaper[i]
+            if positions[target] - positions[i] <= usable_range:
+                # A cheaper stop (or the destination) is in range: buy only enough to get there
+                purchase = max(0.0, positions[target] - positions[i] - fuel)
+            else:
+                # Nothing cheaper in range: fill up and move on to the next stop
+                target = i + 1
+                purchase = usable_range - fuel
+                if positions[target] - positions[i] > usable_range:
+                    logger.warning(f"No fuel stop found at distance {positions[i]}")
+                    break
+
+            if purchase > 1e-9:
+                gallons = purchase / self.mpg
+                stop = table.stop(rows[i], gallons=round(gallons, 2), cost=round(gallons * prices[i], 2))
+                total_gallons += gallons
+                total_cost += stop.cost
+                stops.append(stop)
+                logger.debug(f"Added stop at {stop.distance_from_start} miles: {stop.name}, ${stop.cost}")
+
+            fuel += purchase - (positions[target] - positions[i])
+            i = target
+
         return OptimizedRouteResult(stops=stops, cost=total_cost, gallons=total_gallons)
 
 
     def _calculate_optimal_gallons(
         self, *,
         current_stop: FuelStop,
-        stops_by_segment: Dict[int, List[FuelStop]],
+        candidates: CandidateTable,
         current_distance: float,
         current_fuel_miles: float,
         total_distance: float
@@ -119,16 +246,10 @@ class RouteService:
         max_range = self.tank_capacity * self.mpg
 
         # Look ahead for cheaper stops
-        cheaper_stop_distance = None
-        look_ahead_range = current_distance + max_range
-
-        for seg_idx, stops in stops_by_segment.items():
-            for stop in stops:
-                route_dist = stop.distance_from_start
-                if current_distance < route_dist <= look_ahead_range:
-                    if stop.price < current_price * 0.95:  # 5% cheaper threshold
-                        if cheaper_stop_distance is None or route_dist < cheaper_stop_distance:
-                            cheaper_stop_distance = route_dist
+        cheaper_stop = candidates.first_cheaper_after(
+            current_distance, current_price * 0.95, max_distance=current_distance + max_range  # 5% cheaper threshold
+        )
+        cheaper_stop_distance = cheaper_stop.distance_from_start if cheaper_stop else None
 
         # Calculate gallons needed
         remaining_distance = total_distance - current_distance
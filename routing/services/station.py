@@ -1,29 +1,163 @@
+import enum
 import hashlib
-from typing import List, Dict, Optional
-from django.core.cache import cache
-from django.contrib.gis.geos import Point
-from django.contrib.gis.measure import D
-from django.contrib.gis.db.models.functions import Distance
+from typing import Iterable, List, Optional, Tuple, Union
+import numpy as np
+from django.db import connection
 # from django.contrib.gis.geos import GEOSGeometry
-from geopy.distance import geodesic
 
-from routing.models import FuelStation
-from routing.data import Coordinate, FuelStop, SamplePoint
+from routing.models import CheapestStation, FuelStation
+from routing.data import Coordinate, FuelStop, SamplePoint, RouteData, RouteGeometry, StopTable
+from routing.utils.geo import haversine_miles, segment_lengths_miles
+from routing.utils.cache import (
+    Cell, get_station_generation, get_cell_versions, cells_near, lookup_cell_area, lookup_cell_for, lookup_cells_near,
+    tiered_cache
+)
+from routing.utils.timing import record_cache
+from .candidates import CandidateTable
+from .index import StationIndex
+
+
+class StationLookupType(enum.IntEnum):
+    SAMPLE_POINTS = 0
+    INDEX = 1
+    CORRIDOR = 2
+
+    @property
+    def is_sample_points(self):
+        return self == StationLookupType.SAMPLE_POINTS
+
+    @property
+    def is_index(self):
+        return self == StationLookupType.INDEX
+
+    @property
+    def is_corridor(self):
+        return self == StationLookupType.CORRIDOR
+
+
+METERS_PER_MILE = 1609.34
+
+PRECOMPUTED_DISTANCE = 25  # Search radius in miles the cheapest stations table is built for
+CHEAPEST_STATIONS_PER_CELL = 40
+
+CORRIDOR_QUERY = """
+    WITH route AS (
+        SELECT ST_GeomFromWKB(%(line)s, 4326) AS line
+    ), candidates AS (
+        SELECT s.opis_id, s.name, s.address, s.city, s.state, s.price, s.location,
+               ST_LineLocatePoint(route.line, s.location::geometry) AS fraction,
+               ST_Distance(s.location, route.line::geography) AS off_route
+        FROM {table} s, route
+        WHERE ST_DWithin(s.location, route.line::geography, %(radius)s)
+    )
+    SELECT c.opis_id, c.name, c.address, c.city, c.state, c.price,
+           ST_Y(c.location::geometry), ST_X(c.location::geometry),
+           ST_Length(ST_LineSubstring(route.line, 0, c.fraction)::geography) AS along_route,
+           c.off_route
+    FROM candidates c, route
+    ORDER BY along_route, c.price
+"""
+
+# Stations within radius of each area; WITH ORDINALITY numbers the areas from 1
+NEARBY_QUERY = """
+    SELECT p.area, s.opis_id, s.name, s.address, s.city, s.state, s.price,
+           ST_Y(s.location::geometry), ST_X(s.location::geometry)
+    FROM unnest(%(latitudes)s::float8[], %(longitudes)s::float8[], %(radii)s::float8[])
+        WITH ORDINALITY AS p(lat, lon, radius, area)
+    JOIN {table} s ON ST_DWithin(s.location, ST_MakePoint(p.lon, p.lat)::geography, p.radius)
+    ORDER BY p.area, s.price
+"""
+
+# Precomputed cheapest stations of each lookup cell, cheapest first
+CHEAPEST_QUERY = """
+    SELECT p.cell, s.opis_id, s.name, s.address, s.city, s.state, s.price,
+           ST_Y(s.location::geometry), ST_X(s.location::geometry)
+    FROM unnest(%(rows)s::int[], %(cols)s::int[]) WITH ORDINALITY AS p(cell_row, cell_col, cell)
+    JOIN {cheapest} c
+      ON c.max_distance = %(max_distance)s AND c.cell_row = p.cell_row AND c.cell_col = p.cell_col
+    JOIN {table} s ON s.id = c.station_id
+    ORDER BY p.cell, c.rank
+"""
+
+DELETE_CHEAPEST = """
+    DELETE FROM {cheapest} c
+    USING unnest(%(rows)s::int[], %(cols)s::int[]) AS p(cell_row, cell_col)
+    WHERE c.max_distance = %(max_distance)s AND c.cell_row = p.cell_row AND c.cell_col = p.cell_col
+"""
+
+INSERT_CHEAPEST = """
+    INSERT INTO {cheapest} (max_distance, cell_row, cell_col, rank, station_id)
+    SELECT %(max_distance)s, p.cell_row, p.cell_col, s.rank, s.id
+    FROM unnest(
+        %(rows)s::int[], %(cols)s::int[], %(latitudes)s::float8[], %(longitudes)s::float8[], %(radii)s::float8[]
+    ) AS p(cell_row, cell_col, lat, lon, radius)
+    CROSS JOIN LATERAL (
+        SELECT station.id, row_number() OVER (ORDER BY station.price, station.id) AS rank
+        FROM {table} station
+        WHERE ST_DWithin(station.location, ST_MakePoint(p.lon, p.lat)::geography, p.radius)
+        ORDER BY station.price, station.id
+        LIMIT %(limit)s
+    ) s
+"""
 
 
 class StationService:
 
     @staticmethod
     def get_sample_points_along_route(
-            with_coordinates: List[Coordinate],
+            with_coordinates: Union[RouteGeometry, List[Coordinate]],
             at_intervals: float = 100
     ) -> List[SamplePoint]:
         """
         Get sample points along the route at regular intervals.
+
+        All segment lengths are computed in one vectorized call (see ``segment_lengths_miles``) and each
+        sample is located on the cumulative distance with ``searchsorted``. Distances match
+        ``get_sample_points_along_route_geodesic`` to within 1e-6 relative error for road geometries.
+        :param with_coordinates: The route geometry (or list of coordinates)
+        :param at_intervals: The interval in miles to locate sample points. Default is 100.
+        :return Returns list of SamplePoints.
+        """
+        geometry = RouteGeometry.of(with_coordinates)
+        latitudes, longitudes = geometry.latitudes, geometry.longitudes
+
+        segments = segment_lengths_miles(latitudes, longitudes)
+        cumulative = np.concatenate(([0.0], np.cumsum(segments)))
+        total_distance = float(cumulative[-1])
+
+        targets = at_intervals * np.arange(1, int(total_distance // at_intervals) + 1)
+        # Index of the first coordinate at or past each target; the sample lies on the segment ending there
+        ends = np.searchsorted(cumulative, targets, side='left')
+        starts = ends - 1
+        ratios = (targets - cumulative[starts]) / segments[starts]
+        sample_lats = latitudes[starts] + ratios * (latitudes[ends] - latitudes[starts])
+        sample_lons = longitudes[starts] + ratios * (longitudes[ends] - longitudes[starts])
+
+        points = [SamplePoint(latitude=float(latitudes[0]), longitude=float(longitudes[0]), distance_from_start=0)]
+        points.extend(
+            SamplePoint(latitude=float(lat), longitude=float(lon), distance_from_start=float(d))
+            for lat, lon, d in zip(sample_lats, sample_lons, targets)
+        )
+        points.append(SamplePoint(
+            latitude=float(latitudes[-1]), longitude=float(longitudes[-1]), distance_from_start=total_distance
+        ))
+
+        return points
+
+    @staticmethod
+    def get_sample_points_along_route_geodesic(
+            with_coordinates: List[Coordinate],
+            at_intervals: float = 100
+    ) -> List[SamplePoint]:
+        """
+        Get sample points along the route at regular intervals, measuring every segment with geopy.
+        Reference implementation for ``get_sample_points_along_route``.
         :param with_coordinates: The list of coordinates from the route
         :param at_intervals: The interval in miles to locate sample points. Default is 100.
         :return Returns list of SamplePoints.
         """
+        from geopy.distance import geodesic
+
         points = []
         cumulative_distance = 0
         last_sample_distance = 0
@@ -70,75 +204,266 @@ class StationService:
         return points
 
 
+    @staticmethod
+    def get_stops_cache_key(*, cell: Cell, max_distance: float, generation: int, versions) -> str:
+        # Keyed on the versions of the cells the search area touches, so price updates elsewhere keep this entry
+        versions_hash = hashlib.md5(f'{versions}'.encode()).hexdigest()
+        return f"nearby:{generation}:{max_distance}:{cell[0]}:{cell[1]}:{versions_hash}"
+
     @staticmethod
     def find_nearby_stops_for_point(*, lat: float, lon: float, max_distance: float = 25) -> List[FuelStop]:
         """Find truck stops within radius of a point."""
-        cache_key = f"stops:{hashlib.md5(f'{lat},{lon},{max_distance}'.encode()).hexdigest()}"
-        cached = cache.get(cache_key)
-        if cached:
-            return [FuelStop(**s) for s in cached]
-
-        nearby = []
-        ref_point = Point(lon, lat)
-
-        stations = FuelStation.objects.filter(
-            location__distance_lte=(ref_point, D(mi=max_distance))
-        ).annotate(
-            distance=Distance('location', ref_point)
-        ).order_by('price')[:20]
-
-        for station in stations:
-            nearby.append(FuelStop(
-                id=station.opis_id,
-                name=station.name,
-                address=station.address,
-                city=station.city,
-                state=station.state,
-                price=float(station.price),
-                location=f"{station.city}, {station.state}, USA",
-                latitude=station.location.y,
-                longitude=station.location.x,
-                distance_from_point=station.distance.mi
+        [stops] = StationService.find_nearby_stops_for_points(
+            [SamplePoint(latitude=lat, longitude=lon, distance_from_start=0)], max_distance=max_distance
+        )
+        return stops
+
+    @staticmethod
+    def find_nearby_stops_for_points(
+            points: List[SamplePoint],
+            *,
+            max_distance: float = 25,
+            limit: int = 20
+    ) -> List[List[FuelStop]]:
+        """
+        Find the cheapest truck stops within radius of each point.
+        :return: Returns one list of stops per point, cheapest first.
+        """
+        table = StationService.find_nearby_stop_table(points, max_distance=max_distance, limit=limit)
+        return table.by_segment(len(points))
+
+    @staticmethod
+    def find_nearby_stop_table(
+            points: List[SamplePoint],
+            *,
+            max_distance: float = 25,
+            limit: int = 20
+    ) -> StopTable:
+        """
+        Columnar version of ``find_nearby_stops_for_points``, as returned by ``StationIndex.search``.
+
+        Results are cached per cell of a fixed lookup grid sized to the search radius, not per exact point,
+        so routes sharing a stretch of highway share cached work. A cell's entry holds every station within
+        radius of any point in the cell, and each point's stops are filtered to its exact radius on read.
+        Missing cells come from the precomputed cheapest stations table (see ``refresh_cheapest_stations``)
+        with one indexed query. Only cells that are not precomputed, or whose truncated list may miss some
+        of a point's cheapest stations, are scanned, again in a single query. Cell versions and entries are
+        read in one batch each and new entries written back in one batch.
+        """
+        if not points:
+            return StationIndex.from_rows([]).search(points)
+
+        generation = get_station_generation()
+        point_cells = [lookup_cell_for(p.latitude, p.longitude, max_distance) for p in points]
+        cells = list(dict.fromkeys(point_cells))
+        areas = [lookup_cell_area(cell, max_distance) for cell in cells]
+        area_cells = [cells_near(*area) for area in areas]
+        unique_cells = list(dict.fromkeys(cell for touched in area_cells for cell in touched))
+        versions = dict(zip(unique_cells, get_cell_versions(unique_cells)))
+
+        keys = [
+            StationService.get_stops_cache_key(
+                cell=cell, max_distance=max_distance, generation=generation,
+                versions=[versions[c] for c in touched]
+            )
+            for cell, touched in zip(cells, area_cells)
+        ]
+        entries = tiered_cache.get_many(keys)
+        fresh = {}
+
+        missing = [i for i, key in enumerate(keys) if key not in entries]
+        record_cache(not missing)
+        if missing and max_distance == PRECOMPUTED_DISTANCE:
+            precomputed = StationService._query_cheapest_stations([cells[i] for i in missing], max_distance)
+            # No rows at all means the table is not built yet (or every cell is empty), which a scan tells apart
+            if any(precomputed):
+                fresh.update({
+                    keys[i]: (len(rows) < CHEAPEST_STATIONS_PER_CELL, rows) for i, rows in zip(missing, precomputed)
+                })
+                entries.update(fresh)
+
+        # A truncated entry only answers points with at least ``limit`` of its stations within radius
+        cell_points = {cell: [] for cell in cells}
+        for p, cell in zip(points, point_cells):
+            cell_points[cell].append(p)
+        scan = [
+            i for i, key in enumerate(keys)
+            if key not in entries or not (entries[key][0] or StationService._holds_cheapest(
+                entries[key][1], cell_points[cells[i]], max_distance=max_distance, limit=limit
+            ))
+        ]
+        if scan:
+            found = StationService._query_stations_near([areas[i] for i in scan])
+            scanned = {keys[i]: (True, rows) for i, rows in zip(scan, found)}
+            fresh.update(scanned)
+            entries.update(scanned)
+
+        if fresh:
+            tiered_cache.set_many(fresh, timeout=86400)
+
+        stations = {row[0]: row for key in keys for row in entries[key][1]}
+        return StationIndex.from_rows(stations.values()).search(points, max_distance=max_distance, limit=limit)
+
+    @staticmethod
+    def _query_stations_near(areas: List[tuple]) -> List[List[tuple]]:
+        """Every station within each (latitude, longitude, radius in miles) area, in one query."""
+        with connection.cursor() as cursor:
+            cursor.execute(NEARBY_QUERY.format(table=connection.ops.quote_name(FuelStation._meta.db_table)), {
+                'latitudes': [lat for lat, _, _ in areas],
+                'longitudes': [lon for _, lon, _ in areas],
+                'radii': [radius * METERS_PER_MILE for _, _, radius in areas]
+            })
+            rows = cursor.fetchall()
+
+        results = [[] for _ in areas]
+        for area, opis_id, name, address, city, state, price, lat, lon in rows:
+            results[area - 1].append((opis_id, name, address, city, state, float(price), lat, lon))
+        return results
+
+    @staticmethod
+    def _holds_cheapest(rows: List[tuple], points: List[SamplePoint], *, max_distance: float, limit: int) -> bool:
+        """Whether price sorted ``rows`` include the ``limit`` cheapest stations within radius of every point."""
+        if limit is None or len(rows) < limit:
+            return False
+        distances = haversine_miles(
+            np.array([p.latitude for p in points])[:, None], np.array([p.longitude for p in points])[:, None],
+            np.array([r[6] for r in rows])[None, :], np.array([r[7] for r in rows])[None, :]
+        )
+        return bool(((distances <= max_distance).sum(axis=1) >= limit).all())
+
+    @staticmethod
+    def _query_cheapest_stations(cells: List[Cell], max_distance: float) -> List[List[tuple]]:
+        """Precomputed cheapest stations of each lookup cell, in one indexed query."""
+        with connection.cursor() as cursor:
+            cursor.execute(CHEAPEST_QUERY.format(
+                cheapest=connection.ops.quote_name(CheapestStation._meta.db_table),
+                table=connection.ops.quote_name(FuelStation._meta.db_table)
+            ), {
+                'rows': [row for row, _ in cells],
+                'cols': [col for _, col in cells],
+                'max_distance': max_distance
+            })
+            rows = cursor.fetchall()
+
+        results = [[] for _ in cells]
+        for cell, opis_id, name, address, city, state, price, lat, lon in rows:
+            results[cell - 1].append((opis_id, name, address, city, state, float(price), lat, lon))
+        return results
+
+    @staticmethod
+    def refresh_cheapest_stations(
+            near: Optional[Iterable[Tuple[float, float]]] = None,
+            *,
+            max_distance: float = PRECOMPUTED_DISTANCE
+    ) -> int:
+        """
+        Recompute the precomputed cheapest stations of every lookup cell whose search area can contain one of
+        the ``(latitude, longitude)`` positions, or rebuild the whole table when None.
+
+        Run it in the same transaction as the station changes, so lookups never see a stale table.
+        :return: Returns the number of lookup cells recomputed.
+        """
+        cheapest = connection.ops.quote_name(CheapestStation._meta.db_table)
+        table = connection.ops.quote_name(FuelStation._meta.db_table)
+
+        # Absent cells read as having no stations, so a table that was never built is built whole
+        if near is not None and not CheapestStation.objects.filter(max_distance=max_distance).exists():
+            near = None
+
+        with connection.cursor() as cursor:
+            if near is None:
+                cursor.execute(f"DELETE FROM {cheapest} WHERE max_distance = %s", [max_distance])
+                cursor.execute(f"SELECT ST_Y(location::geometry), ST_X(location::geometry) FROM {table}")
+                near = cursor.fetchall()
+                rebuild = True
+            else:
+                rebuild = False
+
+            cells = list(dict.fromkeys(
+                cell for lat, lon in near for cell in lookup_cells_near(lat, lon, max_distance)
             ))
+            if not cells:
+                return 0
+
+            params = {
+                'rows': [row for row, _ in cells],
+                'cols': [col for _, col in cells],
+                'max_distance': max_distance
+            }
+            if not rebuild:
+                cursor.execute(DELETE_CHEAPEST.format(cheapest=cheapest), params)
+
+            areas = [lookup_cell_area(cell, max_distance) for cell in cells]
+            cursor.execute(INSERT_CHEAPEST.format(cheapest=cheapest, table=table), {
+                **params,
+                'latitudes': [lat for lat, _, _ in areas],
+                'longitudes': [lon for _, lon, _ in areas],
+                'radii': [radius * METERS_PER_MILE for _, _, radius in areas],
+                'limit': CHEAPEST_STATIONS_PER_CELL
+            })
 
-        result = sorted(nearby, key=lambda x: x.price)
-        cache.set(cache_key, [s.as_dict for s in result], timeout=3600)
-        return result
+        return len(cells)
 
     @staticmethod
-    def index_stops_by_segment_for_route(with_points: List[SamplePoint]) -> Dict[int, List[FuelStop]]:
-        """Pre-compute stops near each route segment for efficiency."""
-        stops_by_segment = {}
+    def find_stops_along_route(*, route: RouteData, max_distance: float = 25) -> List[FuelStop]:
+        """
+        Find every truck stop within radius of the route line in a single query.
+        :param route: The route to search along.
+        :param max_distance: Maximum distance off route in miles.
+        :return Returns stops ordered by along-route distance, with ``distance_from_start`` set to the
+            stop's position along the route and ``distance_from_point`` to its distance off route.
+        """
+        return list(StationService.find_stop_table_along_route(route=route, max_distance=max_distance))
 
-        for i, p in enumerate(with_points):
-            nearby = StationService.find_nearby_stops_for_point(lat=p.latitude, lon=p.longitude)
-            for stop in nearby:
-                stop.distance_from_start = p.distance_from_start
-                stop.segment_index = i
-            stops_by_segment[i] = nearby
+    @staticmethod
+    def find_stop_table_along_route(*, route: RouteData, max_distance: float = 25) -> StopTable:
+        """Columnar version of ``find_stops_along_route``."""
+        with connection.cursor() as cursor:
+            cursor.execute(CORRIDOR_QUERY.format(table=connection.ops.quote_name(FuelStation._meta.db_table)), {
+                'line': route.coordinates.to_wkb(),
+                'radius': max_distance * METERS_PER_MILE
+            })
+            rows = cursor.fetchall()
+
+        opis_ids, names, addresses, cities, states, prices, lats, lons, along_route, off_route = (
+            zip(*rows) if rows else [()] * 10
+        )
+        return StopTable(
+            ids=opis_ids,
+            names=names,
+            addresses=addresses,
+            cities=cities,
+            states=states,
+            prices=[float(price) for price in prices],
+            latitudes=lats,
+            longitudes=lons,
+            distances_from_point=np.array(off_route, dtype=np.float64) / METERS_PER_MILE,
+            distances_from_start=np.array(along_route, dtype=np.float64) / METERS_PER_MILE
+        )
+
+    @staticmethod
+    def index_stops_for_corridor(route: RouteData, max_distance: float = 25) -> CandidateTable:
+        """Build the candidate table from every stop within radius of the route line."""
+        return CandidateTable(StationService.find_stop_table_along_route(route=route, max_distance=max_distance))
 
-        return stops_by_segment
+    @staticmethod
+    def index_stops_for_route(
+            with_points: List[SamplePoint],
+            lookup_type: StationLookupType = StationLookupType.INDEX
+    ) -> CandidateTable:
+        """Pre-compute stops near each sample point, sorted by distance along the route."""
+        if lookup_type.is_index:
+            return CandidateTable(StationIndex.get().search(with_points))
+        return CandidateTable(StationService.find_nearby_stop_table(with_points))
 
 
     @staticmethod
     def find_best_stop_in_range(
         *,
-        stops_by_segment: Dict[int, List[FuelStop]],
+        candidates: CandidateTable,
         start_distance: float,
         max_distance: float,
         total_distance: float
     ) -> Optional[FuelStop]:
         """Find the cheapest stop within the driveable range."""
-        candidates = []
-
-        for seg_idx, stops in stops_by_segment.items():
-            for stop in stops:
-                route_dist = stop.distance_from_start
-                if start_distance < route_dist <= min(max_distance, total_distance):
-                    candidates.append(stop)
-
-        if not candidates:
-            return None
-
-        # Return cheapest option
-        return min(candidates, key=lambda x: x.price)
+        return candidates.cheapest_in_range(start_distance, min(max_distance, total_distance))
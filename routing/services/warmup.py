@@ -0,0 +1,102 @@
+import importlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from django.db import connection
+
+from routing.client import RoutingClient
+from routing.utils.cache import get_station_revision
+from .gazetteer import Gazetteer
+from .index import StationIndex, get_snapshot_path
+from .route import RouteService
+
+logger = logging.getLogger('routing')
+
+
+# Imported on first use by the upstream clients, see ``common.client``
+HTTP_LIBRARIES = ('requests', 'aiohttp', 'geopy.adapters', 'geopy.geocoders', 'geopy.distance')
+
+
+def _import_http_libraries():
+    for name in HTTP_LIBRARIES:
+        importlib.import_module(name)
+
+
+def _check_database():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+
+def _load_station_index():
+    # Only INDEX lookups read the index; the default corridor lookup queries PostGIS directly
+    if get_snapshot_path() is not None or RouteService().lookup_type.is_index:
+        StationIndex.get()
+
+
+def _open_upstream_connection():
+    """Open a keep-alive connection in the shared OSRM session's pool, which every request thread reuses."""
+    client = RoutingClient.shared()
+    if client.engine is not None:
+        return
+    try:
+        client.session.head(client.base_url, timeout=client.timeout)
+    except Exception as e:
+        # An upstream outage shows up in the plans themselves; it must not keep the worker out of service
+        logger.warning(f"Could not open an upstream connection to {client.base_url}: {e}")
+
+
+class WarmUp:
+    """
+    Primes the per-process state the first plan would otherwise pay for: it checks that the database answers,
+    opens the Redis connection pool, loads the gazetteer and the HTTP and geocoding libraries and opens a
+    pooled connection to OSRM. The station index is only built when INDEX lookups or a snapshot use it.
+
+    The database check runs on the calling thread's connection, which only outlives the probe with persistent
+    connections (``CONN_MAX_AGE``). aiohttp sessions belong to an event loop, so they are left to the requests
+    that use them.
+
+    Runs once per process, on the first readiness probe (see ``ReadinessView``) or from a server hook such
+    as gunicorn's ``post_worker_init``. A failed run is retried by the next call.
+    """
+
+    steps: Dict[str, Callable[[], None]] = {
+        'database': _check_database,
+        'cache': get_station_revision,
+        'station_index': _load_station_index,
+        'gazetteer': Gazetteer.get,
+        'http_libraries': _import_http_libraries,
+        'upstream': _open_upstream_connection,
+    }
+
+    _timings: Optional[Dict[str, float]] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def run(cls) -> Dict[str, float]:
+        """
+        Run every step unless a previous run completed.
+        :return: Returns the milliseconds each step took in the completed run.
+        :raises Exception: Whatever the first failing step raised.
+        """
+        if cls._timings is None:
+            with cls._lock:
+                if cls._timings is None:
+                    timings = {}
+                    for name, step in cls.steps.items():
+                        started = time.perf_counter()
+                        step()
+                        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+                    cls._timings = timings
+                    logger.info(f"Warmed up in {sum(timings.values()):.1f} ms: {timings}")
+        return cls._timings
+
+    @classmethod
+    def is_done(cls) -> bool:
+        return cls._timings is not None
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._timings = None
@@ -0,0 +1,149 @@
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+from unittest.mock import MagicMock, patch
+from routing.utils.cache import (
+    LocalCache, TieredCache, RELEASE_LOCK_SCRIPT, asingle_flight, cell_key, get_cell_versions, single_flight,
+    tiered_cache
+)
+
+
+class LocalCacheTest(TestCase):
+
+    def test_evicts_least_recently_used_over_budget(self):
+        local = LocalCache(max_bytes=300)
+        local.set('a', 'x' * 100, timeout=60)
+        local.set('b', 'y' * 100, timeout=60)
+        local.get('a')
+        local.set('c', 'z' * 100, timeout=60)
+
+        self.assertEqual(local.get('a'), 'x' * 100)
+        self.assertIsNone(local.get('b', None))
+        self.assertLessEqual(local.size, 300)
+
+    def test_expired_entries_are_misses(self):
+        local = LocalCache(max_bytes=1000)
+        with patch('routing.utils.cache.time.monotonic', return_value=100):
+            local.set('a', 1, timeout=10)
+        with patch('routing.utils.cache.time.monotonic', return_value=111):
+            self.assertIsNone(local.get('a', None))
+        self.assertEqual(local.size, 0)
+
+    def test_values_are_copies(self):
+        local = LocalCache(max_bytes=1000)
+        local.set('a', {'stops': []}, timeout=60)
+        local.get('a')['stops'].append(1)
+
+        self.assertEqual(local.get('a'), {'stops': []})
+
+
+class TieredCacheTest(TestCase):
+
+    def setUp(self):
+        self.remote = LocMemCache('tiered-test', {})
+        self.remote.clear()
+        self.cache = TieredCache(self.remote, max_bytes=10000, local_timeout=60)
+
+    def test_counts_hits_and_misses_per_tier(self):
+        self.remote.set('shared', 1)
+
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.cache.get('shared'), 1)
+        self.assertEqual(self.cache.get('shared'), 1)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['local']['hits'], 1)
+        self.assertEqual(stats['local']['misses'], 2)
+        self.assertEqual(stats['remote'], {'hits': 1, 'misses': 1})
+
+    def test_writes_and_deletes_go_to_both_tiers(self):
+        self.cache.set('key', 'value', timeout=60)
+        self.assertEqual(self.remote.get('key'), 'value')
+
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertIsNone(self.remote.get('key'))
+
+    def test_get_many_fills_local_tier(self):
+        self.cache.set('a', 1)
+        self.remote.set('b', 2)
+
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        self.remote.clear()
+        self.assertEqual(self.cache.get_many(['a', 'b']), {'a': 1, 'b': 2})
+
+    def test_local_copies_of_remote_hits_expire_with_the_remote_entry(self):
+        self.remote.set('short', 1)
+        self.remote.set('long', 2)
+        self.remote.ttl = lambda key: {'short': 5, 'long': None}[key]
+
+        with patch('routing.utils.cache.time.monotonic', return_value=100):
+            self.assertEqual(self.cache.get_many(['short', 'long']), {'short': 1, 'long': 2})
+        self.remote.clear()
+        with patch('routing.utils.cache.time.monotonic', return_value=106):
+            self.assertIsNone(self.cache.get('short'))
+            self.assertEqual(self.cache.get('long'), 2)
+
+
+class SingleFlightTest(TestCase):
+
+    def setUp(self):
+        tiered_cache.clear()
+
+    def take_expired_lock(self, key):
+        # The lock timed out mid-compute and another worker acquired it
+        cache.set(f'lock:{key}', 'other-worker', timeout=30)
+        return 'value'
+
+    def test_lock_taken_over_after_expiry_is_kept(self):
+        self.assertEqual(single_flight('slow', lambda: self.take_expired_lock('slow'), timeout=60), 'value')
+        self.assertEqual(cache.get('lock:slow'), 'other-worker')
+
+    def test_async_lock_taken_over_after_expiry_is_kept(self):
+        import asyncio
+
+        async def compute():
+            return self.take_expired_lock('aslow')
+
+        self.assertEqual(asyncio.run(asingle_flight('aslow', compute, timeout=60)), 'value')
+        self.assertEqual(cache.get('lock:aslow'), 'other-worker')
+
+    def test_lock_is_released_with_a_compare_and_delete_script_on_redis(self):
+        redis = MagicMock()
+        client = MagicMock(spec=['get_client', 'make_key', 'encode'])
+        client.get_client.return_value = redis
+        client.make_key.side_effect = lambda key: f':1:{key}'
+        client.encode.side_effect = lambda value: f'encoded:{value}'
+
+        with patch.object(cache, 'client', client, create=True):
+            single_flight('redis', lambda: 'value', timeout=60)
+
+        script, keys, key, token = redis.eval.call_args.args
+        self.assertEqual((script, keys, key), (RELEASE_LOCK_SCRIPT, 1, ':1:lock:redis'))
+        self.assertTrue(token.startswith('encoded:'))
+
+
+class CellVersionTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cold_cells_are_seeded_in_one_pipeline(self):
+        seed = cache.add
+        pipeline = MagicMock()
+        pipeline.set.side_effect = lambda key, value, nx: seed(key, value, timeout=None)
+        client = MagicMock(spec=['get_client', 'make_key', 'encode'])
+        client.get_client.return_value.pipeline.return_value = pipeline
+        client.make_key.side_effect = lambda key: key
+        client.encode.side_effect = lambda value: value
+        cache.set(cell_key((1, 1)), 7, timeout=None)
+        cells = [(0, 0), (0, 1), (1, 1), (2, 2)]
+
+        with patch.object(cache, 'client', client, create=True), patch.object(cache, 'add') as add:
+            versions = get_cell_versions(cells)
+
+        add.assert_not_called()
+        pipeline.execute.assert_called_once()
+        self.assertEqual(pipeline.set.call_count, 3)
+        self.assertEqual(versions[2], 7)
+        self.assertEqual(get_cell_versions(cells), versions)
@@ -0,0 +1,184 @@
+import os
+import tempfile
+from io import StringIO
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.test import TestCase
+from unittest.mock import patch
+from routing.data import Coordinate
+from routing.models import CheapestStation, FuelStation
+from routing.services.index import StationIndex
+from routing.utils.cache import get_station_generation, get_cell_versions, cell_for
+
+PRICES_HEADER = 'OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n'
+
+
+class UpdatePricesCommandTest(TestCase):
+
+    def setUp(self):
+        FuelStation.objects.create(
+            opis_id='1', name='Pilot', address='I-40', city='Amarillo', state='TX',
+            rack_id=1, price=3.20, location=Point(-101.83, 35.22)
+        )
+        FuelStation.objects.create(
+            opis_id='2', name='Loves', address='I-44', city='Tulsa', state='OK',
+            rack_id=2, price=3.10, location=Point(-95.99, 36.15)
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'prices.csv')
+        with open(self.path, 'w') as f:
+            f.write(PRICES_HEADER)
+            f.write('1,Pilot,I-40,Amarillo,TX,1,3.30\n')
+            f.write('1,Pilot,I-40,Amarillo,TX,1,3.25\n')
+            f.write('2,Loves,I-44,Tulsa,OK,2,3.10\n')
+            f.write('3,Flying J,I-35,Oklahoma City                ,OK,2,2.95\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @patch('routing.services.geolocation.GeoLocationService.geocode')
+    def test_updates_prices_and_adds_new_stations(self, mock_geocode):
+        mock_geocode.return_value = Coordinate(35.47, -97.52)
+        generation = get_station_generation()
+        cells = [cell_for(35.22, -101.83), cell_for(35.47, -97.52), cell_for(36.15, -95.99)]
+        versions = get_cell_versions(cells)
+
+        call_command('update_prices', self.path, stdout=StringIO())
+
+        prices = dict(FuelStation.objects.values_list('opis_id', 'price'))
+        self.assertAlmostEqual(float(prices['1']), 3.25)
+        self.assertAlmostEqual(float(prices['2']), 3.10)
+        self.assertAlmostEqual(float(prices['3']), 2.95)
+        self.assertEqual(FuelStation.objects.get(opis_id='3').city, 'Oklahoma City')
+        mock_geocode.assert_called_once_with('Oklahoma City, OK, USA')
+        self.assertTrue(CheapestStation.objects.filter(station__opis_id='3').exists())
+        # Amarillo changed and Oklahoma City is new; Tulsa's cached lookups stay valid
+        new_versions = get_cell_versions(cells)
+        self.assertGreater(new_versions[0], versions[0])
+        self.assertGreater(new_versions[1], versions[1])
+        self.assertEqual(new_versions[2], versions[2])
+        self.assertEqual(get_station_generation(), generation)
+
+    @patch('routing.services.geolocation.GeoLocationService.geocode')
+    def test_price_changes_are_invalidated_before_geocoding(self, mock_geocode):
+        cell = cell_for(35.22, -101.83)
+        [version] = get_cell_versions([cell])
+        versions_while_geocoding = []
+
+        def geocode(location):
+            versions_while_geocoding.extend(get_cell_versions([cell]))
+            return Coordinate(35.47, -97.52)
+
+        mock_geocode.side_effect = geocode
+        call_command('update_prices', self.path, stdout=StringIO())
+
+        self.assertGreater(versions_while_geocoding[0], version)
+
+    @patch('routing.management.commands.load_stations.Command.geocode_all')
+    @patch('routing.services.geolocation.GeoLocationService.geocode')
+    def test_reimporting_the_loaded_file_changes_nothing(self, mock_geocode, mock_geocode_all):
+        mock_geocode_all.return_value = {'Amarillo, TX, USA': [35.22, -101.83], 'Tulsa, OK, USA': [36.15, -95.99]}
+        path = os.path.join(self.directory.name, 'loaded.csv')
+        with open(path, 'w') as f:
+            f.write(PRICES_HEADER)
+            f.write('1,Pilot,I-40,Amarillo,TX,1,3.30\n')
+            f.write('1,Pilot,I-40,Amarillo,TX,1,3.25\n')
+            f.write('2,Loves,I-44,Tulsa,OK,2,3.10\n')
+        call_command('load_stations', path, stdout=StringIO())
+        cells = [cell_for(35.22, -101.83), cell_for(36.15, -95.99)]
+        versions = get_cell_versions(cells)
+        out = StringIO()
+
+        call_command('update_prices', path, stdout=out)
+
+        self.assertIn('0 prices changed', out.getvalue())
+        self.assertEqual(FuelStation.objects.count(), 2)
+        self.assertAlmostEqual(float(FuelStation.objects.get(opis_id='1').price), 3.25)
+        self.assertEqual(get_cell_versions(cells), versions)
+        mock_geocode.assert_not_called()
+
+    @patch('routing.services.geolocation.GeoLocationService.geocode')
+    def test_dry_run_changes_nothing(self, mock_geocode):
+        versions = get_cell_versions([cell_for(35.22, -101.83)])
+        out = StringIO()
+
+        call_command('update_prices', self.path, '--dry-run', stdout=out)
+
+        self.assertAlmostEqual(float(FuelStation.objects.get(opis_id='1').price), 3.20)
+        self.assertEqual(FuelStation.objects.count(), 2)
+        self.assertEqual(get_cell_versions([cell_for(35.22, -101.83)]), versions)
+        mock_geocode.assert_not_called()
+        self.assertIn('1 new stations', out.getvalue())
+
+
+class BuildStationSnapshotCommandTest(TestCase):
+
+    def setUp(self):
+        FuelStation.objects.create(
+            opis_id='1', name='Pilot', address='I-40', city='Amarillo', state='TX',
+            rack_id=1, price=3.20, location=Point(-101.83, 35.22)
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'stations.npy')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_writes_snapshot_and_update_prices_replaces_it(self):
+        call_command('build_station_snapshot', '--output', self.path, stdout=StringIO())
+        self.assertEqual(list(StationIndex.from_snapshot(self.path).ids), ['1'])
+
+        prices = os.path.join(self.directory.name, 'prices.csv')
+        with open(prices, 'w') as f:
+            f.write(PRICES_HEADER)
+            f.write('1,Pilot,I-40,Amarillo,TX,1,3.05\n')
+        with patch.dict(os.environ, {'STATION_SNAPSHOT_PATH': self.path}):
+            call_command('update_prices', prices, stdout=StringIO())
+
+        self.assertAlmostEqual(StationIndex.from_snapshot(self.path).prices[0], 3.05)
+
+
+class StationFixtureCommandTest(TestCase):
+
+    def setUp(self):
+        FuelStation.objects.create(
+            opis_id='1', name='Pilot', address='I-40, Exit 75', city='Amarillo', state='TX',
+            rack_id=1, price=3.259, location=Point(-101.83, 35.22)
+        )
+        FuelStation.objects.create(
+            opis_id='2', name='Love’s', address='I-44', city='Tulsa', state='OK',
+            rack_id=2, price=3.10, location=Point(-95.99, 36.15)
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'stations.npz')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_binary_dump_restores_the_same_stations(self):
+        fields = ('pk', 'opis_id', 'name', 'address', 'city', 'state', 'rack_id', 'price')
+        stations = list(FuelStation.objects.order_by('pk').values_list(*fields))
+        locations = [s.location.coords for s in FuelStation.objects.order_by('pk')]
+
+        call_command('dump_stations', '--output', self.path, stdout=StringIO())
+        FuelStation.objects.all().delete()
+        call_command('restore_stations', self.path, stdout=StringIO())
+
+        self.assertEqual(list(FuelStation.objects.order_by('pk').values_list(*fields)), stations)
+        self.assertEqual([s.location.coords for s in FuelStation.objects.order_by('pk')], locations)
+        self.assertTrue(CheapestStation.objects.exists())
+        # The id sequence continues after the restored ids
+        self.assertGreater(FuelStation.objects.create(
+            opis_id='3', name='New', address='I-35', city='Dallas', state='TX',
+            rack_id=1, price=3.0, location=Point(-96.8, 32.78)
+        ).pk, stations[-1][0])
+
+    def test_empty_text_fields_are_restored_as_empty(self):
+        FuelStation.objects.filter(opis_id='2').update(address='', city='')
+
+        call_command('dump_stations', '--output', self.path, stdout=StringIO())
+        FuelStation.objects.all().delete()
+        call_command('restore_stations', self.path, stdout=StringIO())
+
+        self.assertEqual(FuelStation.objects.get(opis_id='2').address, '')
+        self.assertEqual(FuelStation.objects.get(opis_id='2').city, '')
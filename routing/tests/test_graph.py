@@ -0,0 +1,133 @@
+import os
+import tempfile
+from django.test import TestCase
+from unittest.mock import patch
+from routing.client import RoutingClient, RoutingEngineType
+from routing.data import Coordinate
+from routing.graph import RoadGraph, LocalGraphEngine
+
+
+def make_grid_graph(size=5, spacing=0.1):
+    """Two-way grid of ``size`` x ``size`` nodes ``spacing`` degrees apart."""
+    latitudes, longitudes, sources, targets = [], [], [], []
+    for row in range(size):
+        for column in range(size):
+            latitudes.append(35 + row * spacing)
+            longitudes.append(-100 + column * spacing)
+            node = row * size + column
+            if column + 1 < size:
+                sources += [node, node + 1]
+                targets += [node + 1, node]
+            if row + 1 < size:
+                sources += [node, node + size]
+                targets += [node + size, node]
+    return RoadGraph.from_edges(latitudes=latitudes, longitudes=longitudes, sources=sources, targets=targets)
+
+
+class RoadGraphTest(TestCase):
+
+    def setUp(self):
+        self.graph = make_grid_graph()
+
+    def test_shortest_path_is_manhattan_length(self):
+        nodes, edges = self.graph.shortest_path(0, 24)
+
+        self.assertEqual(nodes[0], 0)
+        self.assertEqual(nodes[-1], 24)
+        self.assertEqual(len(edges), 8)
+        for a, b, edge in zip(nodes, nodes[1:], edges):
+            self.assertEqual(self.graph.targets[edge], b)
+            self.assertTrue(self.graph.offsets[a] <= edge < self.graph.offsets[a + 1])
+
+    def test_unreachable_target_returns_none(self):
+        graph = RoadGraph.from_edges(
+            latitudes=[35, 35.1, 35.2], longitudes=[-100, -100, -100], sources=[0], targets=[1]
+        )
+
+        self.assertIsNone(graph.shortest_path(0, 2))
+        self.assertEqual(graph.shortest_path(1, 1), ([1], []))
+
+    def test_nearest_node_matches_a_full_scan(self):
+        import numpy as np
+        from routing.utils.geo import haversine_miles
+
+        rng = np.random.default_rng(7)
+        graph = RoadGraph.from_edges(
+            latitudes=rng.uniform(30, 40, 2000), longitudes=rng.uniform(-110, -90, 2000), sources=[0], targets=[1]
+        )
+        for lat, lon in [(35.0, -100.0), (30.01, -109.99), (45.0, -80.0), (-30.0, 150.0)]:
+            expected = np.argmin(haversine_miles(lat, lon, graph.latitudes, graph.longitudes))
+            self.assertEqual(graph.nearest_node(Coordinate(lat, lon)), expected)
+
+        self.assertEqual(self.graph.nearest_node(Coordinate(35.21, -99.69)), 2 * 5 + 3)
+
+    def test_save_and_load_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.npz')
+            self.graph.save(path)
+            loaded = RoadGraph.load(path)
+
+        self.assertEqual(len(loaded), len(self.graph))
+        self.assertEqual(loaded.targets.tolist(), self.graph.targets.tolist())
+        self.assertEqual(loaded.shortest_path(0, 24), self.graph.shortest_path(0, 24))
+
+
+class LocalGraphEngineTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'graph.npz')
+        make_grid_graph().save(self.path)
+
+    def tearDown(self):
+        LocalGraphEngine._engines.pop(self.path, None)
+        self.directory.cleanup()
+
+    def test_routing_client_uses_local_engine(self):
+        client = RoutingClient(engine_type=RoutingEngineType.LOCAL_GRAPH, graph_path=self.path)
+        start = Coordinate(latitude=35.01, longitude=-99.99)
+        finish = Coordinate(latitude=35.39, longitude=-99.61)
+
+        route = client.get_route(from_location=start, to_location=finish)
+
+        self.assertEqual(route.start, start)
+        self.assertEqual(route.finish, finish)
+        self.assertEqual(route.coordinates[0], Coordinate(latitude=35.0, longitude=-100.0))
+        self.assertAlmostEqual(route.coordinates[-1].latitude, 35.4)
+        # 4 steps north and 4 steps east of ~6.9 and ~5.7 miles
+        self.assertAlmostEqual(route.distance, 50.3, delta=0.5)
+        self.assertAlmostEqual(route.duration, route.distance / RoadGraph.default_speed_mph * 60)
+
+    def test_async_client_routes_off_the_event_loop(self):
+        import asyncio
+        import threading
+        from routing.client import AsyncRoutingClient
+
+        client = AsyncRoutingClient(engine_type=RoutingEngineType.LOCAL_GRAPH, graph_path=self.path)
+        engine = LocalGraphEngine.load(self.path)
+        threads = []
+        get_route = engine.get_route
+
+        def record_thread(**kwargs):
+            threads.append(threading.current_thread())
+            return get_route(**kwargs)
+
+        async def route():
+            engine.get_route = record_thread
+            try:
+                return await client.get_route(
+                    from_location=Coordinate(35.01, -99.99), to_location=Coordinate(35.39, -99.61)
+                )
+            finally:
+                del engine.get_route
+
+        self.assertAlmostEqual(asyncio.run(route()).distance, 50.3, delta=0.5)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_mistyped_engine_is_reported(self):
+        with patch.dict(os.environ, {'ROUTING_ENGINE': 'osmr'}):
+            with self.assertRaisesMessage(ValueError, "expected one of: osrm, local_graph"):
+                RoutingEngineType.from_env()
+
+    def test_engine_is_loaded_once_per_path(self):
+        self.assertIs(LocalGraphEngine.load(self.path), LocalGraphEngine.load(self.path))
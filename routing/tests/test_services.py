@@ -1,6 +1,20 @@
+import dataclasses
+import os
+import tempfile
+from pathlib import Path
+from django.contrib.gis.geos import Point
 from django.test import TestCase
-from routing.data import Coordinate, SamplePoint
-from routing.services.station import StationService
+from unittest.mock import patch
+from routing.data import Coordinate, SamplePoint, RouteData, RouteGeometry, FuelStop, StopTable
+from routing.models import CheapestStation, FuelStation
+from routing.services.candidates import CandidateTable
+from routing.services.gazetteer import Gazetteer
+from routing.services.geolocation import GeoLocationService, LocationServiceType
+from routing.services.index import StationIndex
+from routing.services.route import RouteService, OptimizerType
+from routing.services.station import StationService, StationLookupType
+from routing.utils.cache import bump_cells, bump_station_revision, cell_for, lookup_cell_for, tiered_cache
+from routing.utils.geo import haversine_miles
 
 
 class StationServiceTest(TestCase):
@@ -38,3 +52,377 @@ class StationServiceTest(TestCase):
                 points[i].distance_from_start,
                 points[i-1].distance_from_start
             )
+
+    def test_sample_points_match_geodesic_implementation(self):
+        coordinates = [
+            Coordinate(latitude=34.05 + i * 0.01, longitude=-118.25 + i * 0.02) for i in range(500)
+        ]
+
+        points = StationService.get_sample_points_along_route(with_coordinates=coordinates, at_intervals=50)
+        expected = StationService.get_sample_points_along_route_geodesic(
+            with_coordinates=coordinates, at_intervals=50
+        )
+
+        self.assertEqual(len(points), len(expected))
+        for point, reference in zip(points, expected):
+            self.assertAlmostEqual(point.distance_from_start, reference.distance_from_start, delta=1e-3)
+            self.assertAlmostEqual(point.latitude, reference.latitude, places=5)
+            self.assertAlmostEqual(point.longitude, reference.longitude, places=5)
+
+
+class StationCacheTest(TestCase):
+
+    def setUp(self):
+        tiered_cache.clear()
+        FuelStation.objects.create(
+            opis_id='1', name='Pilot', address='I-40', city='Amarillo', state='TX',
+            rack_id=1, price=3.20, location=Point(-101.83, 35.22)
+        )
+        StationService.refresh_cheapest_stations()
+
+    def test_lookup_is_invalidated_only_by_nearby_cells(self):
+        StationService.find_nearby_stops_for_point(lat=35.2, lon=-101.8)
+
+        bump_cells([cell_for(40.0, -80.0)])
+        with self.assertNumQueries(0):
+            stops = StationService.find_nearby_stops_for_point(lat=35.2, lon=-101.8)
+        self.assertEqual([s.id for s in stops], ['1'])
+
+        bump_cells([cell_for(35.22, -101.83)])
+        with self.assertNumQueries(1):
+            StationService.find_nearby_stops_for_point(lat=35.2, lon=-101.8)
+
+    def test_batched_lookup_queries_misses_once(self):
+        points = [
+            SamplePoint(latitude=35.2, longitude=-101.8, distance_from_start=0),
+            SamplePoint(latitude=35.3, longitude=-101.5, distance_from_start=20),
+            SamplePoint(latitude=40.0, longitude=-80.0, distance_from_start=1000),
+        ]
+
+        with self.assertNumQueries(1):
+            results = StationService.find_nearby_stops_for_points(points)
+        self.assertEqual([[s.id for s in stops] for stops in results], [['1'], ['1'], []])
+
+        with self.assertNumQueries(0):
+            cached = StationService.find_nearby_stops_for_points(points)
+        self.assertEqual(cached, results)
+
+    def test_points_in_one_lookup_cell_share_the_cached_entry(self):
+        self.assertEqual(lookup_cell_for(35.2, -101.8, 25), lookup_cell_for(35.25, -101.75, 25))
+        StationService.find_nearby_stops_for_point(lat=35.2, lon=-101.8)
+
+        with self.assertNumQueries(0):
+            stops = StationService.find_nearby_stops_for_point(lat=35.25, lon=-101.75)
+        self.assertEqual([s.id for s in stops], ['1'])
+        self.assertAlmostEqual(stops[0].distance_from_point, haversine_miles(35.25, -101.75, 35.22, -101.83))
+
+    def test_lookup_scans_when_cheapest_stations_are_not_built(self):
+        CheapestStation.objects.all().delete()
+
+        with self.assertNumQueries(2):
+            stops = StationService.find_nearby_stops_for_point(lat=35.2, lon=-101.8)
+        self.assertEqual([s.id for s in stops], ['1'])
+
+    @patch('routing.services.station.CHEAPEST_STATIONS_PER_CELL', 1)
+    def test_truncated_cell_is_scanned_only_when_it_may_miss_stations(self):
+        FuelStation.objects.create(
+            opis_id='2', name='Loves', address='I-40', city='Amarillo', state='TX',
+            rack_id=2, price=3.30, location=Point(-101.85, 35.21)
+        )
+        StationService.refresh_cheapest_stations()
+        point = SamplePoint(latitude=35.2, longitude=-101.8, distance_from_start=0)
+
+        with self.assertNumQueries(1):
+            [stops] = StationService.find_nearby_stops_for_points([point], limit=1)
+        self.assertEqual([s.id for s in stops], ['1'])
+
+        with self.assertNumQueries(1):
+            [stops] = StationService.find_nearby_stops_for_points([point], limit=2)
+        self.assertEqual([s.id for s in stops], ['1', '2'])
+
+
+class StationIndexTest(TestCase):
+
+    def setUp(self):
+        self.index = StationIndex(
+            ids=['1', '2', '3', '4'],
+            names=['Near Cheap', 'Near Expensive', 'Far Away', 'Other Cell'],
+            addresses=['I-10', 'I-10', 'I-40', 'I-10'],
+            cities=['Phoenix', 'Phoenix', 'Flagstaff', 'Tempe'],
+            states=['AZ', 'AZ', 'AZ', 'AZ'],
+            prices=[3.10, 3.50, 2.90, 3.20],
+            latitudes=[33.45, 33.46, 35.20, 33.42],
+            longitudes=[-112.07, -112.08, -111.65, -111.49],
+        )
+
+    def test_query_filters_by_radius_and_sorts_by_price(self):
+        point = SamplePoint(latitude=33.45, longitude=-112.07, distance_from_start=0)
+
+        [stops] = self.index.query([point], max_distance=25)
+
+        self.assertEqual([s.id for s in stops], ['1', '2'])
+        self.assertAlmostEqual(stops[0].distance_from_point, 0, places=3)
+
+    def test_query_searches_neighbouring_cells(self):
+        point = SamplePoint(latitude=33.45, longitude=-111.75, distance_from_start=0)
+
+        [stops] = self.index.query([point], max_distance=25)
+
+        self.assertIn('4', [s.id for s in stops])
+
+    def test_search_returns_columns_grouped_by_point(self):
+        points = [
+            SamplePoint(latitude=33.45, longitude=-112.07, distance_from_start=0),
+            SamplePoint(latitude=33.45, longitude=-111.75, distance_from_start=20),
+        ]
+
+        table = self.index.search(points, max_distance=25, limit=2)
+
+        self.assertEqual(list(table.ids), ['1', '2', '1', '4'])
+        self.assertEqual(list(table.segment_indices), [0, 0, 1, 1])
+        self.assertEqual(list(table.distances_from_start), [0, 0, 20, 20])
+
+    def test_query_returns_one_list_per_point_with_limit(self):
+        points = [
+            SamplePoint(latitude=33.45, longitude=-112.07, distance_from_start=0),
+            SamplePoint(latitude=40.0, longitude=-100.0, distance_from_start=100),
+        ]
+
+        results = self.index.query(points, max_distance=25, limit=1)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual([s.id for s in results[0]], ['1'])
+        self.assertEqual(results[1], [])
+
+    def test_snapshot_is_mapped_and_searches_the_same(self):
+        points = [SamplePoint(latitude=33.45, longitude=-111.75, distance_from_start=0)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'stations.npy'
+            self.index.save(path)
+
+            snapshot = StationIndex.from_snapshot(path)
+
+            self.assertIsNotNone(snapshot.latitudes.base)  # A view into the mapped file, not a copy
+            self.assertFalse(snapshot.latitudes.flags.writeable)
+            self.assertEqual(snapshot.query(points), self.index.query(points))
+
+    def test_get_maps_a_replaced_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'stations.npy'
+            self.index.save(path)
+            with patch.dict(os.environ, {'STATION_SNAPSHOT_PATH': str(path)}):
+                self.assertTrue(StationIndex.preload())
+                preloaded = StationIndex.get()
+
+                StationIndex.from_rows([('5', 'New', 'I-17', 'Phoenix', 'AZ', 3.0, 33.5, -112.1)]).save(path)
+                bump_station_revision()
+
+                self.assertEqual(len(preloaded), 4)
+                self.assertEqual(len(StationIndex.get()), 1)
+                self.assertEqual(os.listdir(directory), ['stations.npy'])
+        StationIndex.reset()
+
+
+class StationCorridorTest(TestCase):
+
+    def setUp(self):
+        FuelStation.objects.create(
+            opis_id='1', name='On Route', address='I-10', city='Quartzsite', state='AZ',
+            rack_id=1, price=3.20, location=Point(-114.0, 33.0)
+        )
+        FuelStation.objects.create(
+            opis_id='2', name='Near Start', address='I-10', city='Blythe', state='CA',
+            rack_id=1, price=3.60, location=Point(-114.9, 33.05)
+        )
+        FuelStation.objects.create(
+            opis_id='3', name='Off Route', address='US-95', city='Parker', state='AZ',
+            rack_id=1, price=2.90, location=Point(-114.0, 34.5)
+        )
+        self.route = RouteData(
+            coordinates=[Coordinate(33.0, -115.0), Coordinate(33.0, -113.0)],
+            distance=116.0
+        )
+
+    def test_find_stops_along_route_orders_by_route_position(self):
+        stops = StationService.find_stops_along_route(route=self.route, max_distance=25)
+
+        self.assertEqual([s.id for s in stops], ['2', '1'])
+        self.assertAlmostEqual(stops[1].distance_from_start, 58, delta=1)
+        self.assertLess(stops[1].distance_from_point, 0.5)
+        self.assertAlmostEqual(stops[0].distance_from_point, 3.5, delta=0.5)
+
+
+def make_stop(stop_id, distance, price):
+    return FuelStop(
+        id=stop_id, name=f'Station {stop_id}', address='I-40', city='Amarillo', state='TX', price=price,
+        location='Amarillo, TX, USA', latitude=35.2, longitude=-101.8, distance_from_point=1,
+        distance_from_start=distance
+    )
+
+
+class RouteServiceTest(TestCase):
+
+    def setUp(self):
+        self.candidates = CandidateTable([
+            make_stop('a', 50, 3.50), make_stop('b', 90, 3.00),
+            make_stop('c', 180, 3.80), make_stop('d', 400, 2.50),
+            make_stop('e', 600, 4.00), make_stop('f', 850, 3.20),
+        ])
+
+    def optimize(self, optimizer, total_distance=1000):
+        service = RouteService(optimizer=optimizer, lookup_type=StationLookupType.SAMPLE_POINTS)
+        with patch.object(
+                StationService, 'index_stops_for_route', return_value=self.candidates
+        ):
+            return service.get_optimized_stops_for_route(with_points=[], total_distance=total_distance)
+
+    def test_next_cheaper_fills_up_at_cheapest_stop(self):
+        result = self.optimize(OptimizerType.NEXT_CHEAPER)
+
+        # 450 usable miles: reach d without buying, fill up there, then buy just enough at f to finish
+        self.assertEqual([s.id for s in result.stops], ['d', 'f'])
+        self.assertEqual([s.gallons for s in result.stops], [40, 15])
+        self.assertAlmostEqual(result.cost, 148)
+        self.assertAlmostEqual(result.gallons, 55)
+
+    def test_next_cheaper_is_never_more_expensive_than_greedy(self):
+        optimal = self.optimize(OptimizerType.NEXT_CHEAPER)
+        greedy = self.optimize(OptimizerType.GREEDY)
+
+        self.assertLessEqual(optimal.cost, greedy.cost)
+
+    def test_next_cheaper_does_not_mutate_candidates(self):
+        self.optimize(OptimizerType.NEXT_CHEAPER)
+
+        for stop in self.candidates:
+            self.assertIsNone(stop.gallons)
+
+    def test_no_stops_needed_for_short_route(self):
+        result = self.optimize(OptimizerType.NEXT_CHEAPER, total_distance=300)
+
+        self.assertEqual(result.stops, [])
+        self.assertEqual(result.cost, 0)
+
+
+class CandidateTableTest(TestCase):
+
+    def setUp(self):
+        self.table = CandidateTable([
+            make_stop('c', 300, 3.10), make_stop('a', 100, 3.40), make_stop('b', 200, 2.90),
+            make_stop('d', 400, 3.60), make_stop('e', 500, 2.80),
+        ])
+
+    def test_stops_are_sorted_by_distance(self):
+        self.assertEqual([s.id for s in self.table], ['a', 'b', 'c', 'd', 'e'])
+
+    def test_cheapest_in_range_excludes_start_and_includes_end(self):
+        self.assertEqual(self.table.cheapest_in_range(200, 400).id, 'c')
+        self.assertEqual(self.table.cheapest_in_range(0, 200).id, 'b')
+        self.assertIsNone(self.table.cheapest_in_range(500, 900))
+
+    def test_first_cheaper_after(self):
+        self.assertEqual(self.table.first_cheaper_after(100, 3.20).id, 'b')
+        self.assertEqual(self.table.first_cheaper_after(200, 3.00).id, 'e')
+        self.assertIsNone(self.table.first_cheaper_after(200, 3.00, max_distance=400))
+        self.assertIsNone(self.table.first_cheaper_after(0, 2.50))
+
+    def test_lookups_return_new_stops(self):
+        stop = self.table.cheapest_in_range(0, 200)
+        stop.gallons = 10
+
+        self.assertIsNone(self.table.cheapest_in_range(0, 200).gallons)
+
+
+class StopTableTest(TestCase):
+
+    def test_round_trips_stops(self):
+        stops = [make_stop('a', 100, 3.40), make_stop('b', None, 2.90)]
+
+        table = StopTable.from_stops(stops)
+
+        self.assertEqual(list(table), stops)
+        self.assertEqual(table.take([1]).stop(0, gallons=5), dataclasses.replace(stops[1], gallons=5))
+
+    def test_by_segment_groups_rows(self):
+        table = StopTable.from_stops([
+            dataclasses.replace(make_stop('a', 0, 3.40), segment_index=0),
+            dataclasses.replace(make_stop('b', 20, 2.90), segment_index=2),
+            dataclasses.replace(make_stop('c', 20, 3.10), segment_index=2),
+        ])
+
+        self.assertEqual([[s.id for s in stops] for stops in table.by_segment(3)], [['a'], [], ['b', 'c']])
+
+
+class GazetteerTest(TestCase):
+
+    def setUp(self):
+        Gazetteer.reset()
+        FuelStation.objects.create(
+            opis_id='1', name='Pilot', address='I-40', city='Amarillo', state='TX',
+            rack_id=1, price=3.20, location=Point(-101.83, 35.22)
+        )
+
+    def tearDown(self):
+        Gazetteer.reset()
+
+    def test_parse_accepts_city_state_formats(self):
+        self.assertEqual(Gazetteer.parse('Amarillo, TX'), ('amarillo', 'TX'))
+        self.assertEqual(Gazetteer.parse(' amarillo ,tx, USA'), ('amarillo', 'TX'))
+        self.assertEqual(Gazetteer.parse('New  York, NY'), ('new york', 'NY'))
+        self.assertIsNone(Gazetteer.parse('Amarillo'))
+        self.assertIsNone(Gazetteer.parse('1 Main St, Amarillo, TX'))
+
+    def test_lookup_is_seeded_from_stations(self):
+        gazetteer = Gazetteer.get()
+
+        self.assertEqual(gazetteer.lookup('Amarillo, TX, USA'), Coordinate(35.22, -101.83))
+        self.assertIsNone(gazetteer.lookup('Tulsa, OK'))
+        self.assertIs(Gazetteer.get(), gazetteer)
+
+    def test_geolocation_service_falls_back_on_miss(self):
+        service = GeoLocationService(LocationServiceType.GAZETTEER)
+        with patch.object(service.geocoder, 'geocode') as geocode:
+            geocode.return_value.latitude, geocode.return_value.longitude = 36.15, -95.99
+
+            self.assertEqual(service.geocode('Amarillo, TX'), Coordinate(35.22, -101.83))
+            geocode.assert_not_called()
+
+            self.assertEqual(service.geocode('Tulsa, OK'), Coordinate(36.15, -95.99))
+            geocode.assert_called_once_with('Tulsa, OK')
+
+
+class RouteGeometryTest(TestCase):
+
+    def setUp(self):
+        self.route = RouteData(
+            coordinates=[Coordinate(34.05, -118.25), Coordinate(35.0, -115.0), Coordinate(33.45, -112.07)],
+            distance=370, duration=330, start=Coordinate(34.05, -118.25), finish=Coordinate(33.45, -112.07)
+        )
+
+    def test_coordinates_are_stored_as_geometry(self):
+        geometry = self.route.coordinates
+
+        self.assertIsInstance(geometry, RouteGeometry)
+        self.assertEqual(len(geometry), 3)
+        self.assertEqual(geometry[-1], Coordinate(33.45, -112.07))
+        self.assertEqual(list(geometry)[1], Coordinate(35.0, -115.0))
+        self.assertEqual(geometry.tolist()[0], [34.05, -118.25])
+
+    def test_cache_round_trip(self):
+        cached = self.route.to_cache()
+
+        self.assertIsInstance(cached['coordinates'], bytes)
+        self.assertEqual(RouteData.from_cache(cached), self.route)
+
+    def test_simplify_keeps_ends_and_drops_collinear_points(self):
+        geometry = RouteGeometry([(34.0, -118.0), (34.0, -117.5), (34.0, -117.0), (35.0, -116.0)])
+
+        simplified = geometry.simplify(0.01)
+
+        self.assertEqual(simplified.tolist(), [[34.0, -118.0], [34.0, -117.0], [35.0, -116.0]])
+
+    def test_from_lonlat_swaps_axes(self):
+        geometry = RouteGeometry.from_lonlat([[-118.25, 34.05], [-112.07, 33.45]])
+
+        self.assertEqual(geometry[0], Coordinate(34.05, -118.25))
+        self.assertEqual(geometry.longitudes.tolist(), [-118.25, -112.07])
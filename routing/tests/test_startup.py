@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from django.test import SimpleTestCase
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Import time of the project's own modules in a fresh interpreter, excluding the libraries they import. Measured
+# at about 20 ms; the budget leaves room for slower machines. Override on slow CI machines.
+IMPORT_TIME_BUDGET_MS = float(os.getenv('IMPORT_TIME_BUDGET_MS', 60))
+
+PROJECT_PACKAGES = ('main', 'routing', 'common')
+
+# Only needed once a request reaches an upstream, so they are imported on first use (see WarmUp)
+DEFERRED_MODULES = ('aiohttp', 'geopy')
+
+STARTUP = f"""
+import os
+import sys
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings.dev')
+django.setup()
+import main.urls
+print('deferred modules imported:', ','.join(name for name in {DEFERRED_MODULES!r} if name in sys.modules))
+"""
+
+
+def run_startup():
+    """Start a fresh interpreter the way the web process starts, returning its stdout and ``-X importtime`` report."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True
+    )
+    return result.stdout, result.stderr
+
+
+def project_import_ms(report: str) -> float:
+    """Sum of the self times of the project's modules in an ``-X importtime`` report."""
+    total = 0
+    for line in report.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        if own.strip().isdigit() and name.strip().split('.')[0] in PROJECT_PACKAGES:
+            total += int(own)
+    return total / 1000
+
+
+class StartupImportTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stdout, cls.report = run_startup()
+
+    def test_heavy_dependencies_are_not_imported_at_startup(self):
+        self.assertIn('deferred modules imported: \n', self.stdout)
+
+    def test_startup_import_time_is_within_budget(self):
+        elapsed = project_import_ms(self.report)
+
+        self.assertGreater(elapsed, 0)
+        self.assertLess(elapsed, IMPORT_TIME_BUDGET_MS, f'Startup imports took {elapsed:.0f} ms')
@@ -1,7 +1,12 @@
 from django.test import TestCase
 from rest_framework.test import APIClient
 from rest_framework import status
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+from common.client import ClientRegistry, CONNECT_TIMEOUT, POOL_SIZE, READ_TIMEOUT
+from routing.services.plan import PlanService
+from routing.services.warmup import WarmUp
+from routing.utils.cache import tiered_cache
+from routing.utils.timing import STAGE_SECONDS
 
 
 class RouteViewSetTest(TestCase):
@@ -39,3 +44,330 @@ class RouteViewSetTest(TestCase):
         
         response = self.client.get('/api/route/plan/?start=Los Angeles, CA&finish=Phoenix, AZ')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @patch('routing.services.geolocation.GeoLocationService.geocode')
+    @patch('routing.client.RoutingClient.get_route')
+    def test_plan_is_served_from_cache(self, mock_route, mock_geocode):
+        from routing.data import Coordinate, RouteData
+
+        tiered_cache.clear()
+        mock_geocode.return_value = Coordinate(latitude=34.05, longitude=-118.25)
+        mock_route.return_value = RouteData(
+            distance=100,
+            duration=120,
+            coordinates=[Coordinate(34.05, -118.25), Coordinate(33.45, -112.07)],
+            start=Coordinate(34.05, -118.25),
+            finish=Coordinate(33.45, -112.07)
+        )
+
+        first = self.client.get('/api/route/plan/?start=Los Angeles, CA&finish=Phoenix, AZ')
+        second = self.client.get('/api/route/plan/?start=los angeles, ca&finish=Phoenix,  AZ')
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(mock_geocode.call_count, 2)
+        self.assertEqual(mock_route.call_count, 1)
+        self.assertEqual(second.data['stops'], first.data['stops'])
+        self.assertEqual(second.data['start']['name'], 'los angeles, ca')
+
+
+class ServerTimingTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        tiered_cache.clear()
+        STAGE_SECONDS.reset()
+
+    @patch('routing.services.geolocation.GeoLocationService.geocode')
+    @patch('routing.client.RoutingClient.get_route')
+    def test_plan_reports_stages_in_header_and_metrics(self, mock_route, mock_geocode):
+        from routing.data import Coordinate, RouteData
+
+        mock_geocode.return_value = Coordinate(latitude=34.05, longitude=-118.25)
+        mock_route.return_value = RouteData(
+            distance=100,
+            duration=120,
+            coordinates=[Coordinate(34.05, -118.25), Coordinate(33.45, -112.07)],
+            start=Coordinate(34.05, -118.25),
+            finish=Coordinate(33.45, -112.07)
+        )
+
+        first = self.client.get('/api/route/plan/?start=Los Angeles, CA&finish=Phoenix, AZ')
+        second = self.client.get('/api/route/plan/?start=Los Angeles, CA&finish=Phoenix, AZ')
+
+        stages = [entry.split(';')[0] for entry in first['Server-Timing'].split(', ')]
+        self.assertEqual(
+            stages, ['geocode', 'geocode', 'route', 'sampling', 'stations', 'optimize', 'map', 'plan', 'total']
+        )
+        self.assertIn('plan;dur=', first['Server-Timing'])
+        self.assertIn('desc="cache miss"', first['Server-Timing'])
+        self.assertTrue(second['Server-Timing'].startswith('plan;dur='))
+        self.assertIn('desc="cache hit"', second['Server-Timing'])
+
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('# TYPE route_planner_stage_duration_seconds histogram', metrics)
+        self.assertIn('route_planner_stage_duration_seconds_count{stage="plan",cache="miss"} 1', metrics)
+        self.assertIn('route_planner_stage_duration_seconds_count{stage="plan",cache="hit"} 1', metrics)
+        self.assertIn('route_planner_stage_duration_seconds_bucket{stage="route",cache="none",le="+Inf"} 1', metrics)
+
+    @patch('routing.services.plan.PlanService.build_plan')
+    @patch('routing.services.geolocation.GeoLocationService.geocode')
+    @patch('routing.client.RoutingClient.get_route')
+    def test_batch_reports_stages_timed_on_worker_threads(self, mock_route, mock_geocode, mock_build):
+        from routing.data import Coordinate, RouteData
+
+        mock_geocode.return_value = Coordinate(latitude=34.05, longitude=-118.25)
+        mock_route.return_value = RouteData(distance=100, coordinates=[Coordinate(34.05, -118.25)])
+        mock_build.return_value = {'start': {}, 'finish': {}}
+
+        routes = [
+            {'start': 'Los Angeles, CA', 'finish': 'Phoenix, AZ'},
+            {'start': 'Phoenix, AZ', 'finish': 'Tucson, AZ'},
+        ]
+        response = self.client.post('/api/route/plan/batch/', {'routes': routes}, format='json')
+
+        stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(stages.count('geocode'), 3)
+        self.assertEqual(stages.count('route'), 1)
+        self.assertEqual(stages[-1], 'total')
+
+
+class UpstreamClientTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        ClientRegistry.reset()
+
+    def test_plan_services_share_upstream_clients(self):
+        first, second = PlanService(), PlanService()
+
+        self.assertIs(first.client, second.client)
+        self.assertIs(first.geolocation, second.geolocation)
+        self.assertEqual(first.client.timeout, (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+    def test_async_clients_default_to_the_upstream_pool_size(self):
+        from routing.client import AsyncRoutingClient
+
+        self.assertEqual(AsyncRoutingClient().pool_size, POOL_SIZE)
+
+    def test_async_sessions_close_with_their_loop(self):
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from routing.client import AsyncRoutingClient
+
+        client = AsyncRoutingClient()
+        sessions = []
+
+        async def use_session():
+            sessions.append(client.get_session())
+
+        async_to_sync(use_session)()
+        asyncio.run(use_session())
+
+        self.assertEqual(len(sessions), 2)
+        self.assertTrue(all(session.closed for session in sessions))
+        self.assertEqual(len(client._sessions), 0)
+
+    def test_upstream_stats(self):
+        PlanService()
+
+        response = self.client.get('/api/route/upstream/stats/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['RoutingClient'], {'requests': 0, 'connections': 0, 'reused': 0})
+
+
+class RouteMapTest(TestCase):
+
+    def setUp(self):
+        tiered_cache.clear()
+        self.client = APIClient()
+
+    @patch('routing.services.geolocation.GeoLocationService.geocode')
+    @patch('routing.client.RoutingClient.get_route')
+    def test_map_is_optional_and_served_separately(self, mock_route, mock_geocode):
+        from routing.data import Coordinate, RouteData
+
+        mock_geocode.return_value = Coordinate(latitude=34.05, longitude=-118.25)
+        mock_route.return_value = RouteData(
+            distance=100,
+            duration=120,
+            coordinates=[Coordinate(34.05, -118.25), Coordinate(33.8, -115.0), Coordinate(33.45, -112.07)],
+            start=Coordinate(34.05, -118.25),
+            finish=Coordinate(33.45, -112.07)
+        )
+
+        response = self.client.get('/api/route/plan/?start=Los Angeles, CA&finish=Phoenix, AZ')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('map', response.data)
+
+        map_response = self.client.get(response.data['map_path'])
+        self.assertEqual(map_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(map_response['Content-Type'], 'text/html')
+        self.assertIn(b'L.polyline', map_response.content)
+
+        response = self.client.get('/api/route/plan/?start=Los Angeles, CA&finish=Phoenix, AZ&include=map')
+        self.assertIn('map', response.data)
+
+    @patch('routing.services.geolocation.GeoLocationService.geocode')
+    @patch('routing.client.RoutingClient.get_route')
+    def test_map_is_rendered_from_the_cached_plan(self, mock_route, mock_geocode):
+        from django.core.cache import cache
+        from routing.data import Coordinate, RouteData
+        from routing.utils.map import get_map_cache_key
+
+        mock_geocode.return_value = Coordinate(latitude=34.05, longitude=-118.25)
+        mock_route.return_value = RouteData(
+            distance=100,
+            duration=120,
+            coordinates=[Coordinate(34.05, -118.25), Coordinate(33.8, -115.0), Coordinate(33.45, -112.07)],
+            start=Coordinate(34.05, -118.25),
+            finish=Coordinate(33.45, -112.07)
+        )
+
+        response = self.client.get('/api/route/plan/?start=Los Angeles, CA&finish=Phoenix, AZ')
+        plan_id = response.data['plan_id']
+        self.assertNotIn('_map_route', response.data)
+        self.assertIsNone(cache.get(get_map_cache_key(plan_id)))
+
+        # Maps are rendered from the geometry kept in the cached plan, without routing again
+        mock_route.reset_mock()
+        first = self.client.get(f'/api/route/{plan_id}/map/')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(cache.get(get_map_cache_key(plan_id)))
+
+        # A plan cache hit returns the same id, and the map can be rendered again once it was evicted
+        self.assertEqual(
+            self.client.get('/api/route/plan/?start=los angeles,  CA&finish=Phoenix, AZ').data['plan_id'], plan_id
+        )
+        cache.delete(get_map_cache_key(plan_id))
+        second = self.client.get(f'/api/route/{plan_id}/map/')
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.content, first.content)
+        mock_route.assert_not_called()
+
+    def test_unknown_plan_map(self):
+        response = self.client.get('/api/route/0123456789abcdef/map/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class AsyncPlanViewTest(TestCase):
+
+    def setUp(self):
+        tiered_cache.clear()
+
+    def test_plan_invalid_address_format(self):
+        response = self.client.get('/api/route/plan/async/?start=InvalidAddress&finish=Phoenix, AZ')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('routing.services.geolocation.AsyncGeoLocationService.ageocode', new_callable=AsyncMock)
+    @patch('routing.client.AsyncRoutingClient.get_route', new_callable=AsyncMock)
+    def test_plan_geocodes_both_endpoints(self, mock_route, mock_geocode):
+        from routing.data import Coordinate, RouteData
+
+        mock_geocode.return_value = Coordinate(latitude=34.05, longitude=-118.25)
+        mock_route.return_value = RouteData(
+            distance=100,
+            duration=120,
+            coordinates=[Coordinate(34.05, -118.25), Coordinate(33.45, -112.07)],
+            start=Coordinate(34.05, -118.25),
+            finish=Coordinate(33.45, -112.07)
+        )
+
+        response = self.client.post(
+            '/api/route/plan/async/', {'start': 'Los Angeles, CA', 'finish': 'Phoenix, AZ'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(mock_geocode.await_count, 2)
+
+    @patch('routing.services.geolocation.AsyncGeoLocationService.ageocode', new_callable=AsyncMock)
+    @patch('routing.client.AsyncRoutingClient.get_route', new_callable=AsyncMock)
+    def test_plan_no_route(self, mock_route, mock_geocode):
+        from routing.data import Coordinate
+
+        mock_geocode.return_value = Coordinate(latitude=34.05, longitude=-118.25)
+        mock_route.return_value = None
+
+        response = self.client.get('/api/route/plan/async/?start=Los Angeles, CA&finish=Phoenix, AZ')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RoutePlanBatchTest(TestCase):
+
+    def setUp(self):
+        tiered_cache.clear()
+        self.client = APIClient()
+
+    def test_batch_requires_routes(self):
+        response = self.client.post('/api/route/plan/batch/', {'routes': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('routing.services.plan.PlanService.build_plan')
+    @patch('routing.services.geolocation.GeoLocationService.geocode')
+    @patch('routing.client.RoutingClient.get_route')
+    def test_batch_deduplicates_and_keeps_input_order(self, mock_route, mock_geocode, mock_build):
+        from routing.data import Coordinate, RouteData
+
+        mock_geocode.side_effect = lambda location: {
+            'Los Angeles, CA': Coordinate(34.05, -118.25),
+            'Phoenix, AZ': Coordinate(33.45, -112.07),
+            'Tucson, AZ': Coordinate(32.22, -110.97),
+        }.get(location)
+        mock_route.return_value = RouteData(distance=100, coordinates=[Coordinate(34.05, -118.25)])
+        mock_build.side_effect = lambda **kwargs: {'start': {}, 'finish': {}, 'plan_id': kwargs['plan_id']}
+
+        routes = [
+            {'start': 'Los Angeles, CA', 'finish': 'Phoenix, AZ'},
+            {'start': 'InvalidAddress', 'finish': 'Phoenix, AZ'},
+            {'start': 'Phoenix, AZ', 'finish': 'Tucson, AZ'},
+            {'start': 'Los Angeles, CA', 'finish': 'Phoenix, AZ'},
+            {'start': 'Springfield, IL', 'finish': 'Phoenix, AZ'},
+        ]
+        response = self.client.post('/api/route/plan/batch/', {'routes': routes}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], [200, 400, 200, 200, 500])
+        self.assertEqual(results[2]['plan']['start'], {'name': 'Phoenix, AZ'})
+        self.assertEqual(results[2]['plan']['finish'], {'name': 'Tucson, AZ'})
+        self.assertEqual(results[0]['plan']['plan_id'], results[3]['plan']['plan_id'])
+        self.assertEqual(mock_geocode.call_count, 4)
+        self.assertEqual(mock_route.call_count, 2)
+
+
+class ReadinessViewTest(TestCase):
+
+    def setUp(self):
+        WarmUp.reset()
+        ClientRegistry.reset()
+        head = patch('requests.Session.head')
+        self.mock_head = head.start()
+        self.addCleanup(head.stop)
+
+    def tearDown(self):
+        WarmUp.reset()
+
+    def test_first_probe_warms_up_once(self):
+        with patch('routing.services.index.StationIndex.get') as mock_index:
+            response = self.client.get('/api/health/ready/')
+            self.assertEqual(self.client.get('/api/health/ready/').status_code, status.HTTP_200_OK)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.json()['warm_up_ms']), set(WarmUp.steps))
+        # The default corridor lookup never reads the station index
+        mock_index.assert_not_called()
+        self.mock_head.assert_called_once()
+        self.assertEqual(self.mock_head.call_args.args, ('https://router.project-osrm.org/route/v1/',))
+
+    def test_unreachable_upstream_does_not_fail_readiness(self):
+        self.mock_head.side_effect = ConnectionError('refused')
+
+        self.assertEqual(self.client.get('/api/health/ready/').status_code, status.HTTP_200_OK)
+
+    def test_not_ready_until_warm_up_succeeds(self):
+        with patch.dict(WarmUp.steps, {'station_index': MagicMock(side_effect=ConnectionError('down'))}):
+            response = self.client.get('/api/health/ready/')
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json(), {'ready': False, 'error': 'down'})
+        self.assertFalse(WarmUp.is_done())
+        self.assertEqual(self.client.get('/api/health/ready/').status_code, status.HTTP_200_OK)
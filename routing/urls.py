@@ -1,10 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RouteViewSet
+from .views import RouteViewSet, AsyncPlanView, ReadinessView
 
 router = DefaultRouter()
 router.register(r'route', RouteViewSet, basename='route')
 
 urlpatterns = [
+    path('route/plan/async/', AsyncPlanView.as_view(), name='route-plan-async'),
+    path('health/ready/', ReadinessView.as_view(), name='health-ready'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,441 @@
+import asyncio
+import math
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Tuple
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from routing.utils.geo import MILES_PER_DEGREE_LAT, degrees_for_miles, haversine_miles
+
+STATION_GENERATION_KEY = 'stations:generation'
+STATION_REVISION_KEY = 'stations:revision'
+
+CELL_SIZE = 1.0  # Invalidation grid cell size in degrees
+
+LOOKUP_CELLS_PER_RADIUS = 2  # Station lookup grid cells are half the search radius on a side
+LOOKUP_RADIUS_MARGIN = 1.01  # Covers the difference between PostGIS spheroid and haversine distances
+
+SINGLE_FLIGHT_POLL = 0.05  # Seconds between checks while waiting on another worker's computation
+
+# Deletes a lock only while it still holds the caller's token, in one step
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+Cell = Tuple[int, int]
+
+
+def _start_counter(key: str) -> int:
+    # Seeded from the clock, so a lost counter never restarts at a value that still has cached entries
+    cache.add(key, int(time.time()), timeout=None)
+    return cache.get(key)
+
+
+def _redis_client():
+    """The django-redis client behind the default cache, or None on other backends (tests, development)."""
+    client = getattr(cache, 'client', None)
+    return client if hasattr(client, 'get_client') else None
+
+
+def _start_counters(keys: List[str]) -> Dict[str, int]:
+    """``_start_counter`` for many keys, seeding them in one pipelined round trip on Redis."""
+    seed = int(time.time())
+    client = _redis_client()
+    if client is not None:
+        pipeline = client.get_client(write=True).pipeline(transaction=False)
+        for key in keys:
+            pipeline.set(client.make_key(key), client.encode(seed), nx=True)
+        pipeline.execute()
+    else:
+        for key in keys:
+            cache.add(key, seed, timeout=None)
+    return cache.get_many(keys)
+
+
+def _get_counter(key: str) -> int:
+    value = cache.get(key)
+    if value is None:
+        value = _start_counter(key)
+    return value
+
+
+def _bump_counter(key: str) -> int:
+    try:
+        return cache.incr(key)
+    except ValueError:
+        _start_counter(key)
+        return cache.incr(key)
+
+
+def get_station_generation() -> int:
+    """Current station data generation. Station caches include it in their keys."""
+    return _get_counter(STATION_GENERATION_KEY)
+
+
+def bump_station_generation() -> int:
+    """Start a new station data generation, orphaning every cached station lookup."""
+    _bump_counter(STATION_REVISION_KEY)
+    return _bump_counter(STATION_GENERATION_KEY)
+
+
+def get_station_revision() -> int:
+    """Counter bumped on every station data change, whole or per cell."""
+    return _get_counter(STATION_REVISION_KEY)
+
+
+def bump_station_revision() -> int:
+    """Make every process reload its station index without invalidating any cached lookup."""
+    return _bump_counter(STATION_REVISION_KEY)
+
+
+def cell_key(cell: Cell) -> str:
+    return f"stations:cell:{cell[0]}:{cell[1]}"
+
+
+def cell_for(lat: float, lon: float) -> Cell:
+    return math.floor(lat / CELL_SIZE), math.floor(lon / CELL_SIZE)
+
+
+def cells_near(lat: float, lon: float, miles: float) -> List[Cell]:
+    """Invalidation cells overlapping the bounding box of a radius around a point."""
+    lat_span, lon_span = degrees_for_miles(miles, lat)
+    row_lo, col_lo = cell_for(lat - lat_span, lon - lon_span)
+    row_hi, col_hi = cell_for(lat + lat_span, lon + lon_span)
+    return [(row, col) for row in range(row_lo, row_hi + 1) for col in range(col_lo, col_hi + 1)]
+
+
+def lookup_cell_for(lat: float, lon: float, miles: float) -> Cell:
+    """
+    Station lookup grid cell of a point, for a search radius of ``miles``.
+
+    Lookups are cached per lookup cell rather than per exact point, so nearby points of different
+    routes share one cache entry. Cells are ``miles / LOOKUP_CELLS_PER_RADIUS`` miles of latitude on a side.
+    """
+    size = miles / LOOKUP_CELLS_PER_RADIUS / MILES_PER_DEGREE_LAT
+    return math.floor(lat / size), math.floor(lon / size)
+
+
+def lookup_cell_area(cell: Cell, miles: float) -> Tuple[float, float, float]:
+    """
+    Center of a lookup cell and a radius around it holding every station within ``miles`` of any point in it.
+    :return: Returns (latitude, longitude, radius in miles).
+    """
+    size = miles / LOOKUP_CELLS_PER_RADIUS / MILES_PER_DEGREE_LAT
+    lat, lon = (cell[0] + 0.5) * size, (cell[1] + 0.5) * size
+    # The corners are the points of the cell farthest from its center
+    offsets = size * np.array([-.5, .5])
+    corners = haversine_miles(lat, lon, lat + offsets[:, None], lon + offsets[None, :])
+    return lat, lon, (miles + float(corners.max())) * LOOKUP_RADIUS_MARGIN
+
+
+def lookup_cells_near(lat: float, lon: float, miles: float) -> List[Cell]:
+    """Lookup cells whose search area (see ``lookup_cell_area``) can contain a station at the point."""
+    # Search areas barely vary between neighbouring cells; the margin covers the difference
+    radius = lookup_cell_area(lookup_cell_for(lat, lon, miles), miles)[2] * LOOKUP_RADIUS_MARGIN
+    lat_span, lon_span = degrees_for_miles(radius, lat)
+    row_lo, col_lo = lookup_cell_for(lat - lat_span, lon - lon_span, miles)
+    row_hi, col_hi = lookup_cell_for(lat + lat_span, lon + lon_span, miles)
+    return [(row, col) for row in range(row_lo, row_hi + 1) for col in range(col_lo, col_hi + 1)]
+
+
+def get_cell_versions(cells: Iterable[Cell]) -> List[int]:
+    """Current versions of invalidation cells, in the order given."""
+    keys = [cell_key(cell) for cell in cells]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        versions.update(_start_counters(missing))
+    return [versions[key] for key in keys]
+
+
+def bump_cells(cells: Iterable[Cell]) -> int:
+    """
+    Invalidate cached station lookups touching any of the cells.
+    :return: Returns the number of cells bumped.
+    """
+    cells = set(cells)
+    for cell in cells:
+        _bump_counter(cell_key(cell))
+    if cells:
+        _bump_counter(STATION_REVISION_KEY)
+    return len(cells)
+
+
+_MISSING = object()
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache with per-entry expiry and a total size budget in bytes.
+
+    Values are stored pickled, like Django's locmem backend, so callers never share mutable objects and
+    the size of every entry is exact. Least recently used entries are evicted once the budget is exceeded.
+    """
+
+    def __init__(self, *, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (expires_at, pickled value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str, default=_MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            data = entry[1]
+        return pickle.loads(data)
+
+    def set(self, key: str, value: Any, timeout: float):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + timeout, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class TieredCache:
+    """
+    Two-tier cache: a LocalCache in front of the shared Django (Redis) cache.
+
+    Reads try the local tier first and copy remote hits into it; writes and deletes go to both tiers.
+    Local copies live for at most ``local_timeout`` seconds and never past the timeout they were set
+    with, or for copies of remote hits, past the remote entry's TTL (on backends with ``ttl``, such as
+    django-redis). Only use it for keys whose value never changes under the same key: routes, geocodes, and
+    station lookups and plans, whose keys carry the generation and cell versions. Stale values then
+    cannot be served locally after the Redis entry is invalidated. Counters and locks must use the
+    shared cache directly.
+    """
+
+    def __init__(self, remote=cache, *, max_bytes: int = 64 * 1024 * 1024, local_timeout: float = 300):
+        self.remote = remote
+        self.local = LocalCache(max_bytes=max_bytes)
+        self.local_timeout = local_timeout
+        self._stats = {'local': {'hits': 0, 'misses': 0}, 'remote': {'hits': 0, 'misses': 0}}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, tier: str, outcome: str, count: int = 1):
+        if count:
+            with self._stats_lock:
+                self._stats[tier][outcome] += count
+
+    def _local_timeout(self, timeout) -> float:
+        return self.local_timeout if timeout is None else min(timeout, self.local_timeout)
+
+    def _copy_timeout(self, key: str) -> float:
+        """Timeout of the local copy of a remote hit, capped by the TTL left on the remote entry."""
+        ttl = getattr(self.remote, 'ttl', None)
+        return self.local_timeout if ttl is None else self._local_timeout(ttl(key))
+
+    def get(self, key: str, default=None):
+        value = self.local.get(key)
+        if value is not _MISSING:
+            self._count('local', 'hits')
+            return value
+        self._count('local', 'misses')
+
+        value = self.remote.get(key, _MISSING)
+        if value is _MISSING:
+            self._count('remote', 'misses')
+            return default
+        self._count('remote', 'hits')
+        self.local.set(key, value, self._copy_timeout(key))
+        return value
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        found, missing = {}, []
+        for key in keys:
+            value = self.local.get(key)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        self._count('local', 'hits', len(found))
+        self._count('local', 'misses', len(missing))
+
+        if missing:
+            remote = self.remote.get_many(missing)
+            self._count('remote', 'hits', len(remote))
+            self._count('remote', 'misses', len(missing) - len(remote))
+            for key, value in remote.items():
+                self.local.set(key, value, self._copy_timeout(key))
+            found.update(remote)
+        return found
+
+    def set(self, key: str, value: Any, timeout: float = None):
+        self.remote.set(key, value, timeout=timeout)
+        self.local.set(key, value, self._local_timeout(timeout))
+
+    def set_many(self, data: Dict[str, Any], timeout: float = None):
+        self.remote.set_many(data, timeout=timeout)
+        for key, value in data.items():
+            self.local.set(key, value, self._local_timeout(timeout))
+
+    def delete(self, key: str):
+        self.local.delete(key)
+        self.remote.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        self.remote.clear()
+
+    async def aget(self, key: str, default=None):
+        value = self.local.get(key)
+        if value is not _MISSING:
+            self._count('local', 'hits')
+            return value
+        self._count('local', 'misses')
+
+        value = await self.remote.aget(key, _MISSING)
+        if value is _MISSING:
+            self._count('remote', 'misses')
+            return default
+        self._count('remote', 'hits')
+        # Reading the TTL is a blocking Redis call
+        timeout = await sync_to_async(self._copy_timeout)(key) if hasattr(self.remote, 'ttl') else self.local_timeout
+        self.local.set(key, value, timeout)
+        return value
+
+    async def aset(self, key: str, value: Any, timeout: float = None):
+        await self.remote.aset(key, value, timeout=timeout)
+        self.local.set(key, value, self._local_timeout(timeout))
+
+    def stats(self) -> dict:
+        """Hit and miss counters per tier, plus the local tier's occupancy."""
+        with self._stats_lock:
+            stats = {tier: dict(counts) for tier, counts in self._stats.items()}
+        stats['local'].update(entries=len(self.local), bytes=self.local.size, max_bytes=self.local.max_bytes)
+        return stats
+
+
+tiered_cache = TieredCache(
+    max_bytes=int(os.getenv('LOCAL_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    local_timeout=float(os.getenv('LOCAL_CACHE_TIMEOUT', 300))
+)
+
+
+def release_lock(lock_key: str, token: str) -> bool:
+    """
+    Delete a ``cache.add`` lock if it still holds ``token``.
+
+    On Redis the check and the delete run as one script, so a lock that expired and was taken by another
+    worker in between is never deleted. Other backends are per process (tests, development) and are
+    checked, then deleted.
+    :return: Returns whether the lock was deleted.
+    """
+    client = _redis_client()
+    if client is not None:
+        redis = client.get_client(write=True)
+        return bool(redis.eval(RELEASE_LOCK_SCRIPT, 1, client.make_key(lock_key), client.encode(token)))
+
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+        return True
+    return False
+
+
+def single_flight(
+        key: str,
+        compute: Callable[[], Any],
+        *,
+        timeout: int,
+        lock_timeout: int = 30,
+        wait_timeout: float = 30
+) -> Any:
+    """
+    Return the cached value for ``key``, computing and caching it with ``compute`` on a miss.
+
+    Only one caller at a time computes a missing key. It holds a ``cache.add`` lock (``SET NX`` on Redis)
+    while concurrent callers poll for its result instead of computing it again. If the computing caller
+    fails, the lock is released and the next waiter takes over. A waiter gives up after ``wait_timeout``
+    seconds and computes the value itself.
+    """
+    value = tiered_cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key, token = f"lock:{key}", uuid.uuid4().hex
+    deadline = time.monotonic() + wait_timeout
+    while not cache.add(lock_key, token, timeout=lock_timeout):
+        if time.monotonic() >= deadline:
+            return compute()
+        time.sleep(SINGLE_FLIGHT_POLL)
+        value = tiered_cache.get(key)
+        if value is not None:
+            return value
+
+    try:
+        # Computed by the previous lock holder between our last check and acquiring the lock
+        value = tiered_cache.get(key)
+        if value is None:
+            value = compute()
+            tiered_cache.set(key, value, timeout=timeout)
+        return value
+    finally:
+        release_lock(lock_key, token)
+
+
+async def asingle_flight(
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        *,
+        timeout: int,
+        lock_timeout: int = 30,
+        wait_timeout: float = 30
+) -> Any:
+    """Async version of ``single_flight`` taking a coroutine function."""
+    value = await tiered_cache.aget(key)
+    if value is not None:
+        return value
+
+    lock_key, token = f"lock:{key}", uuid.uuid4().hex
+    deadline = time.monotonic() + wait_timeout
+    while not await cache.aadd(lock_key, token, timeout=lock_timeout):
+        if time.monotonic() >= deadline:
+            return await compute()
+        await asyncio.sleep(SINGLE_FLIGHT_POLL)
+        value = await tiered_cache.aget(key)
+        if value is not None:
+            return value
+
+    try:
+        value = await tiered_cache.aget(key)
+        if value is None:
+            value = await compute()
+            await tiered_cache.aset(key, value, timeout=timeout)
+        return value
+    finally:
+        await sync_to_async(release_lock)(lock_key, token)
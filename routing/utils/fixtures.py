@@ -0,0 +1,91 @@
+import csv
+import io
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+from django.core.management.color import no_style
+from django.db import connection
+
+# Columns of a binary station fixture, one array each in a compressed ``.npz`` file
+TEXT_COLUMNS = ('opis_id', 'name', 'address', 'city', 'state')
+COLUMNS = ('id', *TEXT_COLUMNS, 'rack_id', 'price', 'latitude', 'longitude')
+
+SELECT_STATIONS = """
+    SELECT id, opis_id, name, address, city, state, rack_id, price,
+        ST_Y(location::geometry), ST_X(location::geometry)
+    FROM {table}
+    ORDER BY id
+"""
+
+# CSV reads an unquoted empty field as NULL, so text columns force empty strings back to ''
+COPY_STATIONS = """
+    COPY {table} (id, opis_id, name, address, city, state, rack_id, price, location)
+    FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (opis_id, name, address, city, state))
+"""
+
+
+def read_station_columns(chunk_size: int = 2000) -> Dict[str, np.ndarray]:
+    """
+    Read every fuel station into one array per fixture column.
+
+    Rows are streamed from a server-side cursor ``chunk_size`` at a time and coordinates are selected as
+    plain numbers, so no model instances or geometry objects are built.
+    """
+    from routing.models import FuelStation
+    table = connection.ops.quote_name(FuelStation._meta.db_table)
+
+    values = {column: [] for column in COLUMNS}
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(SELECT_STATIONS.format(table=table))
+        while rows := cursor.fetchmany(chunk_size):
+            for column, column_values in zip(COLUMNS, zip(*rows)):
+                values[column].extend(column_values)
+
+    return {
+        'id': np.array(values['id'], dtype=np.int64),
+        **{column: np.array(values[column], dtype=str) for column in TEXT_COLUMNS},
+        'rack_id': np.array(values['rack_id'], dtype=np.int64),
+        'price': np.array(values['price'], dtype=np.float64),
+        'latitude': np.array(values['latitude'], dtype=np.float64),
+        'longitude': np.array(values['longitude'], dtype=np.float64),
+    }
+
+
+def write_station_fixture(path, columns: Dict[str, np.ndarray]):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **columns)
+
+
+def read_station_fixture(path) -> Dict[str, np.ndarray]:
+    with np.load(path) as fixture:
+        return {column: fixture[column] for column in COLUMNS}
+
+
+def copy_stations(columns: Dict[str, np.ndarray]) -> int:
+    """
+    Insert stations from fixture columns with a single COPY, keeping their ids.
+
+    Locations are sent as EWKT, which PostGIS parses on input. Run it in a transaction with an empty
+    station table.
+    :return: Returns the number of stations inserted.
+    """
+    from routing.models import FuelStation
+    table = connection.ops.quote_name(FuelStation._meta.db_table)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in zip(*(columns[column].tolist() for column in COLUMNS)):
+        *fields, latitude, longitude = row
+        writer.writerow([*fields, f"SRID=4326;POINT({longitude!r} {latitude!r})"])
+    buffer.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.copy_expert(COPY_STATIONS.format(table=table), buffer)
+        # Ids were copied as is, so move the id sequence past them
+        for sql in connection.ops.sequence_reset_sql(no_style(), [FuelStation]):
+            cursor.execute(sql)
+
+    return len(columns['id'])
@@ -0,0 +1,94 @@
+import numpy as np
+
+EARTH_RADIUS_MILES = 3959
+MILES_PER_DEGREE_LAT = 69.0
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Vectorized great-circle distance in miles.
+
+    Accepts scalars or numpy arrays (broadcast against each other) in degrees and uses the same
+    earth radius as ``Coordinate.distance_to``.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def degrees_for_miles(miles: float, latitude: float):
+    """Return the (lat, lon) span in degrees covered by ``miles`` around ``latitude``."""
+    lat_span = miles / MILES_PER_DEGREE_LAT
+    cos_lat = max(np.cos(np.radians(min(abs(latitude) + lat_span, 89.0))), 1e-6)
+    return lat_span, lat_span / cos_lat
+
+
+# WGS84 ellipsoid
+WGS84_A_MILES = 6378137.0 / 1609.344
+WGS84_E2 = 6.69437999014e-3
+
+
+def segment_lengths_miles(latitudes, longitudes):
+    """
+    Vectorized lengths in miles of the segments between consecutive points of a polyline.
+
+    Each segment is measured on the local tangent plane of the WGS84 ellipsoid at its mid latitude
+    (meridional and prime-vertical radii of curvature). For road polylines, whose segments are at most
+    a few miles long, this agrees with ``geopy.distance.geodesic`` to better than 1e-6 relative error,
+    and stays within 1e-4 for segments up to ~100 miles.
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+
+    mid_lat = (lat[1:] + lat[:-1]) / 2
+    sin2 = np.sin(mid_lat) ** 2
+    w = np.sqrt(1 - WGS84_E2 * sin2)
+    meridional = WGS84_A_MILES * (1 - WGS84_E2) / w ** 3
+    prime_vertical = WGS84_A_MILES / w
+
+    north = meridional * np.diff(lat)
+    east = prime_vertical * np.cos(mid_lat) * np.diff(lon)
+    return np.hypot(north, east)
+
+
+def douglas_peucker(latitudes, longitudes, tolerance: float) -> np.ndarray:
+    """
+    Douglas-Peucker polyline simplification.
+
+    Works on an equirectangular projection around the mean latitude, so ``tolerance`` is in degrees of
+    latitude. Each split computes the distances of all points in its span in one vectorized call.
+    :return: Returns a boolean mask of the points to keep (always including both ends).
+    """
+    lat = np.asarray(latitudes, dtype=np.float64)
+    lon = np.asarray(longitudes, dtype=np.float64)
+    keep = np.zeros(len(lat), dtype=bool)
+    if len(lat) < 3:
+        keep[:] = True
+        return keep
+
+    x = lon * np.cos(np.radians(lat.mean()))
+    y = lat
+    keep[0] = keep[-1] = True
+
+    stack = [(0, len(lat) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(px * dy - py * dx) / length
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return keep
@@ -1,25 +1,61 @@
 import re
 import base64
+import dataclasses
+from django.core.cache import cache
 from django.template.loader import render_to_string
 import json
-from typing import List
+from typing import List, Optional
 from routing.data import Coordinate, FuelStop, RouteData
 
+MAP_PIXELS = 1024  # Rendered map width the geometry is simplified for
+MAP_CACHE_TIMEOUT = 86400
 
-def generate_map_html(route:RouteData, stops:List[FuelStop]):
-    """Generate embeddable Leaflet.js map HTML using Django template"""
 
-    route_coords = [[coord.latitude, coord.longitude] for coord in route.coordinates]
-    
+def simplify_route(route:RouteData, pixels:int = MAP_PIXELS) -> RouteData:
+    """
+    Simplify the route geometry so no removed point is more than one pixel off the line when the whole
+    route is fit into a map ``pixels`` wide.
+    """
+    geometry = route.coordinates
+    if len(geometry) < 3:
+        return route
+
+    extent = max(
+        float(geometry.latitudes.max() - geometry.latitudes.min()),
+        float(geometry.longitudes.max() - geometry.longitudes.min())
+    )
+    return dataclasses.replace(route, coordinates=geometry.simplify(extent / pixels))
+
+
+def render_map_html(route:RouteData, stops:List[FuelStop]) -> str:
+    """Render Leaflet.js map HTML for the route, already simplified with ``simplify_route``, and its stops."""
     context = {
-        'route_coords': json.dumps(route_coords),
+        'route_coords': json.dumps(route.coordinates.tolist()),
         'route': route,
         'stops': stops
     }
-    
+
     html = render_to_string('routing/map.html', context)
-    minified_html = re.sub(r'\s+', ' ', html).strip()
-    return base64.b64encode(minified_html.encode()).decode()
+    return re.sub(r'\s+', ' ', html).strip()
+
+
+def generate_map_html(route:RouteData, stops:List[FuelStop]):
+    """Generate embeddable Leaflet.js map HTML using Django template, for a route simplified with ``simplify_route``"""
+    return base64.b64encode(render_map_html(route, stops).encode()).decode()
+
+
+def get_map_cache_key(plan_id:str) -> str:
+    return f"plan_map:{plan_id}"
+
+
+def cache_map_html(plan_id:str, html:str):
+    """Keep the rendered map of a plan for the map endpoint."""
+    cache.set(get_map_cache_key(plan_id), html, timeout=MAP_CACHE_TIMEOUT)
+
+
+def get_cached_map_html(plan_id:str) -> Optional[str]:
+    """The rendered map of a plan, or None if it was not rendered yet or expired."""
+    return cache.get(get_map_cache_key(plan_id))
 
 
 
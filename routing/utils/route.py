@@ -1,17 +1,37 @@
 from typing import List
+from django.urls import reverse
 from routing.data import FuelStop, RouteData
 from routing.utils.map import generate_map_url, generate_map_html
 
 
-def make_response(*, route:RouteData, fuel_stops:List[FuelStop], total_cost:float, total_gallons:float, message=None):
-    """Create a response dictionary for the API."""
-    return {
+def make_response(
+        *,
+        route:RouteData,
+        fuel_stops:List[FuelStop],
+        total_cost:float,
+        total_gallons:float,
+        message=None,
+        plan_id:str = None,
+        map_route:RouteData = None
+):
+    """
+    Create a response dictionary for the API.
+
+    The embedded base64 map HTML is only included when given ``map_route``, the route simplified with
+    ``simplify_route``; otherwise clients can load it from the plan's map endpoint.
+    """
+    response = {
         'total_distance': route.distance,
         'stops': [stop.as_dict for stop in fuel_stops],
         'total_cost': total_cost,
         'total_gallons': total_gallons,
         'map_url': generate_map_url(start=route.start, end=route.finish, stops=fuel_stops),
-        'map': generate_map_html(route=route, stops=fuel_stops),
         # 'route': route.geometry,
         'message': message
-    }
\ No newline at end of file
+    }
+    if plan_id:
+        response['plan_id'] = plan_id
+        response['map_path'] = reverse('route-map', args=[plan_id])
+    if map_route is not None:
+        response['map'] = generate_map_html(route=map_route, stops=fuel_stops)
+    return response
\ No newline at end of file
@@ -0,0 +1,132 @@
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds, from a cache hit to a slow upstream call
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus text exposition format, one series per label combination.
+
+    Held in memory per worker process, like the cache and upstream counters.
+    """
+
+    def __init__(self, name: str, documentation: str, *, labels: Tuple[str, ...], buckets=STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts, then the sum and count of all observations
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for key, values in series:
+            labels = ','.join(f'{label}="{value}"' for label, value in zip(self.labels, key))
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {values[-2]}')
+            lines.append(f'{self.name}_count{{{labels}}} {values[-1]}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+
+STAGE_SECONDS = Histogram(
+    'route_planner_stage_duration_seconds', 'Time spent in each stage of planning a route.', labels=('stage', 'cache')
+)
+
+
+class Stage:
+    """One timed stage. ``cache`` is 'hit' or 'miss' when the stage was served from or filled a cache."""
+
+    __slots__ = ('name', 'duration', 'cache')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.duration = 0.0
+        self.cache = None
+
+
+class Timings:
+    """Stages recorded while handling one request, rendered as a ``Server-Timing`` header."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: List[Stage] = []
+
+    def header(self) -> str:
+        entries = []
+        for stage in list(self.stages):
+            entry = f'{stage.name};dur={stage.duration * 1000:.1f}'
+            if stage.cache:
+                entry += f';desc="cache {stage.cache}"'
+            entries.append(entry)
+        entries.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(entries)
+
+
+# Context variables, so concurrent requests and the tasks of one async request keep their own stages
+_timings: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar('timings', default=None)
+_running: contextvars.ContextVar[Tuple[Stage, ...]] = contextvars.ContextVar('running_stages', default=())
+
+
+@contextlib.contextmanager
+def record_timings() -> Iterator[Timings]:
+    """Collect the stages timed inside the block, see ``ServerTimingMiddleware``."""
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[Stage]:
+    """
+    Time a stage of the current request and add it to the stage duration histogram.
+
+    Stages can nest; ``record_cache`` marks the innermost one.
+    """
+    current = Stage(name)
+    token = _running.set(_running.get() + (current,))
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - started
+        _running.reset(token)
+        STAGE_SECONDS.observe(current.duration, stage=name, cache=current.cache or 'none')
+        timings = _timings.get()
+        if timings is not None:
+            timings.stages.append(current)
+
+
+def record_cache(hit: bool):
+    """Mark the innermost running stage as a cache hit or miss. Does nothing outside a stage."""
+    running = _running.get()
+    if running:
+        running[-1].cache = 'hit' if hit else 'miss'
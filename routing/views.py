@@ -1,23 +1,30 @@
+import json
 import logging
-import hashlib
-from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.exceptions import ValidationError
 from rest_framework.viewsets import ViewSet
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
 
-from .client import RoutingClient
-from .serializers import RouteRequestSerializer
-from routing.services.route import RouteService
-from .services.geolocation import GeoLocationService
-from .services.station import StationService
-from routing.utils.route import make_response
-from routing.data import SamplePoint
+from common.client import ClientRegistry
+from .serializers import RouteRequestSerializer, BatchRouteRequestSerializer
+from .services.plan import PlanService, AsyncPlanService, RouteNotFoundError
+from .services.warmup import WarmUp
+from .utils.cache import tiered_cache
+from .utils.timing import STAGE_SECONDS
 
 logger = logging.getLogger(__name__)
 
 
+def wants_map(params) -> bool:
+    """Whether ``?include=map`` asked for the embedded map HTML."""
+    return 'map' in params.get('include', '').split(',')
+
+
 class RouteViewSet(ViewSet):
     serializer_class = RouteRequestSerializer
 
@@ -25,7 +32,14 @@ class RouteViewSet(ViewSet):
         return Response({
             'message': 'Route Planning API',
             'endpoints': {
-                'plan': '/api/route/plan/ - Plan a route with fuel stops (GET/POST)'
+                'plan': '/api/route/plan/ - Plan a route with fuel stops (GET/POST, ?include=map to embed the map)',
+                'map': '/api/route/<plan_id>/map/ - Map HTML of a planned route (GET)',
+                'plan_async': '/api/route/plan/async/ - Async variant of plan for ASGI deployments (GET/POST)',
+                'plan_batch': '/api/route/plan/batch/ - Plan many start/finish lanes in one request (POST)',
+                'cache_stats': '/api/route/cache/stats/ - Hit and miss counters per cache tier for this worker (GET)',
+                'upstream_stats': '/api/route/upstream/stats/ - Upstream connection reuse for this worker (GET)',
+                'ready': '/api/health/ready/ - Readiness probe, warms the worker up on its first call (GET)',
+                'metrics': '/metrics - Prometheus histograms of plan stage durations for this worker (GET)'
             }
         })
 
@@ -40,55 +54,138 @@ class RouteViewSet(ViewSet):
             finish = serializer.validated_data['finish']
             logger.info(f"Planning route: {start} to {finish}")
 
-            geolocation = GeoLocationService()
+            response = PlanService().plan(start=start, finish=finish, include_map=wants_map(request.query_params))
 
-            client = RoutingClient()
+            return Response(response)
 
-            start_location = geolocation.geocode(start)
-            finish_location = geolocation.geocode(finish)
+        except RouteNotFoundError:
+            return Response({'error': 'No route found'}, status=status.HTTP_404_NOT_FOUND)
 
-            # Get route data
-            route = client.get_route(
-                from_location=start_location,
-                to_location=finish_location
-            )
-            if not route:
-                return Response({'error': 'No route found'}, status=status.HTTP_404_NOT_FOUND)
-
-            # Get sample stop points with caching
-            cache_key = f"route_points:{hashlib.md5(f'{start}:{finish}'.encode()).hexdigest()}"
-            route_points = cache.get(cache_key)
-            
-            if not route_points:
-                route_points = StationService.get_sample_points_along_route(
-                    with_coordinates=route.coordinates
-                )
-                cache.set(cache_key, [p.__dict__ for p in route_points], timeout=3600)
+        except ValidationError as e:
+            logger.warning(f"Validation error: {e.detail}")
+            return Response({'error': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            logger.error(f"Error planning route: {str(e)}", exc_info=True)
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=['post'], url_path='plan/batch')
+    def plan_batch(self, request):
+        logger.info(f"{request.method} batch request from {request.META.get('REMOTE_ADDR')}")
+        serializer = BatchRouteRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            logger.warning(f"Validation error: {serializer.errors}")
+            return Response({'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        items = serializer.validated_data['routes']
+        lanes = []
+        results = [None] * len(items)
+        for i, item in enumerate(items):
+            item_serializer = self.serializer_class(data=item)
+            if item_serializer.is_valid():
+                lanes.append((i, item_serializer.validated_data['start'], item_serializer.validated_data['finish']))
             else:
-                route_points = [SamplePoint(**p) for p in route_points]
+                results[i] = {'status': status.HTTP_400_BAD_REQUEST, 'error': item_serializer.errors}
 
-            route_service = RouteService()
-            result = route_service.get_optimized_stops_for_route(
-                with_points=route_points,
-                total_distance=route.distance
-            )
-            logger.info(f"Route planned successfully: {route.distance} miles")
+        logger.info(f"Planning batch of {len(items)} routes ({len(lanes)} valid)")
+        try:
+            planned = PlanService().plan_batch([(start, finish) for _, start, finish in lanes])
+        except Exception as e:
+            logger.error(f"Error planning batch: {str(e)}", exc_info=True)
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            response = make_response(
-                route=route, fuel_stops=result.stops, total_cost=result.cost,
-                                     total_gallons=result.gallons, message="Successful"
-            )
-            response.update({
-                'start': {'lat': start_location.latitude, 'lon': start_location.longitude, 'name': start},
-                'finish': {'lat': finish_location.latitude, 'lon': finish_location.longitude, 'name': finish},
-            })
+        for (i, _, _), result in zip(lanes, planned):
+            results[i] = result
 
-            return Response(response)
+        return Response({'results': results, 'message': 'Successful'})
 
-        except ValidationError as e:
-            logger.warning(f"Validation error: {e.detail}")
-            return Response({'error': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=['get'], url_path='cache/stats')
+    def cache_stats(self, request):
+        return Response(tiered_cache.stats())
+
+    @action(detail=False, methods=['get'], url_path='upstream/stats')
+    def upstream_stats(self, request):
+        return Response(ClientRegistry.stats())
+
+    @action(detail=True, methods=['get'])
+    def map(self, request, pk=None):
+        html = PlanService().get_map_html(pk)
+        if html is None:
+            return Response({'error': 'Map not found'}, status=status.HTTP_404_NOT_FOUND)
+        return HttpResponse(html, content_type='text/html')
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPlanView(View):
+    """
+    Async variant of ``RouteViewSet.plan``.
+
+    Serve it with an ASGI server (``main.asgi``) so that in-flight plans share the worker's event loop and
+    its pooled upstream connections instead of holding a thread each.
+    """
+    serializer_class = RouteRequestSerializer
+
+    async def get(self, request):
+        return await self.plan(request, request.GET)
+
+    async def post(self, request):
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            data = request.POST
+        return await self.plan(request, data)
+
+    async def plan(self, request, data):
+        logger.info(f"{request.method} async request from {request.META.get('REMOTE_ADDR')}")
+        serializer = self.serializer_class(data=data)
+        if not serializer.is_valid():
+            logger.warning(f"Validation error: {serializer.errors}")
+            return JsonResponse({'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        start = serializer.validated_data['start']
+        finish = serializer.validated_data['finish']
+        logger.info(f"Planning route: {start} to {finish}")
+
+        try:
+            response = await AsyncPlanService().aplan(
+                start=start, finish=finish, include_map=wants_map(request.GET)
+            )
+            return JsonResponse(response)
+
+        except RouteNotFoundError:
+            return JsonResponse({'error': 'No route found'}, status=status.HTTP_404_NOT_FOUND)
 
         except Exception as e:
             logger.error(f"Error planning route: {str(e)}", exc_info=True)
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ReadinessView(View):
+    """
+    Readiness probe: 503 until this worker has warmed up (see ``WarmUp``), 200 with the warm-up timings after.
+
+    The first probe runs the warm-up, so a worker only receives traffic once its first plan will be fast.
+    """
+
+    def get(self, request):
+        try:
+            timings = WarmUp.run()
+        except Exception as e:
+            logger.warning(f"Warm-up failed: {str(e)}", exc_info=True)
+            return JsonResponse({'ready': False, 'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return JsonResponse({'ready': True, 'warm_up_ms': timings})
+
+
+class MetricsView(View):
+    """
+    Prometheus scrape endpoint with this worker's plan stage duration histograms, labelled by stage and by
+    whether the stage was a cache hit or miss.
+    """
+
+    def get(self, request):
+        return HttpResponse(
+            '\n'.join(STAGE_SECONDS.render()) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8'
+        )